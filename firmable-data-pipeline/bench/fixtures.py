@@ -0,0 +1,290 @@
+"""
+Synthetic inputs for the tests and benchmarks, all generated offline:
+
+- ABR bulk-extract XML in the register's schema (`write_abr_xml`)
+- gzip-member WARC files plus a matching CDX index (`build_warc`, `warc_corpus`)
+- a local HTTP server for both, with Range support and injectable latency
+  (`RangeServer`, `serve`)
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+STATES = ["NSW", "VIC", "QLD", "WA", "SA", "TAS", "ACT", "NT"]
+WORDS = ("acme plumbing harbour dental roofing cafe services sydney melbourne quality local family "
+         "coastal electrical legal accounting bakery motors fitness garden print studio").split()
+GIVEN_NAMES = ["JANE", "JOHN", "MARIA", "WEI", "PRIYA", "LIAM", "OLIVIA", "NOAH"]
+FAMILY_NAMES = ["CITIZEN", "SMITH", "NGUYEN", "PATEL", "BROWN", "WILSON", "TAYLOR", "LEE"]
+CDX_PAGE_SIZE = 1000
+
+
+class RangeServer(ThreadingHTTPServer):
+    """
+    Local keep-alive HTTP server for `files` (path -> bytes) with Range support.
+
+    `/cdx` acts as a stub CDX index over `cdx_pages` (a list of pages, each a
+    list of record dicts), answering `showNumPages` and `page` queries. Pages
+    in `failing_cdx_pages` always answer 503, and those in `slow_cdx_pages`
+    (page -> seconds) answer after that delay.
+
+    Files are served with a content-hash ETag, and HEAD and If-Range are
+    honoured. `fail_next` makes the next N requests answer 503, `drop_next`
+    makes the next N file responses stop halfway through the body and close
+    the connection, and `latency` delays every response. Records the peer of
+    every request and the peak number of requests handled concurrently.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, files: dict):
+        super().__init__(("127.0.0.1", 0), _RangeHandler)
+        self.files = files
+        self.cdx_pages = []
+        self.failing_cdx_pages = set()
+        self.slow_cdx_pages = {}
+        self.fail_next = 0
+        self.drop_next = 0
+        self.latency = 0.0
+        self.requests = []
+        self.active = 0
+        self.peak_active = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        body = self.server.files.get(self.path.lstrip("/"))
+        if body is None:
+            self._reply(404, b"", head=True)
+            return
+        self._reply(200, body, {"ETag": _etag(body), "Accept-Ranges": "bytes"}, head=True)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.client_address, self.path, self.headers.get("Range")))
+            server.active += 1
+            server.peak_active = max(server.peak_active, server.active)
+            fail = server.fail_next > 0
+            server.fail_next -= fail
+        try:
+            time.sleep(server.latency)
+            if fail:
+                self._reply(503, b"")
+                return
+            if self.path.startswith("/cdx"):
+                self._reply_cdx()
+                return
+            body = server.files.get(self.path.lstrip("/"))
+            if body is None:
+                self._reply(404, b"")
+                return
+            headers = {"ETag": _etag(body), "Accept-Ranges": "bytes"}
+            with server.lock:
+                drop = server.drop_next > 0
+                server.drop_next -= drop
+            match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+            if_range = self.headers.get("If-Range")
+            if not match or (if_range and if_range != headers["ETag"]):
+                self._reply(200, body, headers, drop=drop)
+                return
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(body) - 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+            self._reply(206, body[start:end + 1], headers, drop=drop)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _reply_cdx(self):
+        query = parse_qs(urlparse(self.path).query)
+        pages = self.server.cdx_pages
+        if "showNumPages" in query:
+            self._reply(200, json.dumps({"pages": len(pages), "pageSize": 5, "blocks": 10}).encode())
+            return
+        page = int(query.get("page", ["0"])[0])
+        time.sleep(self.server.slow_cdx_pages.get(page, 0))
+        if page in self.server.failing_cdx_pages:
+            self._reply(503, b"")
+            return
+        if page >= len(pages):
+            self._reply(400, b"")
+            return
+        self._reply(200, "\n".join(json.dumps(r) for r in pages[page]).encode())
+
+    def _reply(self, status, body, headers=None, head=False, drop=False):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if head:
+            return
+        if drop:
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+def _etag(body: bytes) -> str:
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+@contextmanager
+def serve(files: dict = None, cdx_pages: list = None, latency: float = 0.0):
+    """Runs a RangeServer in a background thread for the duration of the block."""
+    server = RangeServer(files if files is not None else {})
+    server.cdx_pages = cdx_pages or []
+    server.latency = latency
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def build_warc(pages: list[tuple[str, bytes]]) -> tuple[bytes, list[dict]]:
+    """
+    Writes one gzip member per HTML response and returns the WARC bytes plus
+    CDX-like entries (url, offset, length, digest) for each page.
+    """
+    out = BytesIO()
+    writer = WARCWriter(out, gzip=True)
+    entries = []
+    for i, (url, html) in enumerate(pages):
+        offset = out.tell()
+        http_headers = StatusAndHeaders("200 OK", [("Content-Type", "text/html")], protocol="HTTP/1.1")
+        record = writer.create_warc_record(url, "response", payload=BytesIO(html), http_headers=http_headers)
+        writer.write_record(record)
+        entries.append({
+            "url": url,
+            "offset": offset,
+            "length": out.tell() - offset,
+            "digest": f"DIGEST{i}",
+            "timestamp": "20250315000000",
+        })
+    return out.getvalue(), entries
+
+
+def _company_name(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS).upper() for _ in range(rng.randint(1, 3)))
+
+
+def abr_record_xml(i: int, rng: random.Random) -> str:
+    """One <ABR> element: a company (with trading name, ASIC number and GST) or a sole trader."""
+    abn = 10_000_000_000 + i
+    updated = f"20{rng.randint(10, 24):02d}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+    address = (f"<BusinessAddress><AddressDetails><State>{rng.choice(STATES)}</State>"
+               f"<Postcode>{rng.randint(800, 7999):04d}</Postcode></AddressDetails></BusinessAddress>")
+    status = "ACT" if rng.random() < 0.8 else "CAN"
+    if i % 3:
+        name = f"{_company_name(rng)} {i} PTY LTD"
+        return (
+            f'<ABR recordLastUpdatedDate="{updated}" replaced="N">'
+            f'<ABN status="{status}" ABNStatusFromDate="20000101">{abn}</ABN>'
+            "<EntityType><EntityTypeInd>PRV</EntityTypeInd>"
+            "<EntityTypeText>Australian Private Company</EntityTypeText></EntityType>"
+            f'<MainEntity><NonIndividualName type="MN"><NonIndividualNameText>{name}</NonIndividualNameText>'
+            f"</NonIndividualName>{address}</MainEntity>"
+            f'<ASICNumber ASICNumberType="undetermined">{abn % 1_000_000_000:09d}</ASICNumber>'
+            '<GST status="ACT" GSTStatusFromDate="20000701" />'
+            f'<OtherEntity><NonIndividualName type="TRD"><NonIndividualNameText>{_company_name(rng)}'
+            "</NonIndividualNameText></NonIndividualName></OtherEntity>"
+            "</ABR>"
+        )
+    return (
+        f'<ABR recordLastUpdatedDate="{updated}" replaced="N">'
+        f'<ABN status="{status}" ABNStatusFromDate="20100202">{abn}</ABN>'
+        "<EntityType><EntityTypeInd>IND</EntityTypeInd><EntityTypeText>Individual/Sole Trader</EntityTypeText></EntityType>"
+        f'<LegalEntity><IndividualName type="LGL"><NameTitle>MS</NameTitle><GivenName>{rng.choice(GIVEN_NAMES)}</GivenName>'
+        f"<FamilyName>{rng.choice(FAMILY_NAMES)}</FamilyName></IndividualName>{address}</LegalEntity>"
+        '<GST status="NON" GSTStatusFromDate="19000101" />'
+        "</ABR>"
+    )
+
+
+def write_abr_xml(path: Path, records: int, seed: int = 0) -> Path:
+    """Writes an ABR bulk-extract XML file of `records` records, streaming it to disk."""
+    rng = random.Random(seed)
+    path = Path(path)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?><Transfer><ABR_Extract>')
+        for i in range(records):
+            f.write(abr_record_xml(i, rng))
+        f.write("</ABR_Extract></Transfer>")
+    return path
+
+
+def site_page(i: int, rng: random.Random, paragraphs: int = 40) -> bytes:
+    """
+    A company home page. Most name the company in the <head> (og:site_name
+    or <title>); every fifth only in a body <h1>, so it takes a full parse.
+    """
+    name = f"{_company_name(rng).title()} {i}"
+    body = "".join(f"<p>{' '.join(rng.choice(WORDS) for _ in range(40))}</p>" for _ in range(paragraphs))
+    if i % 5 == 0:
+        head = "<title>Home</title>"
+    elif i % 2:
+        head = f"<title>Welcome</title><meta property='og:site_name' content='{name}'>"
+    else:
+        head = f"<title>{name} | Home</title>"
+    return (
+        f"<!DOCTYPE html><html><head><meta charset='utf-8'>{head}<link rel='stylesheet' href='/s.css'></head>"
+        f"<body><h1>{name}</h1>{body}<footer>© 2024 {name} Pty Ltd</footer></body></html>"
+    ).encode()
+
+
+def warc_corpus(pages: int, files: int = 4, seed: int = 0, paragraphs: int = 40, filler: int = 1,
+                page_size: int = CDX_PAGE_SIZE) -> tuple[dict, list[list[dict]]]:
+    """
+    `pages` pages (one per domain) spread over `files` WARC files, each
+    followed by `filler` pages of other sites that the index doesn't list,
+    so fragments aren't contiguous as they rarely are in a real crawl.
+    Returns (files, cdx_pages): WARC bytes by path, and CDX index records
+    (as the Common Crawl index returns them) in pages of `page_size`,
+    sorted by URL key as a real index is.
+    """
+    rng = random.Random(seed)
+    warc_files, records = {}, []
+    for n in range(files):
+        path = f"crawl-data/CC-MAIN-2025-13/segments/bench/warc/bench-{n:05d}.warc.gz"
+        contents = []
+        for i in range(n, pages, files):
+            contents.append((f"https://site{i}.com.au/", site_page(i, rng, paragraphs)))
+            contents += [(f"https://other{i}-{j}.example/", site_page(i, rng, paragraphs)) for j in range(filler)]
+        warc, entries = build_warc(contents)
+        warc_files[path] = warc
+        for entry in entries[::filler + 1]:
+            records.append({
+                "urlkey": f"au,com,{urlparse(entry['url']).netloc.split('.')[0]})/",
+                "timestamp": entry["timestamp"], "url": entry["url"], "mime": "text/html",
+                "mime-detected": "text/html", "status": "200",
+                "digest": hashlib.sha1(entry["url"].encode()).hexdigest().upper(),
+                "length": str(entry["length"]), "offset": str(entry["offset"]), "filename": path,
+                "languages": "eng", "encoding": "UTF-8",
+            })
+    records.sort(key=lambda r: r["urlkey"])
+    return warc_files, [records[i:i + page_size] for i in range(0, len(records), page_size)]
@@ -0,0 +1,92 @@
+"""
+Per-page parse-time benchmark for company-name extraction.
+
+Compares the previous full-document path (BeautifulSoup over the whole page,
+get_text, extract_company_name_from_html) with the head-first path in
+extract_company_fields, with and without keeping the page text.
+
+    python -m bench.html_extract --pages 300
+"""
+import argparse
+import glob
+import json
+import random
+import statistics
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from extract.common_crawl_extractor import extract_company_fields, extract_company_name_from_html
+
+FIXTURES = Path(__file__).resolve().parent.parent / "tests" / "fixtures" / "html"
+WORDS = "acme plumbing harbour dental roofing cafe services sydney melbourne quality local family".split()
+
+
+def synthetic_page(i: int, rng: random.Random, paragraphs: int = 200) -> bytes:
+    name = " ".join(rng.choice(WORDS).title() for _ in range(2))
+    body = "".join(
+        f"<div class='row'><p>{' '.join(rng.choice(WORDS) for _ in range(40))}</p><a href='/p{j}'>more</a></div>"
+        for j in range(paragraphs)
+    )
+    return (
+        f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>Home - {name} {i}</title>"
+        f"<meta property='og:site_name' content='{name} {i}'><link rel='stylesheet' href='/s.css'>"
+        f"<script>var x = {i};</script></head><body><h1>{name}</h1>{body}"
+        f"<footer>© 2024 {name} Pty Ltd. All rights reserved</footer></body></html>"
+    ).encode()
+
+
+def legacy_fields(payload: bytes):
+    soup = BeautifulSoup(payload, "html.parser")
+    text_content = soup.get_text()
+    text_content = soup.get_text()
+    title_tag = soup.title.string.strip() if soup.title and soup.title.string else None
+    return extract_company_name_from_html(soup, text_content), title_tag, text_content
+
+
+def time_per_page(fn, corpus) -> list[float]:
+    timings = []
+    for payload in corpus:
+        started = time.perf_counter()
+        fn(payload)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def summarize(timings: list[float]) -> dict:
+    timings = sorted(timings)
+    return {
+        "pages": len(timings),
+        "mean_ms": round(statistics.mean(timings), 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+        "pages_per_sec": round(1000 * len(timings) / sum(timings), 1),
+    }
+
+
+def run(pages: int = 300, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    corpus = [Path(p).read_bytes() for p in sorted(glob.glob(str(FIXTURES / "*.html")))]
+    corpus += [synthetic_page(i, rng) for i in range(pages)]
+
+    mismatches = [
+        i for i, payload in enumerate(corpus)
+        if extract_company_fields(payload, keep_text=True)[:2] != legacy_fields(payload)[:2]
+    ]
+    return {
+        "benchmark": "html_extract",
+        "corpus_pages": len(corpus),
+        "mismatches": len(mismatches),
+        "legacy_full_parse": summarize(time_per_page(legacy_fields, corpus)),
+        "head_first_keep_text": summarize(time_per_page(lambda p: extract_company_fields(p, True), corpus)),
+        "head_first_no_text": summarize(time_per_page(lambda p: extract_company_fields(p, False), corpus)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark company-name extraction per page")
+    parser.add_argument("--pages", type=int, default=300, help="Number of synthetic pages added to the fixture corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(run(args.pages, args.seed), indent=2))
@@ -0,0 +1,113 @@
+"""
+Recall and speed of the tfidf match engine against the fuzzy engine
+(token-blocked token_set_ratio, the reference) on generated name pairs.
+
+Crawl names are noisy copies of ABR names (typos, dropped, added or
+reordered words) plus names with no ABR counterpart. recall is the share
+of the reference's matches that an engine also makes, with the same ABN
+or an equally scored one; extra_matches are matches the reference does
+not make.
+
+    python -m bench.match_recall --abr-rows 50000 --crawl-rows 5000
+"""
+import argparse
+import json
+import random
+import time
+
+from bench.fixtures import WORDS
+from matcher.em import ABRIndex
+from matcher.tfidf import TOP_K, TfidfIndex
+
+SYLLABLES = "ka lo mi ra te vo zu ni pe sa do gi".split()
+
+
+def _coined(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def _typo(word: str, rng: random.Random) -> str:
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:] if rng.random() < 0.5 else word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def _variant(name: str, rng: random.Random) -> str:
+    words = name.split()
+    kind = rng.randrange(5)
+    if kind == 1:
+        words[rng.randrange(len(words))] = _typo(words[rng.randrange(len(words))], rng)
+    elif kind == 2 and len(words) > 2:
+        words.pop(rng.randrange(len(words)))
+    elif kind == 3:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(WORDS))
+    elif kind == 4:
+        rng.shuffle(words)
+    return " ".join(words)
+
+
+def matching_fixture(abr_rows: int, crawl_rows: int, unmatched: float = 0.2, seed: int = 0):
+    """(abn, entity_name, normalized_name, state, postcode) ABR rows and crawl normalized names."""
+    rng = random.Random(seed)
+    abr = []
+    for i in range(abr_rows):
+        name = " ".join([_coined(rng)] + [rng.choice(WORDS) for _ in range(rng.randint(1, 3))])
+        abr.append((f"{10_000_000_000 + i}", f"{name.upper()} PTY LTD", name, None, None))
+    crawl = [
+        " ".join(_coined(rng) for _ in range(2)) if rng.random() < unmatched
+        else _variant(rng.choice(abr)[2], rng)
+        for _ in range(crawl_rows)
+    ]
+    return abr, crawl
+
+
+def _matches(index, names: list[str]) -> tuple[dict, float]:
+    started = time.perf_counter()
+    best = index.best_matches(names)
+    elapsed = time.perf_counter() - started
+    return {i: (m[0], m[2]) for i, m in enumerate(best) if m is not None and m[2] >= index.threshold}, elapsed
+
+
+def recall_report(abr: list[tuple], crawl: list[str], top_k: int = TOP_K) -> dict:
+    engines = {"fuzzy": ABRIndex(), "tfidf": TfidfIndex(top_k=top_k), "tfidf_cosine": TfidfIndex(top_k=top_k, rescore=False)}
+    report = {}
+    for name, index in engines.items():
+        started = time.perf_counter()
+        for row in abr:
+            index.add(*row[:3])
+        index.finish()
+        build_seconds = time.perf_counter() - started
+        matches, match_seconds = _matches(index, crawl)
+        report[name] = {"matches": len(matches), "build_seconds": round(build_seconds, 3),
+                        "match_seconds": round(match_seconds, 3),
+                        "names_per_sec": round(len(crawl) / match_seconds, 1) if match_seconds else None,
+                        "_matches": matches}
+
+    reference = report["fuzzy"].pop("_matches")
+    for name in ("tfidf", "tfidf_cosine"):
+        matches = report[name].pop("_matches")
+        # An equally scored ABN counts: the reference breaks ties by row order only
+        found = sum(
+            i in matches and (matches[i][0] == abn or (name == "tfidf" and matches[i][1] == score))
+            for i, (abn, score) in reference.items()
+        )
+        report[name]["recall"] = round(found / len(reference), 4) if reference else None
+        report[name]["extra_matches"] = len(matches.keys() - reference.keys())
+    return report
+
+
+def run(abr_rows: int = 20_000, crawl_rows: int = 2000, top_k: int = TOP_K, seed: int = 0) -> dict:
+    abr, crawl = matching_fixture(abr_rows, crawl_rows, seed=seed)
+    return {"benchmark": "match_recall", "abr_rows": abr_rows, "crawl_rows": crawl_rows, "top_k": top_k,
+            "engines": recall_report(abr, crawl, top_k)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall of the tfidf match engine against the fuzzy engine")
+    parser.add_argument("--abr-rows", type=int, default=20_000)
+    parser.add_argument("--crawl-rows", type=int, default=2000)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(run(args.abr_rows, args.crawl_rows, args.top_k, args.seed), indent=2))
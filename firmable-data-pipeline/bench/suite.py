@@ -0,0 +1,280 @@
+"""
+Offline benchmark suite: throughput and peak memory of the pipeline's hot
+paths on synthetic data from bench.fixtures, with no network access.
+
+- abr_parse: parse_abr_xml over a generated ABR XML file
+- crawl_fetch_parse: CDX paging, WARC range fetching and parsing against a
+  local server with `--latency` seconds per request
+- abr_load / crawl_load: load_abr_records / load_crawl_records in batches,
+  from `--load-workers` threads as run.py does
+- matching: perform_string_matching over generated preprocess tables
+
+Each benchmark runs in a fresh process, so peak_rss_mb is its own
+high-water mark (baseline_rss_mb is read once its inputs are set up).
+Results are printed, or written with --output, as JSON for comparing
+versions. Runs against DATABASE_URL (a throwaway SQLite file unless set):
+
+    python -m bench.suite --abr-records 100000 --pages 2000 --latency 0.02 --output bench.json
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench_suite.db"
+
+from bench.fixtures import WORDS, serve, warc_corpus, write_abr_xml
+from extract.warc_fetcher import MAX_RANGE_GAP
+from matcher.em import MATCH_ENGINES
+
+BATCH_SIZE = 500
+
+
+def rss_mb() -> float:
+    """Peak resident set size of this process so far (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def bench_abr_parse(xml_path: str):
+    from extract.abr_extractor import parse_abr_xml
+
+    def run():
+        return sum(1 for _ in parse_abr_xml(Path(xml_path)))
+    return run
+
+
+def bench_crawl_fetch_parse(base_url: str, fetch_concurrency: int, range_gap: int):
+    from extract.cdx_client import AdaptiveRateLimiter, CdxClient, iter_warc_groups
+    from extract.common_crawl_extractor import iter_warc_fragments, parse_fragment
+    from extract.dedup import MemoryDedupStore
+    from extract.warc_fetcher import WarcFetcher
+
+    def run():
+        client = CdxClient(index_url=f"{base_url}cdx",
+                           limiter=AdaptiveRateLimiter(rate=1000, max_rate=1000))
+        fetcher = WarcFetcher(max_concurrency=fetch_concurrency, backoff=0)
+        try:
+            entries = (e for _, file_entries in iter_warc_groups(client, "com.au") for e in file_entries)
+            fragments = iter_warc_fragments(entries, fetcher=fetcher, warc_base=base_url, max_range_gap=range_gap,
+                                            dedup=MemoryDedupStore())
+            return sum(1 for item in fragments if parse_fragment(item))
+        finally:
+            fetcher.close()
+            client.close()
+    return run
+
+
+def _reset_tables(*models):
+    from sqlalchemy import delete
+
+    from db.base import Base
+    from db.conn import SessionLocal, engine
+
+    Base.metadata.create_all(engine)
+    with SessionLocal() as session:
+        for model in models:
+            session.execute(delete(model))
+        session.commit()
+
+
+def _in_batches(loader, records, batch_size, workers=1):
+    def run():
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(loader, (records[i:i + batch_size] for i in range(0, len(records), batch_size))))
+        return len(records)
+    return run
+
+
+def bench_abr_load(rows: int, batch_size: int, workers: int = 1):
+    from bench.loader import synthetic_abr_records
+    from db.models import ABRFingerprint, ABRRecord
+    from load.loader import load_abr_records
+
+    _reset_tables(ABRFingerprint, ABRRecord)
+    return _in_batches(load_abr_records, synthetic_abr_records(rows), batch_size, workers)
+
+
+def bench_crawl_load(rows: int, batch_size: int, workers: int = 1):
+    from db.models import CrawlPageText, CrawlRecord
+    from db.page_text import pack_text
+    from load.loader import load_crawl_records
+
+    rng = random.Random(0)
+    records = []
+    for i in range(rows):
+        text = " ".join(rng.choice(WORDS) for _ in range(300))
+        records.append({"url": f"https://site{i}.com.au/", "title": f"Site {i}", "company_name": f"Site {i}",
+                        "digest": f"D{i}", "timestamp": "20250315000000", "page_text": pack_text(text, "compressed"),
+                        "text_chars": len(text)})
+    _reset_tables(CrawlPageText, CrawlRecord)
+    return _in_batches(load_crawl_records, records, batch_size, workers)
+
+
+def bench_matching(abr_rows: int, crawl_rows: int, workers: int, engine: str = "fuzzy"):
+    from sqlalchemy import text
+
+    from db.base import Base
+    from db.conn import SessionLocal, engine
+    from matcher.em import perform_string_matching
+
+    rng = random.Random(0)
+    Base.metadata.create_all(engine)
+    with SessionLocal() as session:
+        for table in ("abr_preprocess", "crawl_preprocess"):
+            session.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        session.execute(text(
+            "CREATE TABLE abr_preprocess (abn TEXT PRIMARY KEY, entity_name TEXT, normalized_name TEXT, "
+            "state TEXT, postcode TEXT, record_updated TEXT)"
+        ))
+        session.execute(text(
+            "CREATE TABLE crawl_preprocess (url TEXT PRIMARY KEY, company_name TEXT, normalized_name TEXT, "
+            "timestamp TEXT)"
+        ))
+        names = [" ".join(rng.choice(WORDS) for _ in range(3)) + f" {i}" for i in range(abr_rows)]
+        session.execute(
+            text("INSERT INTO abr_preprocess VALUES (:abn, :name, :norm, 'NSW', '2000', '20240101')"),
+            [{"abn": f"{10_000_000_000 + i}", "name": f"{name.upper()} PTY LTD", "norm": name}
+             for i, name in enumerate(names)]
+        )
+        session.execute(
+            text("INSERT INTO crawl_preprocess VALUES (:url, :name, :norm, '20250315000000')"),
+            [{"url": f"https://site{i}.com.au/", "name": name.title(), "norm": name}
+             for i, name in enumerate(rng.sample(names, min(crawl_rows, len(names))))]
+        )
+        session.commit()
+
+    def run():
+        perform_string_matching(workers=workers, full=True, engine=engine)
+        return crawl_rows
+    return run
+
+
+BENCHMARKS = {
+    "abr_parse": bench_abr_parse,
+    "crawl_fetch_parse": bench_crawl_fetch_parse,
+    "abr_load": bench_abr_load,
+    "crawl_load": bench_crawl_load,
+    "matching": bench_matching,
+}
+
+
+def _measure(name: str, kwargs: dict, results):
+    """Runs in the child process: sets the benchmark up, then times it."""
+    # Keep stdout for the report
+    sys.stdout = sys.stderr
+    try:
+        run = BENCHMARKS[name](**kwargs)
+        baseline = rss_mb()
+        started = time.perf_counter()
+        items = run()
+        elapsed = time.perf_counter() - started
+        results.put({
+            "items": items,
+            "seconds": round(elapsed, 3),
+            "items_per_sec": round(items / elapsed, 1) if elapsed else None,
+            "baseline_rss_mb": baseline,
+            "peak_rss_mb": rss_mb(),
+        })
+    except Exception as e:
+        results.put({"error": repr(e)})
+
+
+def measure(name: str, **kwargs) -> dict:
+    context = mp.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(name, kwargs, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def git_version() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              check=True, cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(abr_records: int = 50_000, pages: int = 1000, warc_files: int = 4, latency: float = 0.01,
+        fetch_concurrency: int = 16, range_gap: int = MAX_RANGE_GAP, load_rows: int = 20_000, batch_size: int = BATCH_SIZE,
+        match_abr_rows: int = 20_000, match_crawl_rows: int = 2000, match_workers: int = 1,
+        only: list = None, match_engine: str = "fuzzy", load_workers: int = 1) -> dict:
+    from db.conn import engine
+
+    selected = only or list(BENCHMARKS)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        if "abr_parse" in selected:
+            xml_path = write_abr_xml(Path(workdir) / "abr.xml", abr_records)
+            results["abr_parse"] = measure("abr_parse", xml_path=str(xml_path))
+        if "crawl_fetch_parse" in selected:
+            files, cdx_pages = warc_corpus(pages, warc_files)
+            with serve(files, cdx_pages, latency) as server:
+                results["crawl_fetch_parse"] = measure("crawl_fetch_parse", base_url=server.base_url,
+                                                       fetch_concurrency=fetch_concurrency, range_gap=range_gap)
+                results["crawl_fetch_parse"]["requests"] = len(server.requests)
+    if "abr_load" in selected:
+        results["abr_load"] = measure("abr_load", rows=load_rows, batch_size=batch_size, workers=load_workers)
+    if "crawl_load" in selected:
+        results["crawl_load"] = measure("crawl_load", rows=load_rows, batch_size=batch_size, workers=load_workers)
+    if "matching" in selected:
+        results["matching"] = measure("matching", abr_rows=match_abr_rows, crawl_rows=match_crawl_rows,
+                                      workers=match_workers, engine=match_engine)
+
+    return {
+        "benchmark": "suite",
+        "version": git_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "dialect": engine.dialect.name,
+        "params": {
+            "abr_records": abr_records, "pages": pages, "warc_files": warc_files, "latency": latency,
+            "fetch_concurrency": fetch_concurrency, "range_gap": range_gap, "load_rows": load_rows, "batch_size": batch_size,
+            "load_workers": load_workers,
+            "match_abr_rows": match_abr_rows, "match_crawl_rows": match_crawl_rows, "match_workers": match_workers,
+            "match_engine": match_engine,
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline throughput and memory benchmarks")
+    parser.add_argument("--abr-records", type=int, default=50_000)
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--warc-files", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.01, help="Seconds the local server waits per request")
+    parser.add_argument("--fetch-concurrency", type=int, default=16)
+    parser.add_argument("--range-gap", type=int, default=MAX_RANGE_GAP,
+                        help="As in run.py; 0 fetches every fragment with its own request")
+    parser.add_argument("--load-rows", type=int, default=20_000)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--load-workers", type=int, default=1, help="Threads loading batches, as in run.py")
+    parser.add_argument("--match-abr-rows", type=int, default=20_000)
+    parser.add_argument("--match-crawl-rows", type=int, default=2000)
+    parser.add_argument("--match-workers", type=int, default=1)
+    parser.add_argument("--match-engine", choices=MATCH_ENGINES, default="fuzzy")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS))
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run(args.abr_records, args.pages, args.warc_files, args.latency, args.fetch_concurrency,
+                 args.range_gap, args.load_rows, args.batch_size, args.match_abr_rows, args.match_crawl_rows,
+                 args.match_workers, args.only, args.match_engine, args.load_workers)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    print(json.dumps(report, indent=2))
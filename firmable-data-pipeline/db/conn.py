@@ -1,7 +1,33 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 import os
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///local.db")
 
+# Applied to every SQLite connection: WAL lets readers run alongside the
+# writer, NORMAL sync is durable in WAL mode short of a power loss, and
+# reads go through a memory map. Several local workers (run.py --worker)
+# may write one file at once, so they wait for the write lock instead of
+# failing after the 5 s default.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 30_000,
+    "mmap_size": 256 * 2 ** 20,
+    "cache_size": -64_000,
+    "temp_store": "MEMORY",
+}
+
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine)
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+    finally:
+        cursor.close()
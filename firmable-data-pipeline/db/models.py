@@ -1,10 +1,11 @@
 from sqlalchemy import (
-    Column, String, Float, Date, Text, ForeignKey,
+    Column, String, Float, Date, Text, ForeignKey, BigInteger, Integer, LargeBinary,
     UniqueConstraint, Index
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from db.base import Base
+from db.page_text import unpack_text
 
 class ABRRecord(Base):
     __tablename__ = "abr_records_extracted"
@@ -27,7 +28,6 @@ class CrawlRecord(Base):
 
     url = Column(String, primary_key=True)
     title = Column(String)
-    text = Column(Text)
     timestamp = Column(String, index=True)
     company_name = Column(String, index=True)
     digest = Column(String, unique=True)
@@ -38,6 +38,28 @@ class CrawlRecord(Base):
     )
 
     matches = relationship("MatchedEntity", back_populates="crawl_record", cascade="all, delete")
+    # Loaded only when .text is read
+    page_text = relationship("CrawlPageText", uselist=False, lazy="select", cascade="all, delete")
+
+    @property
+    def text(self):
+        return self.page_text.text if self.page_text is not None else None
+
+
+class CrawlPageText(Base):
+    __tablename__ = "crawl_page_text"
+
+    # Page text lives apart from crawl_records_extracted so that matching and
+    # dbt never read it: zlib-compressed UTF-8, possibly truncated (chars is
+    # the length of the full text)
+    url = Column(String, ForeignKey("crawl_records_extracted.url", ondelete="CASCADE"), primary_key=True)
+    content = Column(LargeBinary)
+    chars = Column(Integer)
+    timestamp = Column(String)
+
+    @property
+    def text(self):
+        return unpack_text(self.content)
 
 
 class MatchedEntity(Base):
@@ -55,3 +77,53 @@ class MatchedEntity(Base):
     __table_args__ = (
         Index("ix_similarity_entity_company", "similarity_score", "entity_name", "company_name"),
     )
+
+
+class MatchFingerprint(Base):
+    __tablename__ = "match_fingerprints"
+
+    # "abr" (keyed by abn, fingerprinted by record_updated) or
+    # "crawl" (keyed by url, fingerprinted by timestamp)
+    source = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String)
+
+
+class ABRFingerprint(Base):
+    __tablename__ = "abr_fingerprints"
+
+    # Last loaded version of each ABN; content_hash covers every loaded column
+    abn = Column(String, primary_key=True)
+    record_updated = Column(String)
+    content_hash = Column(BigInteger)
+
+
+class CrawlDomainClaim(Base):
+    __tablename__ = "crawl_domain_claims"
+
+    # Domains claimed by extract.dedup.DatabaseDedupStore, shared by every
+    # worker; owner is the work unit that claimed it (NULL for seeded domains)
+    domain = Column(String, primary_key=True)
+    owner = Column(String)
+
+
+class WorkLease(Base):
+    __tablename__ = "work_leases"
+
+    # One unit of distributed work (see pipeline.leases), keyed by what it covers
+    key = Column(String, primary_key=True)
+    kind = Column(String, index=True)
+    payload = Column(Text)
+    priority = Column(Integer, default=0)
+    # pending, leased, done or failed; a lease past lease_expires (epoch
+    # seconds) can be claimed by another worker
+    status = Column(String)
+    owner = Column(String)
+    lease_expires = Column(Float)
+    attempts = Column(Integer, default=0)
+    error = Column(Text)
+    updated = Column(Float)
+
+    __table_args__ = (
+        Index("ix_work_leases_claimable", "status", "priority", "key"),
+    )
@@ -0,0 +1,28 @@
+import zlib
+from typing import Optional
+
+TEXT_RETENTION_MODES = ("none", "truncated", "compressed")
+# Off by default: extracting the body text costs the head-only parse of
+# pages that name the company in their <head>
+TEXT_RETENTION = "none"
+# Characters kept per page in "truncated" mode
+TEXT_MAX_CHARS = 2000
+COMPRESS_LEVEL = 6
+
+
+def pack_text(text: Optional[str], retention: str = TEXT_RETENTION, max_chars: int = TEXT_MAX_CHARS) -> Optional[bytes]:
+    """
+    Page text as stored in crawl_page_text: zlib-compressed UTF-8, cut to
+    `max_chars` in "truncated" mode. None in "none" mode or for empty text.
+    """
+    if retention not in TEXT_RETENTION_MODES:
+        raise ValueError(f"Unknown text retention mode: {retention}")
+    if retention == "none" or not text:
+        return None
+    if retention == "truncated":
+        text = text[:max_chars]
+    return zlib.compress(text.encode("utf-8", "replace"), COMPRESS_LEVEL)
+
+
+def unpack_text(content: Optional[bytes]) -> Optional[str]:
+    return zlib.decompress(content).decode("utf-8") if content is not None else None
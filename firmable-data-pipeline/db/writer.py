@@ -0,0 +1,137 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from db.conn import SessionLocal, engine
+from pipeline import metrics, profiling
+
+# Write jobs waiting for the writer thread; submitters block beyond this
+QUEUE_SIZE = 64
+# Jobs committed together in one transaction
+GROUP_SIZE = 16
+
+WRITE_TRANSACTIONS = metrics.counter("writer_transactions_total", "Transactions committed by the database writer thread")
+WRITE_JOBS = metrics.counter("writer_jobs_total", "Write jobs run by the database writer thread")
+WRITE_RETRIES = metrics.counter("writer_isolated_jobs_total", "Jobs re-run alone after their group's transaction failed")
+
+_STOP = object()
+
+
+class DatabaseWriter:
+    """
+    One thread that runs every database write of the process.
+
+    Jobs are callables taking a session; whatever threads submit them, they
+    queue up here, and the jobs waiting at any moment (up to GROUP_SIZE)
+    run in one transaction with a single commit. SQLite allows one writer
+    at a time, so this replaces loaders contending for the lock (and
+    committing one by one) with group commits.
+
+    If a grouped transaction fails, its jobs are re-run one per transaction
+    so that only the failing job reports the error. Jobs must therefore be
+    safe to run twice, as upserts are, and leave counting what they wrote
+to the caller, which gets their result only once committed.
+    """
+
+    def __init__(self, session_factory=SessionLocal, group_size: int = GROUP_SIZE, queue_size: int = QUEUE_SIZE):
+        self.session_factory = session_factory
+        self.group_size = group_size
+        self._queue = queue.Queue(queue_size)
+        self._thread = threading.Thread(target=self._run, name="database-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn) -> Future:
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def run(self, fn):
+        """Runs `fn(session)` on the writer thread and returns its result once committed."""
+        return self.submit(fn).result()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            group = [job]
+            while len(group) < self.group_size:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is _STOP:
+                    self._write(group)
+                    return
+                group.append(job)
+            self._write(group)
+
+    def _write(self, group):
+        session = self.session_factory()
+        try:
+            with profiling.stage("database writer"):
+                results = [fn(session) for fn, _ in group]
+                session.commit()
+        except BaseException as e:
+            session.rollback()
+            if len(group) == 1:
+                group[0][1].set_exception(e)
+                return
+            WRITE_RETRIES.inc(len(group))
+            for job in group:
+                self._write([job])
+            return
+        finally:
+            session.close()
+        WRITE_TRANSACTIONS.inc()
+        WRITE_JOBS.inc(len(group))
+        for (_, future), result in zip(group, results):
+            future.set_result(result)
+
+    def close(self):
+        """Finishes the queued jobs and stops the thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _forget_writer():
+    # A forked child has no writer thread; it starts its own on first use
+    global _writer, _writer_lock
+    _writer, _writer_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_writer)
+
+
+def get_writer() -> DatabaseWriter:
+    """The process's writer, started on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = DatabaseWriter()
+        return _writer
+
+
+def write(fn):
+    """
+    Runs `fn(session)` in a committed transaction and returns its result:
+    on the shared writer thread for SQLite, in a session of the calling
+    thread otherwise (PostgreSQL takes concurrent writers).
+    """
+    if engine.dialect.name == "sqlite":
+        return get_writer().run(fn)
+    session = SessionLocal()
+    try:
+        result = fn(session)
+        session.commit()
+        return result
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
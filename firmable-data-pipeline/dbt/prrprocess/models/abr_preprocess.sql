@@ -17,21 +17,41 @@
 -- 4. Returns all original fields along with `normalized_name` as output.
 --
 -- Output:
--- One cleaned and normalized record per ABN, stored as a **physical table** for downstream use.
+-- One cleaned and normalized record per ABN, stored as an **incremental table** for downstream use.
+-- Incremental runs only normalize ABNs that are new or whose `record_updated` changed since the
+-- last run (delete+insert on `abn`); `--full-refresh` rebuilds the whole table.
 --
 
+{{
+    config(
+        materialized='incremental',
+        unique_key='abn',
+        incremental_strategy='delete+insert',
+        indexes=[
+            {'columns': ['abn'], 'unique': True},
+            {'columns': ['normalized_name']},
+        ]
+    )
+}}
+
 WITH raw AS (
     SELECT
-        abn,
-        entity_name,
-        entity_type,
-        entity_status,
-        address,
-        postcode,
-        state,
-        start_date,
-        record_updated
-    FROM {{ source('firmable_sources', 'abr_records_extracted') }}
+        src.abn,
+        src.entity_name,
+        src.entity_type,
+        src.entity_status,
+        src.address,
+        src.postcode,
+        src.state,
+        src.start_date,
+        src.record_updated
+    FROM {{ source('firmable_sources', 'abr_records_extracted') }} AS src
+    {% if is_incremental() %}
+    -- Compared per ABN rather than against max(record_updated): ABR files can load out of date order
+    LEFT JOIN {{ this }} AS prev ON prev.abn = src.abn
+    WHERE prev.abn IS NULL
+       OR prev.record_updated IS DISTINCT FROM src.record_updated
+    {% endif %}
 ),
 
 cleaned AS (
@@ -1,4 +1,18 @@
-{{ config(materialized='table') }}
+{{
+    config(
+        materialized='incremental',
+        unique_key='url',
+        incremental_strategy='delete+insert',
+        indexes=[
+            {'columns': ['url'], 'unique': True},
+            {'columns': ['normalized_name']},
+        ],
+        post_hook=[
+            "delete from {{ this }} as prev using {{ source('firmable_sources', 'crawl_records_extracted') }} as src
+             where prev.url = src.url and prev.timestamp is distinct from src.timestamp"
+        ]
+    )
+}}
 
 -- This model cleans and normalizes company names from crawl_records_extracted
 -- for downstream entity matching by:
@@ -7,23 +21,31 @@
 -- - normalizing whitespace
 -- - stripping common legal suffixes (e.g., Pty, Ltd, etc.)
 -- The final output includes all original columns plus a normalized company name.
+-- Incremental runs only clean pages that are new or whose crawl timestamp changed
+-- since the last run (delete+insert on url); `--full-refresh` rebuilds the table.
+-- A re-crawled page whose name no longer passes the final filter is not re-inserted,
+-- so the post_hook drops its previous row.
 
 with base as (
     select
-        url,
-        title,
-        text,
-        timestamp,
-        company_name,
-        digest
-    from {{ source('firmable_sources', 'crawl_records_extracted') }}
+        src.url,
+        src.title,
+        src.timestamp,
+        src.company_name,
+        src.digest
+    from {{ source('firmable_sources', 'crawl_records_extracted') }} as src
+    {% if is_incremental() %}
+    -- Compared per url: pages from older crawls can be loaded after newer ones
+    left join {{ this }} as prev on prev.url = src.url
+    where prev.url is null
+       or prev.timestamp is distinct from src.timestamp
+    {% endif %}
 ),
 
 cleaned as (
     select
         url,
         title,
-        text,
         timestamp,
         digest,
         company_name,
@@ -35,7 +57,6 @@ punctuation_removed as (
     select
         url,
         title,
-        text,
         timestamp,
         digest,
         company_name,
@@ -47,7 +68,6 @@ whitespace_normalized as (
     select
         url,
         title,
-        text,
         timestamp,
         digest,
         company_name,
@@ -59,7 +79,6 @@ suffix_stripped as (
     select
         url,
         title,
-        text,
         timestamp,
         digest,
         company_name,
@@ -77,7 +96,6 @@ suffix_stripped as (
 select
     url,
     title,
-    text,
     timestamp,
     digest,
     company_name,
@@ -1,8 +1,18 @@
-import requests
+import queue
+import shutil
 import zipfile
 import xml.etree.ElementTree as ET
 from pathlib import Path
-from typing import Generator, Dict, List
+from typing import Generator, Dict, List, Iterable
+
+from extract.download import DOWNLOAD_SEGMENTS, download_file
+from pipeline import metrics, profiling
+from pipeline.stages import process_context
+
+try:
+    from lxml import etree as LXML_ETREE
+except ImportError:
+    LXML_ETREE = None
 
 ABR_SPLIT_ZIP_URL = (
     "https://data.gov.au/data/dataset/5bd7fcab-e315-42cb-8daf-50b7efc2027e/"
@@ -13,91 +23,275 @@ CACHE_DIR = Path("data/cache")
 EXTRACT_DIR = CACHE_DIR / "abr_xmls"
 ZIP_PATH = CACHE_DIR / "ABR_SPLIT.zip"
 
+PARSE_WORKERS = 1
+
+ABR_RECORDS_PARSED = metrics.counter("abr_records_parsed_total", "ABR records parsed from the XML extract")
+RECORD_BATCH_SIZE = 500
+# Parsed batches buffered per worker before workers block on the loader
+QUEUED_BATCHES_PER_WORKER = 4
+# How long the loader waits for a batch before checking that the workers are still alive
+WORKER_POLL_SECONDS = 5.0
+
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
-EXTRACT_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def download_and_extract_abr_zip(url: str = ABR_SPLIT_ZIP_URL) -> List[Path]:
-    """~
-    Downloads and extracts ABR XML ZIP file. Skips if files already exist.
+class ABRParseError(Exception):
+    """An ABR XML member could not be parsed, or a parse worker died."""
 
-    Returns:
-        List[Path]: List of extracted XML file paths.
+
+def download_abr_zip(url: str = ABR_SPLIT_ZIP_URL, segments: int = DOWNLOAD_SEGMENTS) -> Path:
+    """
+    Downloads the ABR XML ZIP file unless it is already cached. Interrupted
+    downloads resume where they stopped on the next run.
     """
     if not ZIP_PATH.exists():
         print(f"📥 Downloading ABR ZIP from: {url}")
-        response = requests.get(url)
-        response.raise_for_status()
-        with open(ZIP_PATH, "wb") as f:
-            f.write(response.content)
+        download_file(url, ZIP_PATH, segments=segments)
     else:
         print("✅ ZIP file already downloaded.")
+    return ZIP_PATH
+
+
+def list_abr_members(zip_path: Path = ZIP_PATH) -> List[str]:
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        return [name for name in zip_ref.namelist() if name.endswith(".xml")]
+
+
+def download_and_extract_abr_zip(url: str = ABR_SPLIT_ZIP_URL, segments: int = DOWNLOAD_SEGMENTS) -> List[Path]:
+    """~
+    Downloads and extracts ABR XML ZIP file. Skips if files already exist.
+
+    Returns:
+        List[Path]: List of extracted XML file paths.
+    """
+    download_abr_zip(url, segments)
+    EXTRACT_DIR.mkdir(parents=True, exist_ok=True)
 
     xml_paths = []
     with zipfile.ZipFile(ZIP_PATH, "r") as zip_ref:
-        for file in zip_ref.namelist():
-            if file.endswith(".xml"):
-                dest_path = EXTRACT_DIR / Path(file).name
-                if not dest_path.exists():
-                    print(f"📦 Extracting {file}")
-                    with zip_ref.open(file) as xml_file, open(dest_path, "wb") as f:
-                        f.write(xml_file.read())
-                else:
-                    print(f"✅ Already extracted: {file}")
-                xml_paths.append(dest_path)
+        for file in list_abr_members(ZIP_PATH):
+            dest_path = EXTRACT_DIR / Path(file).name
+            if not dest_path.exists():
+                print(f"📦 Extracting {file}")
+                with zip_ref.open(file) as xml_file, open(dest_path, "wb") as f:
+                    shutil.copyfileobj(xml_file, f)
+            else:
+                print(f"✅ Already extracted: {file}")
+            xml_paths.append(dest_path)
 
     return xml_paths
 
-def parse_abr_xml(file_path: Path) -> Generator[Dict, None, None]:
-    context = ET.iterparse(file_path, events=("start", "end"))
-    _, root = next(context)
+def _child(parent, tag):
+    for child in parent:
+        if child.tag == tag:
+            return child
+    return None
+
+
+def abr_record(elem) -> Dict:
+    """
+    Builds the record dict for one <ABR> element.
+
+    Names and addresses sit one level below <ABR> (under MainEntity or
+    LegalEntity), so they are read in a single walk over the children
+    instead of `.//` path searches, which lxml evaluates in Python.
+    """
+    abn_elem = entity_type = name_elem = family_name = details = None
+    given_names = []
+    for child in elem:
+        tag = child.tag
+        if tag == "ABN":
+            abn_elem = abn_elem if abn_elem is not None else child
+        elif tag == "EntityType":
+            type_text = _child(child, "EntityTypeText")
+            if entity_type is None and type_text is not None:
+                entity_type = type_text.text or ""
+        else:
+            for part in child:
+                part_tag = part.tag
+                if part_tag == "NonIndividualName" and name_elem is None and tag == "MainEntity":
+                    name_elem = _child(part, "NonIndividualNameText")
+                elif part_tag == "IndividualName":
+                    for name_part in part:
+                        if name_part.tag == "GivenName":
+                            given_names.append(name_part)
+                        elif name_part.tag == "FamilyName" and family_name is None:
+                            family_name = name_part.text or ""
+                elif part_tag == "BusinessAddress" and details is None:
+                    details = _child(part, "AddressDetails")
+
+    abn = abn_elem.text if abn_elem is not None else None
+    entity_status = abn_elem.get("status") if abn_elem is not None else None
+    start_date = abn_elem.get("ABNStatusFromDate") if abn_elem is not None else None
+    record_updated = elem.get("recordLastUpdatedDate")
 
+    # Entity Name
+    if name_elem is None:
+        # Individual
+        if given_names and family_name:
+            given = " ".join(g.text for g in given_names if g.text)
+            name = f"{given} {family_name}"
+        else:
+            name = None
+    else:
+        name = name_elem.text
+
+    # Address
+    state = details.findtext("State") if details is not None else None
+    postcode = details.findtext("Postcode") if details is not None else None
+    address = None  # No address line in XML, can build from state + postcode optionally
+
+    return {
+        "abn": abn,
+        "entity_name": name,
+        "entity_type": entity_type,
+        "entity_status": entity_status,
+        "start_date": start_date,
+        "address": address,
+        "state": state,
+        "postcode": postcode,
+        "record_updated": record_updated
+    }
+
+
+def parse_abr_stream(source) -> Generator[Dict, None, None]:
+    """
+    Parses ABR records from a path or binary file object (such as an open
+    ZIP member) in constant memory.
+
+    With lxml only <ABR> end events are reported, and each element is
+    cleared along with the already-processed siblings before it. The
+    stdlib fallback clears the document root after every record instead.
+    """
+    if LXML_ETREE is not None:
+        for _, elem in LXML_ETREE.iterparse(source, events=("end",), tag="ABR"):
+            yield abr_record(elem)
+            elem.clear(keep_tail=True)
+            parent = elem.getparent()
+            while elem.getprevious() is not None:
+                del parent[0]
+        return
+
+    context = ET.iterparse(source, events=("start", "end"))
+    _, root = next(context)
     for event, elem in context:
         if event == "end" and elem.tag == "ABR":
-            abn = elem.findtext("ABN")
-            entity_type = elem.findtext("EntityType/EntityTypeText")
-            entity_status = elem.find("ABN").attrib.get("status")
-            start_date = elem.find("ABN").attrib.get("ABNStatusFromDate")
-            record_updated = elem.attrib.get("recordLastUpdatedDate")
-
-            # Entity Name
-            name_elem = elem.find(".//MainEntity/NonIndividualName/NonIndividualNameText")
-            if name_elem is None:
-                # Individual
-                given_names = elem.findall(".//IndividualName/GivenName")
-                family_name = elem.findtext(".//IndividualName/FamilyName")
-                if given_names and family_name:
-                    given = " ".join(g.text for g in given_names if g.text)
-                    name = f"{given} {family_name}"
-                else:
-                    name = None
-            else:
-                name = name_elem.text
-
-            # Address
-            state = elem.findtext(".//BusinessAddress/AddressDetails/State")
-            postcode = elem.findtext(".//BusinessAddress/AddressDetails/Postcode")
-            address = None  # No address line in XML, can build from state + postcode optionally
-
-            yield {
-                "abn": abn,
-                "entity_name": name,
-                "entity_type": entity_type,
-                "entity_status": entity_status,
-                "start_date": start_date,
-                "address": address,
-                "state": state,
-                "postcode": postcode,
-                "record_updated": record_updated
-            }
-
+            yield abr_record(elem)
             root.clear()
 
 
+def parse_abr_xml(file_path: Path) -> Generator[Dict, None, None]:
+    yield from parse_abr_stream(file_path)
+
+
+def parse_abr_member(zip_path: Path, member: str) -> Generator[Dict, None, None]:
+    """Parses one XML member straight from the ZIP, without extracting it to disk."""
+    with zipfile.ZipFile(zip_path, "r") as zip_ref, zip_ref.open(member) as xml_file:
+        yield from parse_abr_stream(xml_file)
+
+
+def batched(records: Iterable[Dict], batch_size: int) -> Generator[List[Dict], None, None]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _parse_members_in_worker(zip_path, members, batches, batch_size, profile_settings=None):
+    """
+    Pool worker: parses ZIP members taken from `members` until it gets None,
+    then puts None. A member that fails to parse is put as an ABRParseError
+    instead and ends the worker.
+    """
+    if profile_settings is not None:
+        profiling.enable(**profile_settings, worker=True)
+    for member in iter(members.get, None):
+        try:
+            # Profiled per ABR file, queue waits included
+            with profiling.stage("ABR parse"):
+                for batch in batched(parse_abr_member(zip_path, member), batch_size):
+                    batches.put(batch)
+        except Exception as e:
+            batches.put(ABRParseError(f"Failed to parse {member}: {e!r}"))
+            return
+    batches.put(None)
+
+
+def iter_abr_batches(
+    zip_path: Path = ZIP_PATH,
+    members: List[str] = None,
+    workers: int = PARSE_WORKERS,
+    batch_size: int = RECORD_BATCH_SIZE
+) -> Generator[List[Dict], None, None]:
+    """
+    Streams ABR records from the ZIP in batches of up to `batch_size`.
+
+    XML members are parsed in place from the archive. With `workers` > 1
+    they are spread over that many processes, which hand batches back
+    through a bounded queue, so parsing stays at most a few batches ahead
+    of the loader. Batches from different members arrive interleaved.
+    Raises ABRParseError if a member fails to parse or a worker dies before
+    it is done.
+    """
+    if members is None:
+        members = list_abr_members(zip_path)
+    if workers <= 1:
+        for member in members:
+            for batch in batched(parse_abr_member(zip_path, member), batch_size):
+                ABR_RECORDS_PARSED.inc(len(batch))
+                yield batch
+        return
+
+    workers = min(workers, len(members)) or 1
+    # Not forked: the loader's threads and the database writer are already running
+    ctx = process_context()
+    member_queue = ctx.Queue()
+    batches = ctx.Queue(maxsize=workers * QUEUED_BATCHES_PER_WORKER)
+    for member in members:
+        member_queue.put(member)
+    for _ in range(workers):
+        member_queue.put(None)
+
+    processes = [
+        ctx.Process(target=_parse_members_in_worker,
+                    args=(zip_path, member_queue, batches, batch_size, profiling.settings()), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        running = workers
+        while running:
+            try:
+                batch = batches.get(timeout=WORKER_POLL_SECONDS)
+            except queue.Empty:
+                dead = [process.exitcode for process in processes if process.exitcode not in (None, 0)]
+                if dead:
+                    raise ABRParseError(f"ABR parse worker exited with code {dead[0]} before it was done")
+                continue
+            if batch is None:
+                running -= 1
+            elif isinstance(batch, ABRParseError):
+                raise batch
+            else:
+                ABR_RECORDS_PARSED.inc(len(batch))
+                yield batch
+    finally:
+        # The loader may stop early (record limit); don't leave workers blocked on the queue
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
 
 
 def extract_abr_records(xml_paths: List[Path], max_files: int = None) -> Generator[Dict, None, None]:
     for i, xml_path in enumerate(xml_paths):
         if max_files is not None and i >= max_files:
             break
-        yield from parse_abr_xml(xml_path)
+        for record in parse_abr_xml(xml_path):
+            ABR_RECORDS_PARSED.inc()
+            yield record
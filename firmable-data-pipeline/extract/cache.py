@@ -0,0 +1,142 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Optional
+
+from pipeline import metrics
+
+CACHE_DIR = Path(os.getenv("CRAWL_CACHE_DIR", "data/cache/crawl"))
+CACHE_MAX_BYTES = int(os.getenv("CRAWL_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+COMPRESS_LEVEL = 6
+# Entries dropped per eviction round once the cache is over its size cap
+EVICT_BATCH = 256
+
+CACHE_HITS = metrics.counter("cache_hits_total", "Crawl cache lookups answered from disk")
+CACHE_MISSES = metrics.counter("cache_misses_total", "Crawl cache lookups that missed")
+
+
+class DiskCache:
+    """
+    Content cache on local disk for immutable crawl data (CDX pages, WARC
+    fragments).
+
+    Values are stored one file per key under `root`, named by the SHA-256 of
+    the key, optionally zlib-compressed. A SQLite index (`index.sqlite`)
+    holds each key's file, stored size and last access time, so lookups
+    never scan the directory. When the stored bytes exceed `max_bytes` the
+    least recently used entries are evicted. Safe to share between threads.
+    """
+
+    def __init__(self, root: Path = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.root / "index.sqlite", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, file TEXT, size INTEGER, compressed INTEGER, last_access REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_entries_last_access ON entries (last_access)")
+        self._db.commit()
+        self.total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _file(self, key: str) -> Path:
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return self.root / name[:2] / name
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._db.execute("SELECT file, compressed FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+                self._db.commit()
+        if row is None:
+            self.misses += 1
+            CACHE_MISSES.inc()
+            return None
+        try:
+            data = (self.root / row[0]).read_bytes()
+            value = zlib.decompress(data) if row[1] else data
+        except (OSError, zlib.error):
+            # Removed or damaged behind the index's back
+            self.delete(key)
+            self.misses += 1
+            CACHE_MISSES.inc()
+            return None
+        self.hits += 1
+        CACHE_HITS.inc()
+        return value
+
+    def put(self, key: str, value: bytes, compress: bool = True):
+        data = zlib.compress(value, COMPRESS_LEVEL) if compress else bytes(value)
+        path = self._file(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._lock:
+            old = self._db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, file, size, compressed, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, str(path.relative_to(self.root)), len(data), int(compress), time.time())
+            )
+            self.total_bytes += len(data) - (old[0] if old else 0)
+            self._evict()
+            self._db.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            row = self._db.execute("SELECT file, size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._db.commit()
+            self.total_bytes -= row[1]
+        (self.root / row[0]).unlink(missing_ok=True)
+
+    def _evict(self):
+        """Drops least recently used entries until the cache fits in max_bytes. Caller holds the lock."""
+        while self.total_bytes > self.max_bytes:
+            rows = self._db.execute(
+                "SELECT key, file, size FROM entries ORDER BY last_access LIMIT ?", (EVICT_BATCH,)
+            ).fetchall()
+            if not rows:
+                break
+            for key, file, size in rows:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                (self.root / file).unlink(missing_ok=True)
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> Optional[DiskCache]:
+    """Shared cache under CACHE_DIR, or None when CRAWL_CACHE_DIR is set to an empty string."""
+    global _default_cache
+    if not os.getenv("CRAWL_CACHE_DIR", str(CACHE_DIR)):
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = DiskCache()
+    return _default_cache
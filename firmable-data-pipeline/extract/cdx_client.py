@@ -0,0 +1,301 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator, List, Tuple
+from urllib.parse import urlencode
+
+import requests
+
+from extract.cache import DiskCache
+from pipeline import metrics
+
+CDX_INDEX = "https://index.commoncrawl.org/CC-MAIN-2025-13-index"
+QUERY_SIZE = 1000
+PAGE_CONCURRENCY = 4
+MAX_RETRIES = 5
+RETRY_STATUSES = (429, 503)
+BACKOFF_SECONDS = 1.0
+BACKOFF_FACTOR = 1.5
+TIMEOUT = 10
+# Only the fields the pipeline reads are requested from the index
+CDX_FIELDS = ["url", "timestamp", "digest", "mime", "mime-detected", "status", "languages",
+              "filename", "offset", "length"]
+
+CDX_REQUESTS = metrics.counter("cdx_requests_total", "CDX index requests sent")
+CDX_RETRIES = metrics.counter("cdx_retries_total", "CDX index requests retried after throttling or an error")
+CDX_REQUEST_SECONDS = metrics.timer("cdx_request_seconds", "CDX index request latency")
+CDX_PAGES = metrics.counter("cdx_pages_total", "CDX index pages fetched")
+
+
+class CdxFetchError(Exception):
+    """A CDX index request failed for good: retries ran out or the index answered with an error status."""
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate adapts to the server (AIMD).
+
+    Every request takes a token. `on_success` raises the rate additively up
+    to `max_rate`; `on_throttle` (a 429/503) halves it down to `min_rate`
+    and empties the bucket so callers back off immediately.
+    """
+
+    def __init__(self, rate: float = 2.0, min_rate: float = 0.2, max_rate: float = 10.0,
+                 increase: float = 0.25, decrease: float = 0.5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait_seconds = (1.0 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, 0.0)
+
+
+class CdxClient:
+    """
+    Paged client for a pywb/Common Crawl CDX index.
+
+    The page count is discovered up front with `showNumPages`, then pages are
+    fetched `concurrency` at a time under an AdaptiveRateLimiter and handed
+    back as each one completes.
+
+    With a `cache`, successful responses are stored under the index URL
+    (which names the crawl) and the query parameters, page included, and
+    repeated queries are answered without touching the network.
+    """
+
+    def __init__(self, index_url: str = CDX_INDEX, concurrency: int = PAGE_CONCURRENCY,
+                 limiter: AdaptiveRateLimiter = None, max_retries: int = MAX_RETRIES,
+                 backoff: float = BACKOFF_SECONDS, timeout: float = TIMEOUT, cache: DiskCache = None):
+        self.index_url = index_url
+        self.cache = cache
+        self.concurrency = concurrency
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def close(self):
+        self.session.close()
+
+    def _get(self, params: dict) -> requests.Response:
+        """
+        GET under the rate limiter, retrying throttled and failed requests.
+        Raises CdxFetchError once retries run out or on a status that isn't
+        retried, so a failed page is never mistaken for an empty one.
+        """
+        backoff = self.backoff
+        error = None
+        for _ in range(self.max_retries):
+            self.limiter.acquire()
+            CDX_REQUESTS.inc()
+            try:
+                with CDX_REQUEST_SECONDS.time():
+                    response = self.session.get(self.index_url, params=params, timeout=self.timeout)
+                if response.status_code == 200:
+                    self.limiter.on_success()
+                    return response
+                if response.status_code not in RETRY_STATUSES:
+                    raise CdxFetchError(f"Unexpected status {response.status_code} for {params}")
+                print(f"[!] Rate limit hit (HTTP {response.status_code}), backing off...")
+                error = f"HTTP {response.status_code}"
+                self.limiter.on_throttle()
+            except requests.RequestException as e:
+                print(f"[!] Error: {e}, backing off...")
+                error = str(e)
+            CDX_RETRIES.inc()
+            time.sleep(backoff)
+            backoff *= BACKOFF_FACTOR
+        raise CdxFetchError(f"Gave up on {params} after {self.max_retries} attempts ({error})")
+
+    def _get_text(self, params: dict) -> str:
+        """Response body for `params`, from the cache when possible."""
+        key = f"cdx:{self.index_url}?{urlencode(sorted(params.items()))}"
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached.decode()
+        response = self._get(params)
+        if self.cache is not None:
+            self.cache.put(key, response.content)
+        return response.text
+
+    def num_pages(self, params: dict) -> int:
+        body = self._get_text({**params, "showNumPages": "true"})
+        return int(json.loads(body.strip().split("\n")[0]).get("pages", 0))
+
+    def fetch_page(self, params: dict, page: int) -> List[dict]:
+        body = self._get_text({**params, "page": page})
+        return [json.loads(line) for line in body.strip().split("\n") if line]
+
+    def iter_pages(self, params: dict, pages: int = None, skip: set = None,
+                   failed: list = None, ordered: bool = False) -> Iterator[Tuple[int, List[dict]]]:
+        """
+        Yields (page, records) for the first `pages` pages of the query (all
+        pages if None), in completion order, leaving out the pages in `skip`.
+        Raises CdxFetchError if the page count or a page can't be fetched;
+        with a `failed` list, pages that can't be fetched are appended to it
+        instead and the other pages still yielded.
+
+        With `ordered`, pages are yielded in page order instead: pages that
+        complete early wait for the ones before them, and no more pages are
+        requested while `concurrency` of them are waiting.
+        """
+        total = self.num_pages(params)
+        if pages is not None:
+            total = min(total, pages)
+        skip = skip or set()
+        print(f"[i] CDX query has {total} pages to fetch" +
+              (f" ({len(skip & set(range(total)))} already done)" if skip else ""))
+
+        order = [page for page in range(total) if page not in skip]
+        page_numbers = iter(order)
+        # Completed pages waiting for earlier ones (ordered); None for failed pages
+        ready = {}
+        head = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            in_flight = {}
+
+            def refill():
+                while len(in_flight) < self.concurrency and len(ready) < self.concurrency:
+                    next_page = next(page_numbers, None)
+                    if next_page is None:
+                        return
+                    in_flight[pool.submit(self.fetch_page, params, next_page)] = next_page
+
+            refill()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=in_flight.get):
+                    page = in_flight.pop(future)
+                    records = None
+                    try:
+                        records = future.result()
+                    except CdxFetchError as e:
+                        if failed is None:
+                            raise
+                        print(f"[!] CDX page {page} failed: {e}")
+                        failed.append(page)
+                    else:
+                        CDX_PAGES.inc()
+                        print(f"[i] Extracted Page {page}...")
+                    if not ordered:
+                        if records is not None:
+                            yield page, records
+                        continue
+                    ready[page] = records
+                    while head < len(order) and order[head] in ready:
+                        records = ready.pop(order[head])
+                        if records is not None:
+                            yield order[head], records
+                        head += 1
+                refill()
+
+
+def domain_query(domain_keyword: str) -> dict:
+    return {
+        "url": f"*.{domain_keyword}/*",
+        "output": "json",
+        "filter": "status:200",
+        "fl": ",".join(CDX_FIELDS),
+        "limit": QUERY_SIZE
+    }
+
+
+def to_record(raw: dict) -> dict:
+    return {
+        "url": raw.get("url"),
+        "timestamp": raw.get("timestamp"),
+        "digest": raw.get("digest"),
+        "mime": raw.get("mime"),
+        "mime-detected": raw.get("mime-detected"),
+        "status": raw.get("status"),
+        "languages": raw.get("languages"),
+        "filename": raw.get("filename"),
+        "offset": raw.get("offset"),
+        "length": raw.get("length")
+    }
+
+
+def group_by_warc(records) -> dict:
+    """Turns CDX records into fetcher entries grouped by WARC file."""
+    warc_index = defaultdict(list)
+    for rec in records:
+        warc_path = rec.get("filename")
+        digest = rec.get("digest")
+        offset = rec.get("offset")
+        length = rec.get("length")
+        if warc_path and digest and offset and length:
+            warc_index[warc_path].append({
+                "digest": digest,
+                "offset": int(offset),
+                "length": int(length),
+                "warc_path": warc_path,
+                "url": rec.get("url"),
+                "timestamp": rec.get("timestamp")
+            })
+    return warc_index
+
+
+def journal_query(client: CdxClient, domain_keyword: str) -> str:
+    """Identifies a query's pages in a pipeline.journal.CrawlJournal."""
+    return f"{client.index_url} {domain_query(domain_keyword)['url']}"
+
+
+def page_groups(raw_records, selector=None) -> dict:
+    """group_by_warc() of one CDX page's records, after an extract.cdx_select.CdxSelector if given."""
+    records = [to_record(r) for r in raw_records]
+    return group_by_warc(selector.select(records) if selector is not None else records)
+
+
+def iter_warc_groups(client: CdxClient, domain_keyword: str, pages: int = None,
+                     journal=None, selector=None, failed: list = None) -> Iterator[Tuple[str, List[dict]]]:
+    """
+    Streams (warc_path, entries) groups page by page, so fragment fetching
+    can start as soon as the first CDX page arrives.
+
+    With a `selector`, only the entries it selects from each page are
+    kept. With a `journal`, pages it already holds are not requested, and
+    each new page is recorded there, with its entries, before they are
+    yielded. With a `failed` list, pages that can't be fetched are added
+    to it (see CdxClient.iter_pages) and left out of the journal, so a
+    resumed run requests them again.
+    """
+    query = journal_query(client, domain_keyword)
+    skip = journal.done_pages(query) if journal is not None else None
+    # A selector carries domains from one page to the next, so it gets them in page order
+    for page, raw_records in client.iter_pages(domain_query(domain_keyword), pages, skip=skip, failed=failed,
+                                               ordered=selector is not None):
+        groups = page_groups(raw_records, selector)
+        if journal is not None:
+            journal.record_page(query, page, [e for entries in groups.values() for e in entries])
+        yield from groups.items()
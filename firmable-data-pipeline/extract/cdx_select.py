@@ -0,0 +1,119 @@
+from urllib.parse import urlparse
+
+from extract.dedup import domain_of
+from pipeline import metrics
+
+HTML_MIMES = ("text/html", "application/xhtml+xml")
+# Compressed WARC record size above which a capture is not worth fetching
+MAX_RECORD_BYTES = 512 * 1024
+# Path segments below the site root ("/" is 0, "/about/team" is 2)
+MAX_URL_DEPTH = 3
+# ISO 639-3 codes of the content languages to keep (empty keeps any)
+LANGUAGES = ("eng",)
+
+DROP_REASONS = ("mime", "length", "language", "depth", "duplicate")
+
+CDX_SELECTED = metrics.counter("cdx_entries_selected_total", "CDX entries kept for fetching")
+CDX_DROPPED = {
+    reason: metrics.counter("cdx_entries_dropped_total", "CDX entries dropped before fetching", reason=reason)
+    for reason in DROP_REASONS
+}
+CDX_BYTES_AVOIDED = metrics.counter("cdx_bytes_avoided_total", "WARC bytes of CDX entries dropped before fetching")
+
+
+def url_depth(url: str) -> int:
+    return len([segment for segment in urlparse(url).path.split("/") if segment])
+
+
+def candidate_rank(record: dict) -> tuple:
+    """Lower is better: the shallowest path, without a query string, then the shortest URL."""
+    url = record.get("url") or ""
+    return url_depth(url), bool(urlparse(url).query), len(url)
+
+
+class CdxSelector:
+    """
+    Picks which CDX captures are worth fetching, before any WARC request.
+
+    Captures are dropped when their mime type (the detected one where the
+    index has it) is not HTML, their WARC record is over `max_bytes`,
+    their languages don't include one of `languages` or their URL is more
+    than `max_depth` segments deep. Fields missing from a record don't
+    count against it. Of the remaining captures of each domain in a CDX
+    page, only the best by candidate_rank() is kept, so the root page wins
+    over deep links and documents. The index is sorted by SURT key, which
+    puts a site's captures together with its root first, and a domain
+    whose captures span pages on consecutive ones. Pages must therefore
+    be selected in page order (CdxClient.iter_pages with `ordered`): a
+    domain selected on the previous page keeps that capture, and its
+    captures here are dropped as duplicates. Only the previous page's
+    domains are remembered, so memory stays at one page's worth; across
+    resumed runs and CDX units read by other workers it is still the
+    domain dedup store that keeps one page per domain.
+
+    `counts` holds kept and dropped entries per reason, `bytes_avoided` the
+    summed WARC record lengths of the dropped ones.
+    """
+
+    def __init__(self, max_bytes: int = MAX_RECORD_BYTES, max_depth: int = MAX_URL_DEPTH,
+                 languages=LANGUAGES):
+        self.max_bytes = max_bytes
+        self.max_depth = max_depth
+        self.languages = set(languages or ())
+        self.counts = {"selected": 0, **{reason: 0 for reason in DROP_REASONS}}
+        self.bytes_avoided = 0
+        # Domains selected on, or carried through, the previous page
+        self._previous = set()
+
+    def drop_reason(self, record: dict):
+        mime = record.get("mime-detected") or record.get("mime")
+        if mime and mime.split(";")[0].strip().lower() not in HTML_MIMES:
+            return "mime"
+        length = record.get("length")
+        if self.max_bytes and length and int(length) > self.max_bytes:
+            return "length"
+        languages = record.get("languages")
+        if self.languages and languages and not self.languages & set(languages.split(",")):
+            return "language"
+        if self.max_depth is not None and url_depth(record.get("url") or "") > self.max_depth:
+            return "depth"
+        return None
+
+    def _drop(self, record: dict, reason: str):
+        self.counts[reason] += 1
+        CDX_DROPPED[reason].inc()
+        length = int(record.get("length") or 0)
+        self.bytes_avoided += length
+        CDX_BYTES_AVOIDED.inc(length)
+
+    def select(self, records) -> list[dict]:
+        """The records of one CDX page worth fetching: the best per domain not selected before, in index order."""
+        best, carried = {}, set()
+        for position, record in enumerate(records):
+            reason = self.drop_reason(record)
+            if reason is not None:
+                self._drop(record, reason)
+                continue
+            domain = domain_of(record.get("url") or "")
+            if domain in self._previous:
+                carried.add(domain)
+                self._drop(record, "duplicate")
+                continue
+            current = best.get(domain)
+            if current is None or candidate_rank(record) < candidate_rank(current[1]):
+                if current is not None:
+                    self._drop(current[1], "duplicate")
+                best[domain] = (position, record)
+            else:
+                self._drop(record, "duplicate")
+        self._previous = carried.union(best)
+        selected = [record for _, record in sorted(best.values(), key=lambda item: item[0])]
+        self.counts["selected"] += len(selected)
+        CDX_SELECTED.inc(len(selected))
+        return selected
+
+    def summary(self) -> str:
+        dropped = ", ".join(f"{self.counts[reason]} {reason}" for reason in DROP_REASONS if self.counts[reason])
+        return (f"{self.counts['selected']} CDX entries selected, {sum(self.counts[r] for r in DROP_REASONS)} dropped"
+                f"{f' ({dropped})' if dropped else ''}; {self.bytes_avoided / 2 ** 20:.1f} MB of WARC records "
+                f"not fetched")
@@ -1,90 +1,37 @@
-import requests
-import json
-import random
-import time
-import os
 from warcio.archiveiterator import ArchiveIterator
 from bs4 import BeautifulSoup
-from io import BytesIO
-from sqlalchemy.exc import IntegrityError
-from db.conn import SessionLocal 
-from db.models import CrawlRecord
-from urllib.parse import urlparse
-import spacy
+from itertools import groupby
+from extract.html_extract import decode_html, extract_from_head, normalize_company_name
+from extract.cdx_client import CdxClient, domain_query, to_record
+from extract.warc_fetcher import WarcFetcher, MemberReader, MAX_RANGE_GAP, plan_ranges, split_range
+from extract.ner import NER_TEXT_CAP, NERStage, first_org, get_nlp
+from extract.cache import DiskCache, get_default_cache
+from extract.dedup import MemoryDedupStore, domain_of
+from db.page_text import TEXT_MAX_CHARS, TEXT_RETENTION, pack_text
+from pipeline import metrics
+from pipeline.journal import FAILED, FETCHED, SKIPPED, journal_key
 import re
 
-CDX_INDEX = "https://index.commoncrawl.org/CC-MAIN-2025-13-index"
-QUERY_SIZE = 1000
 MAX_PAGES = 10
 WARC_BASE = "https://data.commoncrawl.org/"
-nlp = spacy.load("en_core_web_sm")
-
-
-def search_common_crawl(domain_keyword: str, pages: int = MAX_PAGES):
-    for page in range(pages):
-        backoff = 1.0
-        max_retries = 5
-        retries = 0
-
-        while retries < max_retries:
-            try:
-                params = {
-                    "url": f"*.{domain_keyword}/*",
-                    "output": "json",
-                    "page": page,
-                    "filter": "status:200",
-                    "limit": QUERY_SIZE
-                }
-                url = f"{CDX_INDEX}?{requests.compat.urlencode(params)}"
-                response = requests.get(url, timeout=10)
-
-                if response.status_code == 200:
-                    lines = response.text.strip().split("\n")
-                    for line in lines:
-                        record = json.loads(line)
-                        yield {
-                            "url": record.get("url"),
-                            "timestamp": record.get("timestamp"),
-                            "digest": record.get("digest"),
-                            "mime": record.get("mime"),
-                            "status": record.get("status"),
-                            "filename": record.get("filename"),
-                            "offset": record.get("offset"),
-                            "length": record.get("length")
-                        }
-                    break  # success, move to next page
-                elif response.status_code in (429, 503):
-                    print(f"[!] Rate limit hit (HTTP {response.status_code}), backing off...")
-                    time.sleep(backoff)
-                    backoff *= 1.5
-                    retries += 1
-                else:
-                    print(f"[!] Unexpected status {response.status_code}, skipping page.")
-                    break
-            except requests.RequestException as e:
-                print(f"[!] Error: {e}, backing off...")
-                time.sleep(backoff)
-                backoff *= 1.5
-                retries += 1
-
-        # Always wait a random interval before next page
-        delay = random.uniform(0.5, 2.0)
-        print(f"[i] Extracted Page {page}...")
-        print(f"[i] Waiting {delay:.2f}s before next page...")
-        time.sleep(delay)
-
-def normalize_company_name(title: str) -> str:
-    """Extract cleaner company name from title string."""
-    if not title:
-        return None
-    if "–" in title:
-        return title.split("–")[-1].strip()
-    if "-" in title:
-        return title.split("-")[-1].strip()
-    return title.strip()
 
+FRAGMENTS_PARSED = metrics.counter("fragments_parsed_total", "WARC fragments parsed into crawl records")
+PARSE_ERRORS = metrics.counter("parse_errors_total", "WARC fragments that failed to parse")
+PARSE_SECONDS = metrics.timer("parse_seconds", "Time to parse one WARC fragment")
+
+
+def search_common_crawl(domain_keyword: str, pages: int = MAX_PAGES, client: CdxClient = None):
+    """
+    Yields CDX records for `*.{domain_keyword}/*`, fetching up to `pages`
+    index pages concurrently under an adaptive rate limit. Pages already in
+    the default crawl cache are not fetched again.
+    """
+    client = client or CdxClient(cache=get_default_cache())
+    for _, raw_records in client.iter_pages(domain_query(domain_keyword), pages):
+        for record in raw_records:
+            yield to_record(record)
 
-def extract_company_name_from_html(soup: BeautifulSoup, html_text: str = "") -> str:
+def extract_company_name_from_html(soup: BeautifulSoup, html_text: str = "", use_ner: bool = True) -> str:
     # 1. Meta tags
     meta_tags = [
         ('meta', {'property': 'og:site_name'}),
@@ -107,95 +54,294 @@ def extract_company_name_from_html(soup: BeautifulSoup, html_text: str = "") ->
         return normalize_company_name(h1.text)
 
     # 4. Footer pattern (e.g., © 2024 XYZ Pty Ltd)
-    footer_text = soup.get_text()
+    footer_text = html_text or soup.get_text()
     match = re.search(r'© ?\d{4} ?(.+?)(\.|All rights reserved|$)', footer_text, re.IGNORECASE)
     if match:
         return normalize_company_name(match.group(1))
 
     # 5. Named Entity Recognition (ORG)
-    if html_text:
-        doc = nlp(html_text)
-        for ent in doc.ents:
-            if ent.label_ == "ORG":
-                return normalize_company_name(ent.text)
+    if use_ner and html_text:
+        return first_org(get_nlp()(html_text[:NER_TEXT_CAP]))
 
     return None
 
 
-seen_domains = set()
-def download_and_extract_company_data(
-    entries: list[dict],
-    digest_set: set
-) -> list[dict]:
+def extract_company_fields(payload: bytes, keep_text: bool = True):
     """
-    Downloads WARC byte ranges for selected entries, parses HTML for company name,
-    and deduplicates based on digest + domain.
-    Only processes the first occurrence per domain.
+    Returns (company_name, title, text) for an HTML payload, without the NER
+    fallback: a None name with non-empty text means NER is still to be tried.
+
+    The company name is first looked for in the page <head> only; the full
+    document is parsed only when that is inconclusive or when the page text
+    is kept (`keep_text`). text is None when the head alone was enough.
     """
-    matched_records = []
+    markup = decode_html(payload)
+    if not keep_text:
+        clean_name, title_tag, resolved = extract_from_head(markup)
+        if resolved:
+            return clean_name, title_tag, None
 
-    for entry in entries:
-        if entry.get("digest") not in digest_set:
-            continue
+    # The whole document is needed anyway: parse it once, take the text once
+    soup = BeautifulSoup(markup, "html.parser")
+    text_content = soup.get_text()
+    title_tag = soup.title.string.strip() if soup.title and soup.title.string else None
+    # 🔍 Improved extraction
+    clean_name = extract_company_name_from_html(soup, text_content, use_ner=False)
 
-        target_url = entry.get("url")
-        if not target_url:
-            continue
-        parsed = urlparse(target_url)
-        domain = parsed.netloc.lower()
+    return clean_name, title_tag, text_content
 
-        # Strict: only allow one page per domain — first occurrence
-        if domain in seen_domains:
-            print(f"[i] Skipping domain already seen: {domain}")
-            continue
 
-        # Mark domain early
-        seen_domains.add(domain)
+def parse_company_record(entry: dict, fragment, text_retention: str = TEXT_RETENTION,
+                         text_max_chars: int = TEXT_MAX_CHARS):
+    """
+    Parses one gzip WARC fragment (a file object) without the NER fallback.
+
+    Returns (crawl_record, ner_text) for its response, where ner_text is the
+    page text when the name still needs NER and None otherwise, or
+    (None, None) if the fragment holds no response.
 
-        warc_path = entry["warc_path"]
-        offset = int(entry["offset"])
-        length = int(entry["length"])
-        start = offset
-        end = offset + length - 1
-        warc_url = f"{WARC_BASE}{warc_path}"
+    The record's page text is packed for crawl_page_text as `text_retention`
+    says (see db.page_text); with "none" it is not even extracted
+    when the page <head> names the company.
+    """
+    keep_text = text_retention != "none"
+    with PARSE_SECONDS.time():
+        return _parse_response(entry, fragment, keep_text, text_retention, text_max_chars)
 
-        headers = {"Range": f"bytes={start}-{end}"}
-        print(f"📦 Downloading WARC fragment: {warc_url} [{start}-{end}]")
 
-        try:
-            response = requests.get(warc_url, headers=headers, stream=True, timeout=30)
-            response.raise_for_status()
-        except Exception as e:
-            print(f"[!] Failed to fetch WARC range: {e}")
+def _parse_response(entry, fragment, keep_text, text_retention, text_max_chars):
+    for record in ArchiveIterator(fragment, arc2warc=True):
+        if record.rec_type != "response":
             continue
 
-        try:
-            for record in ArchiveIterator(response.raw, arc2warc=True):
-                if record.rec_type != "response":
-                    continue
+        clean_name, title_tag, text_content = extract_company_fields(record.content_stream().read(), keep_text)
+
+        crawl_record = {
+            "url": entry.get("url"),
+            "company_name": clean_name,
+            "title": title_tag,
+            "page_text": pack_text(text_content, text_retention, text_max_chars),
+            "text_chars": len(text_content) if keep_text and text_content else None,
+            "digest": entry.get("digest"),
+            "timestamp": entry.get("timestamp")
+        }  # Only process one record
+        FRAGMENTS_PARSED.inc()
+        return crawl_record, (text_content if clean_name is None and text_content else None)
+    return None, None
+
+
+def parse_fragment(item, text_retention: str = TEXT_RETENTION, text_max_chars: int = TEXT_MAX_CHARS):
+    """
+    Pipeline-stage form of parse_company_record for an (entry, member bytes)
+    item from iter_warc_fragments. Parse errors are logged and the item dropped.
+    """
+    entry, member = item
+    try:
+        crawl_record, ner_text = parse_company_record(entry, MemberReader(memoryview(member)), text_retention,
+                                                      text_max_chars)
+    except Exception as parse_err:
+        print(f"[!] Error parsing WARC response: {parse_err}")
+        PARSE_ERRORS.inc()
+        return None
+    return (crawl_record, ner_text) if crawl_record else None
+
+
+def extract_company_record(entry: dict, fragment, text_retention: str = TEXT_RETENTION,
+                           ner_stage: NERStage = None, text_max_chars: int = TEXT_MAX_CHARS) -> dict:
+    """
+    Parses one gzip WARC fragment and returns the crawl record for its response, if any.
+
+    Pages that need the NER fallback are queued on `ner_stage` (their
+    company_name is filled in when the stage is flushed), or run through
+    NER immediately without one.
+    """
+    crawl_record, ner_text = parse_company_record(entry, fragment, text_retention, text_max_chars)
+    if ner_text:
+        if ner_stage is None:
+            crawl_record["company_name"] = first_org(get_nlp()(ner_text[:NER_TEXT_CAP]))
+        else:
+            ner_stage.defer(crawl_record, ner_text)
+            return None
+    return crawl_record
+
+
+_default_fetcher = None
+
 
-                payload = record.content_stream().read()
-                soup = BeautifulSoup(payload, "html.parser")
-                text_content = soup.get_text()
+def get_default_fetcher() -> WarcFetcher:
+    """Shared fetcher, so keep-alive connections survive across WARC files."""
+    global _default_fetcher
+    if _default_fetcher is None:
+        _default_fetcher = WarcFetcher()
+    return _default_fetcher
 
-                # 🔍 Improved extraction
-                text_content = soup.get_text()
-                title_tag = soup.title.string.strip() if soup.title and soup.title.string else None
-                clean_name = extract_company_name_from_html(soup, text_content)
 
+def fragment_key(entry: dict) -> str:
+    return f"warc:{entry['warc_path']}:{int(entry['offset'])}:{int(entry['length'])}"
 
-                matched_records.append({
-                    "url": target_url,
-                    "company_name": clean_name,
-                    "title": title_tag,
-                    "text": text_content,
-                    "digest": entry.get("digest"),
-                    "timestamp": entry.get("timestamp")
-                })
 
-                break  # Only process one record
+# Default dedup store: domains claimed by this process so far
+seen_domains = MemoryDedupStore()
 
+
+def iter_warc_fragments(
+    entries,
+    digest_set: set = None,
+    fetcher: WarcFetcher = None,
+    warc_base: str = WARC_BASE,
+    max_range_gap: int = MAX_RANGE_GAP,
+    cache: DiskCache = None,
+    dedup=None,
+    journal=None
+):
+    """
+    Fetches the WARC fragments of `entries` (an iterable, consumed lazily)
+    concurrently and yields (entry, member) for each one as it arrives,
+    where member is a memoryview of the entry's gzip member.
+
+    Only the first entry per domain is kept: each domain is claimed in
+    `dedup` (an extract.dedup store, `seen_domains` if omitted) before any
+    lookup or request is made for it, and entries of already claimed
+    domains are skipped. Claims of fragments that fail to fetch are
+    released so a later run retries them; consumers release those of
+    fragments that fail to parse or load, or hold no company record. Fragments of the same WARC
+    file less than `max_range_gap` bytes apart are fetched with a single
+    Range request and split back up locally. With a `cache`, fragments are
+    looked up by WARC file, offset and length first, and fetched ones are
+    stored there (as-is, since members are already gzip-compressed).
+    With a pipeline.journal.CrawlJournal, skipped, fetched and failed
+    entries are marked there.
+    """
+    fetcher = fetcher or get_default_fetcher()
+    dedup = seen_domains if dedup is None else dedup
+
+    def selected_entries():
+        for entry in entries:
+            if digest_set is not None and entry.get("digest") not in digest_set:
+                continue
+
+            target_url = entry.get("url")
+            if not target_url:
+                continue
+            domain = domain_of(target_url)
+
+            # Strict: only allow one page per domain — first occurrence
+            if not dedup.claim(domain):
+                print(f"[i] Skipping domain already seen: {domain}")
+                if journal is not None:
+                    journal.mark([journal_key(entry)], SKIPPED)
+                continue
+            yield entry
+
+    def file_plans(file_entries):
+        """Range plans for one WARC file's entries, plus one plan holding its cache hits."""
+        hits, misses = [], []
+        for entry in file_entries:
+            member = cache.get(fragment_key(entry)) if cache is not None else None
+            if member is None:
+                misses.append(entry)
+            else:
+                hits.append((entry, memoryview(member)))
+        if hits:
+            yield {"cached": hits}
+        yield from plan_ranges(misses, max_gap=max_range_gap)
+
+    def plan_range(plan):
+        if "cached" in plan:
+            return None
+        return f"{warc_base}{plan['warc_path']}", plan["start"], plan["end"]
+
+    # Entries arrive grouped by WARC file; coalesce each file's nearby
+    # fragments into shared range requests
+    plans = (
+        plan
+        for _, file_entries in groupby(selected_entries(), key=lambda e: e["warc_path"])
+        for plan in file_plans(file_entries)
+    )
+
+    for plan, body, fetch_err in fetcher.fetch_all(plans, plan_range):
+        if "cached" in plan:
+            if journal is not None:
+                journal.mark([journal_key(entry) for entry, _ in plan["cached"]], FETCHED)
+            yield from plan["cached"]
+            continue
+        if fetch_err is not None:
+            print(f"[!] Failed to fetch WARC range: {fetch_err}")
+            for entry in plan["entries"]:
+                dedup.release(domain_of(entry["url"]))
+            if journal is not None:
+                journal.mark([journal_key(entry) for entry in plan["entries"]], FAILED, str(fetch_err))
+            continue
+        if journal is not None:
+            journal.mark([journal_key(entry) for entry in plan["entries"]], FETCHED)
+        for entry, member in split_range(plan, body):
+            if cache is not None:
+                cache.put(fragment_key(entry), member, compress=False)
+            yield entry, member
+
+
+def iter_company_data(
+    entries,
+    digest_set: set = None,
+    fetcher: WarcFetcher = None,
+    warc_base: str = WARC_BASE,
+    max_range_gap: int = MAX_RANGE_GAP,
+    text_retention: str = TEXT_RETENTION,
+    ner_stage: NERStage = None,
+    cache: DiskCache = None,
+    dedup=None
+):
+    """
+    Streaming form of download_and_extract_company_data: fetches the WARC
+    fragments of `entries` with iter_warc_fragments and yields each crawl
+    record as soon as its fragment has been parsed.
+
+    With `text_retention` "none" the page text is not extracted and most
+    pages are resolved from their <head> alone.
+
+    Pages left without a name by the HTML heuristics go through `ner_stage`
+    (a default NERStage if omitted) in batches; they are yielded when their
+    batch is processed.
+    """
+    ner_stage = ner_stage or NERStage()
+    dedup = seen_domains if dedup is None else dedup
+
+    for entry, member in iter_warc_fragments(entries, digest_set, fetcher, warc_base, max_range_gap, cache, dedup):
+        try:
+            record, ner_text = parse_company_record(entry, MemberReader(member), text_retention)
         except Exception as parse_err:
             print(f"[!] Error parsing WARC response: {parse_err}")
+            PARSE_ERRORS.inc()
+            record = None
+        if record is None:
+            # Only pages that yield no record give their domain back; pages
+            # deferred to NER keep it until they are yielded
+            dedup.release(domain_of(entry["url"]))
+        elif ner_text:
+            ner_stage.defer(record, ner_text)
+        else:
+            yield record
+
+        if ner_stage.full():
+            yield from ner_stage.flush()
+
+    yield from ner_stage.flush()
+
+
+def download_and_extract_company_data(
+    entries: list[dict],
+    digest_set: set,
+    fetcher: WarcFetcher = None,
+    warc_base: str = WARC_BASE,
+    max_range_gap: int = MAX_RANGE_GAP
+) -> list[dict]:
+    """
+    Downloads WARC byte ranges for selected entries, parses HTML for company name,
+    and deduplicates based on digest + domain.
+    Only processes the first occurrence per domain.
 
-    return matched_records
+    Fragments are fetched concurrently by `fetcher` (the shared default
+    fetcher if omitted) and parsed as they arrive.
+    """
+    return list(iter_company_data(entries, digest_set, fetcher, warc_base, max_range_gap,
+                                  cache=get_default_cache()))
@@ -0,0 +1,244 @@
+import math
+import sqlite3
+import threading
+from hashlib import blake2b
+from pathlib import Path
+from typing import Iterable
+from urllib.parse import urlparse
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db.conn import engine
+from db.models import CrawlDomainClaim
+
+DEDUP_PATH = Path("data/cache/domains.sqlite")
+BLOOM_CAPACITY = 10_000_000
+BLOOM_ERROR_RATE = 0.001
+SEED_BATCH_SIZE = 10_000
+
+
+def domain_of(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+class MemoryDedupStore:
+    """Domains claimed by this process, in a set. Thread-safe."""
+
+    def __init__(self):
+        self._domains = set()
+        self._lock = threading.Lock()
+
+    def claim(self, domain: str) -> bool:
+        """Marks `domain` as covered; False if it already was."""
+        with self._lock:
+            if domain in self._domains:
+                return False
+            self._domains.add(domain)
+            return True
+
+    def release(self, domain: str):
+        """Forgets a claim whose page could not be fetched, parsed or loaded, so a later run retries it."""
+        with self._lock:
+            self._domains.discard(domain)
+
+    def seed(self, domains: Iterable[str]):
+        with self._lock:
+            self._domains.update(domains)
+
+    def clear(self):
+        """Forgets every claim, for a crawl that starts over."""
+        with self._lock:
+            self._domains.clear()
+
+    def __contains__(self, domain: str) -> bool:
+        return domain in self._domains
+
+    def __len__(self):
+        return len(self._domains)
+
+
+class BloomDedupStore:
+    """
+    Fixed-size Bloom filter of claimed domains, for domain counts too large
+    for a set (about 1.8 MB per million domains at a 0.1% error rate).
+
+    A false positive makes a new domain look covered, so roughly
+    `error_rate` of new domains are skipped. Claims can't be released.
+    Thread-safe.
+    """
+
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, domain: str):
+        digest = blake2b(domain.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def _add(self, positions) -> bool:
+        added = False
+        for p in positions:
+            byte, bit = divmod(p, 8)
+            if not self._bits[byte] & (1 << bit):
+                self._bits[byte] |= 1 << bit
+                added = True
+        self._count += added
+        return added
+
+    def claim(self, domain: str) -> bool:
+        positions = self._positions(domain)
+        with self._lock:
+            return self._add(positions)
+
+    def release(self, domain: str):
+        pass
+
+    def seed(self, domains: Iterable[str]):
+        for domain in domains:
+            positions = self._positions(domain)
+            with self._lock:
+                self._add(positions)
+
+    def clear(self):
+        with self._lock:
+            self._bits = bytearray(len(self._bits))
+            self._count = 0
+
+    def __contains__(self, domain: str) -> bool:
+        return all(self._bits[p // 8] & (1 << (p % 8)) for p in self._positions(domain))
+
+    def __len__(self):
+        return self._count
+
+
+class SQLiteDedupStore:
+    """
+    Claimed domains in an on-disk SQLite index, kept across runs.
+
+    A claim is an INSERT OR IGNORE, so it is atomic across threads (each has
+    its own connection) and across processes sharing the file. Claims stay
+    until released or cleared: run_common_crawl_pipeline clears the store
+    whenever it starts a crawl over, and keeps it for --resume.
+    """
+
+    def __init__(self, path: Path = DEDUP_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        db = self._db()
+        db.execute("CREATE TABLE IF NOT EXISTS claimed_domains (domain TEXT PRIMARY KEY)")
+        db.commit()
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def claim(self, domain: str) -> bool:
+        db = self._db()
+        with db:
+            return db.execute("INSERT OR IGNORE INTO claimed_domains (domain) VALUES (?)", (domain,)).rowcount == 1
+
+    def release(self, domain: str):
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM claimed_domains WHERE domain = ?", (domain,))
+
+    def seed(self, domains: Iterable[str]):
+        db = self._db()
+        with db:
+            db.executemany("INSERT OR IGNORE INTO claimed_domains (domain) VALUES (?)", ((d,) for d in domains))
+
+    def clear(self):
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM claimed_domains")
+
+    def __contains__(self, domain: str) -> bool:
+        return self._db().execute("SELECT 1 FROM claimed_domains WHERE domain = ?", (domain,)).fetchone() is not None
+
+    def __len__(self):
+        return self._db().execute("SELECT COUNT(*) FROM claimed_domains").fetchone()[0]
+
+
+class DatabaseDedupStore:
+    """
+    Claimed domains in the pipeline database's crawl_domain_claims table,
+    shared by every process and node that writes to it.
+
+    A claim is an INSERT that does nothing on conflict, so exactly one
+    claimer gets each domain. Claims are made on behalf of `owner` (a
+    distributed work unit): a domain it already holds counts as claimed by
+    it again, so a unit retried after a crash gets its own domains back,
+    and it only releases its own claims. `released` counts releases, i.e.
+    fragments that failed to fetch.
+    """
+
+    def __init__(self, owner: str = None):
+        self.owner = owner
+        self.released = 0
+        self._insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+
+    def _owned(self):
+        return CrawlDomainClaim.owner.is_(None) if self.owner is None else CrawlDomainClaim.owner == self.owner
+
+    def claim(self, domain: str) -> bool:
+        with engine.begin() as conn:
+            stmt = self._insert(CrawlDomainClaim).values(domain=domain, owner=self.owner).on_conflict_do_nothing()
+            if conn.execute(stmt).rowcount == 1:
+                return True
+            if self.owner is None:
+                return False
+            return conn.execute(
+                select(CrawlDomainClaim.owner).where(CrawlDomainClaim.domain == domain)
+            ).scalar() == self.owner
+
+    def release(self, domain: str):
+        self.released += 1
+        with engine.begin() as conn:
+            conn.execute(CrawlDomainClaim.__table__.delete().where(CrawlDomainClaim.domain == domain, self._owned()))
+
+    def seed(self, domains: Iterable[str]):
+        rows = [{"domain": d, "owner": None} for d in set(domains)]
+        if rows:
+            with engine.begin() as conn:
+                conn.execute(self._insert(CrawlDomainClaim).on_conflict_do_nothing(), rows)
+
+    def clear(self):
+        """Forgets every claim, for a distributed crawl that starts over."""
+        with engine.begin() as conn:
+            conn.execute(CrawlDomainClaim.__table__.delete())
+
+    def __contains__(self, domain: str) -> bool:
+        with engine.connect() as conn:
+            return conn.execute(
+                select(CrawlDomainClaim.domain).where(CrawlDomainClaim.domain == domain)
+            ).first() is not None
+
+    def __len__(self):
+        with engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(CrawlDomainClaim)).scalar()
+
+
+DEDUP_STORES = {"memory": MemoryDedupStore, "bloom": BloomDedupStore, "sqlite": SQLiteDedupStore,
+                "database": DatabaseDedupStore}
+
+
+def seed_from_database(store, session) -> int:
+    """Claims the domain of every page already in crawl_records_extracted. Returns the number of pages read."""
+    rows = session.execute(text("SELECT url FROM crawl_records_extracted"), execution_options={"yield_per": SEED_BATCH_SIZE})
+    count = 0
+    for partition in rows.partitions(SEED_BATCH_SIZE):
+        store.seed(domain_of(url) for url, in partition)
+        count += len(partition)
+    return count
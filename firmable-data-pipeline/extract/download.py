@@ -0,0 +1,220 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+import requests
+
+from pipeline import metrics
+
+CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_SEGMENTS = 1
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+BACKOFF_FACTOR = 1.5
+TIMEOUT = 60
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+DOWNLOAD_BYTES = metrics.counter("download_bytes_total", "Bytes of bulk files downloaded")
+DOWNLOAD_RETRIES = metrics.counter("download_retries_total", "Bulk download requests retried or resumed")
+
+
+class RemoteFileChanged(Exception):
+    """The file changed on the server (or the server stopped honouring Range) mid-download."""
+
+
+def probe(session: requests.Session, url: str) -> Tuple[Optional[int], Optional[str], bool]:
+    """Returns (size, etag, accepts_ranges) from a HEAD request, with None/False where unknown."""
+    try:
+        response = session.head(url, allow_redirects=True, timeout=TIMEOUT)
+    except requests.RequestException:
+        return None, None, False
+    if response.status_code != 200:
+        return None, None, False
+    length = response.headers.get("Content-Length")
+    size = int(length) if length and length.isdigit() else None
+    accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+    return size, response.headers.get("ETag"), accepts_ranges
+
+
+def plan_segments(size: int, segments: int) -> list[list[int]]:
+    """Splits [0, size) into `segments` byte ranges of the form [start, end (inclusive), done]."""
+    segments = max(1, min(segments, size))
+    step = -(-size // segments)
+    return [[start, min(start + step, size) - 1, 0] for start in range(0, size, step)]
+
+
+class _PartState:
+    """
+    Progress of a ranged download, kept next to the .part file so an
+    interrupted download resumes only if the remote file is unchanged.
+    """
+
+    def __init__(self, path: Path, url: str, size: int, etag: Optional[str], segments: list):
+        self.path = path
+        self.url = url
+        self.size = size
+        self.etag = etag
+        self.segments = segments
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Path, url: str, size: int, etag: Optional[str]):
+        try:
+            saved = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        if (saved.get("url"), saved.get("size"), saved.get("etag")) != (url, size, etag):
+            return None
+        return cls(path, url, size, etag, saved["segments"])
+
+    def save(self):
+        with self.lock:
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text(json.dumps({"url": self.url, "size": self.size, "etag": self.etag, "segments": self.segments}))
+            os.replace(tmp, self.path)
+
+    def downloaded(self) -> int:
+        return sum(done for _, _, done in self.segments)
+
+
+def _fetch_segment(session, url, part_path, segment, state, chunk_size, max_retries, backoff):
+    """Downloads the rest of one [start, end, done] segment into part_path, resuming after failures."""
+    for attempt in range(max_retries + 1):
+        start, end, done = segment
+        if start + done > end:
+            return
+        headers = {"Range": f"bytes={start + done}-{end}"}
+        if state.etag:
+            headers["If-Range"] = state.etag
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                if response.status_code == 200:
+                    raise RemoteFileChanged(f"{url} answered a Range request with the full file")
+                response.raise_for_status()
+                with open(part_path, "r+b") as f:
+                    f.seek(start + done)
+                    for chunk in response.iter_content(chunk_size):
+                        chunk = chunk[:end + 1 - (start + segment[2])]
+                        f.write(chunk)
+                        f.flush()
+                        DOWNLOAD_BYTES.inc(len(chunk))
+                        with state.lock:
+                            segment[2] += len(chunk)
+                        if len(state.segments) > 1:
+                            state.save()
+            if start + segment[2] > end:
+                return
+            error = requests.exceptions.ChunkedEncodingError(f"{url} ended early at byte {start + segment[2]}")
+        except RETRY_ERRORS as e:
+            error = e
+        if attempt == max_retries:
+            raise error
+        print(f"[!] {error}, resuming at byte {start + segment[2]} in {backoff:.1f}s...")
+        DOWNLOAD_RETRIES.inc()
+        time.sleep(backoff)
+        backoff *= BACKOFF_FACTOR
+
+
+def _stream_whole(session, url, part_path, chunk_size, max_retries, backoff):
+    """Fallback for servers without Range support: restart from byte 0 after a failure."""
+    for attempt in range(max_retries + 1):
+        try:
+            with session.get(url, stream=True, timeout=TIMEOUT) as response:
+                response.raise_for_status()
+                with open(part_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+                        DOWNLOAD_BYTES.inc(len(chunk))
+            return
+        except RETRY_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            print(f"[!] {e}, restarting download in {backoff:.1f}s...")
+            DOWNLOAD_RETRIES.inc()
+            time.sleep(backoff)
+            backoff *= BACKOFF_FACTOR
+
+
+def _download_ranged(session, url, part_path, state_path, size, etag, segments, chunk_size, max_retries, backoff):
+    state = _PartState.load(state_path, url, size, etag) if part_path.exists() else None
+    if state is not None and len(state.segments) == 1:
+        # A single stream's progress is whatever reached the disk
+        state.segments[0][2] = min(part_path.stat().st_size, size)
+    if state is None:
+        state = _PartState(state_path, url, size, etag, plan_segments(size, segments))
+        with open(part_path, "wb") as f:
+            if len(state.segments) > 1:
+                f.truncate(size)
+        state.save()
+        print(f"📥 Downloading {url} ({size} bytes, {len(state.segments)} segment(s))")
+    else:
+        print(f"📥 Resuming {url} at {state.downloaded()} of {size} bytes")
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(state.segments)) as pool:
+            futures = [
+                pool.submit(_fetch_segment, session, url, part_path, segment, state, chunk_size, max_retries, backoff)
+                for segment in state.segments
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        state.save()
+
+
+def download_file(
+    url: str,
+    dest: Path,
+    segments: int = DOWNLOAD_SEGMENTS,
+    chunk_size: int = CHUNK_SIZE,
+    max_retries: int = MAX_RETRIES,
+    backoff: float = BACKOFF_SECONDS,
+    session: requests.Session = None
+) -> Path:
+    """
+    Streams `url` to `dest` through `dest`.part, in constant memory.
+
+    When the server reports a size and accepts Range requests, the download
+    resumes from what an earlier, interrupted run left in the .part file
+    (as long as the ETag is unchanged; If-Range guards against the file
+    changing in between), and can be split into `segments` byte ranges
+    fetched in parallel. The .part file is renamed onto `dest` only once
+    its size matches the server's.
+    """
+    dest = Path(dest)
+    part_path = dest.with_name(dest.name + ".part")
+    state_path = dest.with_name(dest.name + ".part.json")
+    own_session = session is None
+    session = session or requests.Session()
+
+    try:
+        size, etag, accepts_ranges = probe(session, url)
+        if not size or not accepts_ranges:
+            print(f"📥 Downloading {url} (no resume support)")
+            _stream_whole(session, url, part_path, chunk_size, max_retries, backoff)
+        else:
+            try:
+                _download_ranged(session, url, part_path, state_path, size, etag, segments,
+                                 chunk_size, max_retries, backoff)
+            except RemoteFileChanged as e:
+                # Nothing already on disk can be trusted; start over once
+                print(f"[!] {e}, restarting download...")
+                state_path.unlink(missing_ok=True)
+                part_path.unlink(missing_ok=True)
+                size, etag, _ = probe(session, url)
+                _download_ranged(session, url, part_path, state_path, size, etag, segments,
+                                 chunk_size, max_retries, backoff)
+
+        actual = part_path.stat().st_size
+        if size is not None and actual != size:
+            raise IOError(f"Downloaded {actual} bytes of {url}, expected {size}")
+        os.replace(part_path, dest)
+        state_path.unlink(missing_ok=True)
+        return dest
+    finally:
+        if own_session:
+            session.close()
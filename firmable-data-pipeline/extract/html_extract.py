@@ -0,0 +1,78 @@
+import re
+from typing import Optional, Tuple
+
+from bs4 import BeautifulSoup, UnicodeDammit
+
+try:
+    import lxml  # noqa: F401
+    HEAD_PARSER = "lxml"
+except ImportError:
+    HEAD_PARSER = "html.parser"
+
+# Meta tags tried, in order, before falling back to <title>. Each rule carries
+# a marker string that must appear in the markup for the tag to be present.
+META_TAGS = [
+    (('meta', {'property': 'og:site_name'}), "og:site_name"),
+    (('meta', {'name': 'og:site_name'}), "og:site_name"),
+    (('meta', {'name': 'description'}), "description"),
+    (('meta', {'property': 'og:title'}), "og:title"),
+]
+
+HEAD_END = re.compile(r"</head\s*>|<body[\s>]", re.IGNORECASE)
+
+
+def normalize_company_name(title: str) -> str:
+    """Extract cleaner company name from title string."""
+    if not title:
+        return None
+    if "–" in title:
+        return title.split("–")[-1].strip()
+    if "-" in title:
+        return title.split("-")[-1].strip()
+    return title.strip()
+
+
+def decode_html(payload: bytes) -> str:
+    """Decodes a page the same way BeautifulSoup(payload, "html.parser") does."""
+    return UnicodeDammit(payload, is_html=True).unicode_markup or ""
+
+
+def extract_from_head(markup: str) -> Tuple[Optional[str], Optional[str], bool]:
+    """
+    Fast path for extract_company_name_from_html: parses only the <head> of
+    the page.
+
+    Returns (company_name, title, resolved). When `resolved` is False the
+    head alone cannot give the same answer as the full-document extractor
+    (no usable meta tag or title in the head, or a higher-priority tag may
+    appear after it) and the caller must fall back to parsing the whole page.
+    `title` is the stripped first <title> string whenever the head has one.
+    """
+    head_end = HEAD_END.search(markup)
+    if not head_end:
+        return None, None, False
+    tail = markup[head_end.start():]
+    head = BeautifulSoup(markup[:head_end.start()], HEAD_PARSER)
+
+    if HEAD_PARSER == "lxml" and head.title and "<" in (head.title.string or ""):
+        # lxml keeps markup inside <title> as text where html.parser builds child
+        # nodes (and .string becomes None), so only html.parser can answer here
+        return None, None, False
+    title = head.title.string.strip() if head.title and head.title.string else None
+    if title is None and "<title" in tail.lower():
+        # The document's first <title> may come after the head
+        return None, None, False
+
+    for tag, marker in META_TAGS:
+        meta = head.find(*tag)
+        if meta is None:
+            if marker in tail:
+                # The first match in document order could be after the head
+                return None, title, False
+            continue
+        if meta.get('content'):
+            return normalize_company_name(meta['content']), title, True
+
+    if head.title and head.title.string:
+        return normalize_company_name(head.title.string), title, True
+    return None, title, False
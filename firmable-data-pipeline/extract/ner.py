@@ -0,0 +1,87 @@
+import threading
+from typing import Optional
+
+from extract.html_extract import normalize_company_name
+from pipeline import metrics
+
+NER_MODEL = "en_core_web_sm"
+# Pipes of NER_MODEL that ORG extraction does not need
+NER_EXCLUDED_PIPES = ["tagger", "parser", "attribute_ruler", "lemmatizer", "senter"]
+NER_BATCH_SIZE = 64
+NER_TEXT_CAP = 20_000
+NER_N_PROCESS = 1
+
+NER_FALLBACKS = metrics.counter("ner_fallbacks_total", "Pages whose company name was left to NER")
+NER_BATCH_SECONDS = metrics.timer("ner_batch_seconds", "Time to run NER over one batch")
+
+_nlp = None
+_nlp_lock = threading.Lock()
+
+
+def get_nlp():
+    """Loads the spaCy model on first use, without the pipes NER does not need."""
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                import spacy
+                _nlp = spacy.load(NER_MODEL, exclude=NER_EXCLUDED_PIPES)
+    return _nlp
+
+
+def first_org(doc) -> Optional[str]:
+    for ent in doc.ents:
+        if ent.label_ == "ORG":
+            return normalize_company_name(ent.text)
+    return None
+
+
+class NERStage:
+    """
+    Deferred named-entity fallback for company names.
+
+    Crawl records whose name could not be found by the cheaper HTML
+    heuristics are queued with their page text (capped at `text_cap`
+    characters) and resolved in batches through `nlp.pipe`, optionally
+    across `n_process` processes.
+    """
+
+    def __init__(self, batch_size: int = NER_BATCH_SIZE, text_cap: int = NER_TEXT_CAP,
+                 n_process: int = NER_N_PROCESS):
+        self.batch_size = batch_size
+        self.text_cap = text_cap
+        self.n_process = n_process
+        self.pending = []
+
+    def defer(self, record: dict, text: str):
+        self.pending.append((record, text[:self.text_cap]))
+        NER_FALLBACKS.inc()
+
+    def full(self) -> bool:
+        return len(self.pending) >= self.batch_size
+
+    def flush(self) -> list[dict]:
+        """Runs NER over every queued page and returns the queued records."""
+        if not self.pending:
+            return []
+        records, texts = zip(*self.pending)
+        self.pending = []
+        try:
+            with NER_BATCH_SECONDS.time():
+                docs = get_nlp().pipe(texts, batch_size=self.batch_size, n_process=self.n_process)
+                for record, doc in zip(records, docs):
+                    record["company_name"] = first_org(doc)
+        except Exception as e:
+            print(f"[!] NER failed for a batch of {len(records)} pages: {e}")
+        return list(records)
+
+    def resolve(self, items) -> list[dict]:
+        """
+        Pipeline-stage form: takes (record, ner_text) pairs, runs NER over
+        those with text and returns every record, in order.
+        """
+        for record, text in items:
+            if text:
+                self.defer(record, text)
+        self.flush()
+        return [record for record, _ in items]
@@ -0,0 +1,199 @@
+import io
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pipeline import metrics
+
+MAX_CONCURRENCY = 16
+PER_HOST_CONCURRENCY = 8
+MAX_RETRIES = 5
+RETRY_STATUSES = (429, 503)
+BACKOFF_SECONDS = 1.0
+BACKOFF_FACTOR = 1.5
+TIMEOUT = 30
+# Neighbouring fragments of one WARC file closer than this are fetched in one request
+MAX_RANGE_GAP = 32 * 1024
+# ...as long as the merged request stays below this size
+MAX_RANGE_SPAN = 8 * 1024 * 1024
+
+WARC_REQUESTS = metrics.counter("warc_requests_total", "WARC range requests sent")
+WARC_RETRIES = metrics.counter("warc_retries_total", "WARC range requests retried")
+WARC_REQUEST_SECONDS = metrics.timer("warc_request_seconds", "WARC range request latency")
+WARC_BYTES = metrics.counter("warc_bytes_total", "Bytes of WARC data fetched")
+
+
+def plan_ranges(entries: list[dict], max_gap: int = MAX_RANGE_GAP, max_span: int = MAX_RANGE_SPAN) -> list[dict]:
+    """
+    Coalesces the byte ranges of one WARC file's entries into fewer requests.
+
+    Entries are sorted by offset and merged while the gap to the previous
+    range is at most `max_gap` and the merged range stays within `max_span`
+    bytes. Returns plans of the form
+    {"warc_path", "start", "end" (inclusive), "entries"}.
+    """
+    plans = []
+    for entry in sorted(entries, key=lambda e: int(e["offset"])):
+        start = int(entry["offset"])
+        end = start + int(entry["length"]) - 1
+        plan = plans[-1] if plans else None
+        if plan and start - plan["end"] - 1 <= max_gap and max(end, plan["end"]) - plan["start"] < max_span:
+            plan["end"] = max(end, plan["end"])
+            plan["entries"].append(entry)
+        else:
+            plans.append({"warc_path": entry.get("warc_path"), "start": start, "end": end, "entries": [entry]})
+    return plans
+
+
+def split_range(plan: dict, body: bytes) -> Iterator[Tuple[dict, memoryview]]:
+    """Yields (entry, member) for each entry of a fetched plan, slicing `body` without copying."""
+    view = memoryview(body)
+    for entry in plan["entries"]:
+        start = int(entry["offset"]) - plan["start"]
+        yield entry, view[start:start + int(entry["length"])]
+
+
+class MemberReader(io.RawIOBase):
+    """Read-only file object over a memoryview, so ArchiveIterator can parse a slice in place."""
+
+    def __init__(self, view: memoryview):
+        self.view = view
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), len(self.view) - self.pos)
+        buffer[:n] = self.view[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+class WarcFetcher:
+    """
+    Concurrent HTTP byte-range fetcher.
+
+    Requests run on a bounded thread pool sharing one keep-alive
+    `requests.Session`. Concurrency is capped globally (`max_concurrency`)
+    and per host (`per_host_concurrency`). Responses with a status in
+    RETRY_STATUSES, and connection errors, are retried with exponential
+    backoff, honouring a numeric Retry-After header.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENCY,
+        per_host_concurrency: int = PER_HOST_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+        backoff: float = BACKOFF_SECONDS,
+        timeout: float = TIMEOUT,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_concurrency, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._host_slots = defaultdict(lambda: threading.BoundedSemaphore(per_host_concurrency))
+        self._host_slots_lock = threading.Lock()
+
+    def close(self):
+        self.session.close()
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        with self._host_slots_lock:
+            return self._host_slots[urlparse(url).netloc]
+
+    def fetch_range(self, url: str, start: int, end: int) -> bytes:
+        """Fetches bytes [start, end] (inclusive) of `url`, retrying as configured."""
+        backoff = self.backoff
+        headers = {"Range": f"bytes={start}-{end}"}
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                with self._host_slot(url):
+                    WARC_REQUESTS.inc()
+                    with WARC_REQUEST_SECONDS.time():
+                        response = self.session.get(url, headers=headers, timeout=self.timeout)
+                    if response.status_code not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        body = response.content
+                        WARC_BYTES.inc(len(body))
+                        # Servers that ignore Range send the whole file
+                        if response.status_code == 200:
+                            body = body[start:end + 1]
+                        return body
+                    retry_after = response.headers.get("Retry-After")
+                    error = requests.HTTPError(f"HTTP {response.status_code}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if attempt == self.max_retries:
+                raise error
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else backoff
+            WARC_RETRIES.inc()
+            print(f"[!] {error} fetching {url} [{start}-{end}], retrying in {delay:.1f}s...")
+            time.sleep(delay)
+            backoff *= BACKOFF_FACTOR
+
+    def fetch_all(
+        self,
+        jobs: Iterable,
+        job_range: Callable[[object], Tuple[str, int, int]],
+    ) -> Iterator[Tuple[object, Optional[bytes], Optional[Exception]]]:
+        """
+        Fetches every job concurrently and yields (job, body, error) as each
+        request completes, so the caller can parse fragments while the rest
+        are still in flight. `job_range` maps a job to (url, start, end), or
+        to None for a job that needs no request (e.g. already cached); those
+        are yielded back as (job, None, None).
+
+        `jobs` is consumed lazily; at most twice `max_concurrency` requests are
+        queued at any time.
+        """
+        jobs = iter(jobs)
+        max_in_flight = self.max_concurrency * 2
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            in_flight = {}
+            ready = deque()
+
+            def submit_next() -> bool:
+                job = next(jobs, None)
+                if job is None:
+                    return False
+                request = job_range(job)
+                if request is None:
+                    ready.append(job)
+                else:
+                    in_flight[pool.submit(self.fetch_range, *request)] = job
+                return True
+
+            while len(in_flight) < max_in_flight and len(ready) < max_in_flight and submit_next():
+                pass
+
+            while in_flight or ready:
+                while ready:
+                    yield ready.popleft(), None, None
+                    submit_next()
+                if not in_flight:
+                    continue
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    error = future.exception()
+                    yield job, (None if error else future.result()), error
+                    submit_next()
@@ -18,13 +18,22 @@ CREATE TABLE abr_records_extracted (
 CREATE TABLE crawl_records_extracted (
     url TEXT PRIMARY KEY,
     title TEXT,
-    text TEXT,
     timestamp TEXT,
     company_name TEXT,
     digest TEXT UNIQUE,
     CONSTRAINT _url_uc UNIQUE (url)
 );
 
+-- Page text, zlib-compressed and kept out of crawl_records_extracted
+CREATE TABLE crawl_page_text (
+    url TEXT PRIMARY KEY REFERENCES crawl_records_extracted(url) ON DELETE CASCADE,
+    content BYTEA,
+    chars INTEGER,
+    timestamp TEXT
+);
+-- Already compressed: store out of line without TOAST recompressing it
+ALTER TABLE crawl_page_text ALTER COLUMN content SET STORAGE EXTERNAL;
+
 CREATE TABLE matched_entities (
     abn TEXT REFERENCES abr_records_extracted(abn) ON DELETE CASCADE,
     url TEXT REFERENCES crawl_records_extracted(url) ON DELETE CASCADE,
@@ -34,6 +43,37 @@ CREATE TABLE matched_entities (
     PRIMARY KEY (abn, url)
 );
 
+CREATE TABLE match_fingerprints (
+    source TEXT,
+    key TEXT,
+    fingerprint TEXT,
+    PRIMARY KEY (source, key)
+);
+
+CREATE TABLE abr_fingerprints (
+    abn TEXT PRIMARY KEY,
+    record_updated TEXT,
+    content_hash BIGINT
+);
+
+CREATE TABLE crawl_domain_claims (
+    domain TEXT PRIMARY KEY,
+    owner TEXT
+);
+
+CREATE TABLE work_leases (
+    key TEXT PRIMARY KEY,
+    kind TEXT,
+    payload TEXT,
+    priority INTEGER DEFAULT 0,
+    status TEXT,
+    owner TEXT,
+    lease_expires DOUBLE PRECISION,
+    attempts INTEGER DEFAULT 0,
+    error TEXT,
+    updated DOUBLE PRECISION
+);
+
 -- 3. Create B-tree and GIN indexes
 
 -- B-tree
@@ -44,6 +84,8 @@ CREATE INDEX ix_crawl_records_extracted_timestamp ON crawl_records_extracted (ti
 CREATE INDEX ix_crawl_records_extracted_company_name ON crawl_records_extracted (company_name);
 CREATE INDEX ix_company_name_digest ON crawl_records_extracted (company_name, digest);
 CREATE INDEX ix_similarity_entity_company ON matched_entities (similarity_score, entity_name, company_name);
+CREATE INDEX ix_work_leases_kind ON work_leases (kind);
+CREATE INDEX ix_work_leases_claimable ON work_leases (status, priority, key);
 
 -- GIN (Trigram for fuzzy matching)
 CREATE INDEX IF NOT EXISTS idx_abr_entity_name_trgm
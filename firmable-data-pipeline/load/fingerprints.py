@@ -0,0 +1,107 @@
+from hashlib import blake2b
+
+import numpy as np
+from sqlalchemy import text
+
+from load.loader import ABR_COLUMNS
+from pipeline import metrics
+
+FINGERPRINT_TABLE = "abr_fingerprints"
+
+ABR_CHANGES = {
+    outcome: metrics.counter("abr_changes_total", "ABR records by change-detection outcome", outcome=outcome)
+    for outcome in ("inserted", "updated", "skipped")
+}
+
+
+def abr_content_hash(record: dict) -> int:
+    """Signed 64-bit hash of every loaded column of an ABR record, record_updated included."""
+    content = "\x1f".join("" if record.get(c) is None else str(record.get(c)) for c in ABR_COLUMNS)
+    return int.from_bytes(blake2b(content.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+class ABRChangeFilter:
+    """
+    Drops ABR records that are unchanged since they were last loaded.
+
+    The fingerprints of the previous load are held as two sorted int64
+    arrays (numeric ABN, content hash), about 16 bytes per ABN, and looked
+    up a batch at a time. ABNs loaded during this run, and any non-numeric
+    ones, live in a small overflow dict. Counts records as it goes:
+    "inserted" ABNs have no stored fingerprint yet, "updated" ones changed
+    and "skipped" ones are identical to their last load.
+    """
+
+    def __init__(self, abns: np.ndarray = None, hashes: np.ndarray = None, overflow: dict = None):
+        self.abns = abns if abns is not None else np.empty(0, dtype=np.int64)
+        self.hashes = hashes if hashes is not None else np.empty(0, dtype=np.int64)
+        self.overflow = overflow or {}
+        self.counts = {"inserted": 0, "updated": 0, "skipped": 0}
+
+    def __len__(self):
+        return len(self.abns) + len(self.overflow)
+
+    @classmethod
+    def load(cls, session) -> "ABRChangeFilter":
+        """
+        Reads the stored fingerprints. Only ABNs still present in
+        abr_records_extracted count, so deleted rows are reloaded.
+        """
+        abns, hashes, overflow = [], [], {}
+        rows = session.execute(
+            text(f"""
+                SELECT f.abn, f.content_hash
+                FROM {FINGERPRINT_TABLE} f
+                JOIN abr_records_extracted a ON a.abn = f.abn
+            """),
+            execution_options={"yield_per": 100_000}
+        )
+        for abn, content_hash in rows:
+            if abn.isdigit() and len(abn) < 19:
+                abns.append(int(abn))
+                hashes.append(content_hash)
+            else:
+                overflow[abn] = content_hash
+        abns = np.array(abns, dtype=np.int64)
+        hashes = np.array(hashes, dtype=np.int64)
+        order = np.argsort(abns, kind="stable")
+        return cls(abns[order], hashes[order], overflow)
+
+    def _stored(self, abns: list[str]) -> list:
+        """Hash of each ABN in the sorted arrays, or None."""
+        stored = [None] * len(abns)
+        numeric = [i for i, abn in enumerate(abns) if abn.isdigit() and len(abn) < 19]
+        if numeric and len(self.abns):
+            keys = np.array([int(abns[i]) for i in numeric], dtype=np.int64)
+            pos = np.minimum(np.searchsorted(self.abns, keys), len(self.abns) - 1)
+            found = self.abns[pos] == keys
+            for i, hit, p in zip(numeric, found, pos):
+                if hit:
+                    stored[i] = int(self.hashes[p])
+        return stored
+
+    def split(self, records: list[dict]) -> tuple[list[dict], list[dict]]:
+        """
+        Returns (changed records, their fingerprint rows) for one batch and
+        remembers the new fingerprints for the rest of the run.
+        """
+        records = [r for r in records if r.get("abn")]
+        stored = self._stored([r["abn"] for r in records])
+        changed, fingerprints = [], []
+        for record, old_hash in zip(records, stored):
+            # Loaded earlier in this run (or even earlier in this batch)
+            old_hash = self.overflow.get(record["abn"], old_hash)
+            content_hash = abr_content_hash(record)
+            outcome = "skipped" if old_hash == content_hash else "inserted" if old_hash is None else "updated"
+            self.counts[outcome] += 1
+            ABR_CHANGES[outcome].inc()
+            if outcome == "skipped":
+                continue
+            self.overflow[record["abn"]] = content_hash
+            changed.append(record)
+            fingerprints.append({
+                "abn": record["abn"],
+                "record_updated": record.get("record_updated"),
+                "content_hash": content_hash
+            })
+        return changed, fingerprints
@@ -1,16 +1,227 @@
-from db.models import ABRRecord
-from db.models import CrawlRecord
+import csv
+import io
+import time
+from datetime import date, datetime
+
+from db.models import ABRRecord, ABRFingerprint
+from db.models import CrawlRecord, CrawlPageText
 from db.conn import SessionLocal
+from db.writer import write
+from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from pipeline import metrics
 BATCH_SIZE = 500
-def load_abr_records(records):
+
+ABR_COLUMNS = [
+    "abn", "entity_name", "entity_type", "entity_status", "address",
+    "postcode", "state", "start_date", "record_updated"
+]
+FINGERPRINT_COLUMNS = ["abn", "record_updated", "content_hash"]
+CRAWL_COLUMNS = ["url", "title", "timestamp", "company_name", "digest"]
+# Columns refreshed when a crawl page is seen again with a newer timestamp
+CRAWL_UPDATE_COLUMNS = ["title", "timestamp"]
+PAGE_TEXT_COLUMNS = ["url", "content", "chars", "timestamp"]
+COPY_NULL = "\\N"
+COPY_OPTIONS = "(FORMAT csv, NULL '\\N')"
+
+
+def _parse_date(value):
+    """ABR dates come as YYYYMMDD strings; the Date column wants a date."""
+    if value is None or isinstance(value, date):
+        return value
+    if len(value) == 8 and value.isdigit():
+        # The usual case, without strptime's overhead
+        try:
+            return date(int(value[:4]), int(value[4:6]), int(value[6:]))
+        except ValueError:
+            return None
+    for fmt in ("%Y%m%d", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _abr_rows(records) -> list[dict]:
+    """Keyed by ABN; a later record in the batch replaces an earlier one, as merge() would."""
+    rows = {}
+    for r in records:
+        abn = r.get("abn")
+        if not abn:
+            continue
+        row = {column: r.get(column) for column in ABR_COLUMNS}
+        row["start_date"] = _parse_date(row["start_date"])
+        rows[abn] = row
+    return list(rows.values())
+
+
+def _newest_by_url(records) -> dict:
+    """Keyed by URL, keeping the newest capture of each page in the batch."""
+    newest = {}
+    for r in records:
+        if not (r.get("digest") and r.get("url")):
+            continue
+        current = newest.get(r["url"])
+        if current is None or (r.get("timestamp") or "") > (current.get("timestamp") or ""):
+            newest[r["url"]] = r
+    return newest
+
+
+def _crawl_rows(newest: dict) -> list[dict]:
+    return [{column: r.get(column) for column in CRAWL_COLUMNS} for r in newest.values()]
+
+
+def _page_text_rows(newest: dict) -> list[dict]:
+    """crawl_page_text rows for the pages whose newest capture kept any (packed) text."""
+    return [
+        {"url": url, "content": r["page_text"], "chars": r.get("text_chars"), "timestamp": r.get("timestamp")}
+        for url, r in newest.items() if r.get("page_text") is not None
+    ]
+
+
+def copy_buffer(rows: list[dict], columns: list[str]) -> io.StringIO:
+    """
+    Encodes rows as CSV for COPY_OPTIONS: NULLs are written as an unquoted
+    \\N, bytes in bytea hex form, and NUL characters (which PostgreSQL text
+    cannot hold) are dropped.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in rows:
+        writer.writerow([
+            COPY_NULL if row[c] is None
+            else "\\x" + row[c].hex() if isinstance(row[c], bytes)
+            else str(row[c]).replace("\x00", "")
+            for c in columns
+        ])
+    buffer.seek(0)
+    return buffer
+
+
+def _copy_upsert(session, table: str, columns: list[str], rows: list[dict], key: str,
+                 update_columns: list[str], newer_column: str = None):
+    """
+    PostgreSQL path: COPY the batch into an UNLOGGED staging table shaped
+    like `table`, then apply it with one INSERT ... ON CONFLICT. TRUNCATE
+    holds the staging table's lock until commit, so concurrent loaders of
+    the same table take turns instead of mixing batches.
+    """
+    staging = f"{table}_staging"
+    column_list = ", ".join(columns)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in update_columns)
+    where = f" WHERE EXCLUDED.{newer_column} > {table}.{newer_column}" if newer_column else ""
+
+    session.execute(text(f"CREATE UNLOGGED TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS)"))
+    session.execute(text(f"TRUNCATE {staging}"))
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH {COPY_OPTIONS}", copy_buffer(rows, columns))
+    finally:
+        cursor.close()
+    session.execute(text(
+        f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} "
+        f"ON CONFLICT ({key}) DO UPDATE SET {updates}{where}"
+    ))
+
+
+def _sqlite_value(value):
+    # Dates as SQLAlchemy's SQLite Date type stores them
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def _sqlite_upsert(session, table: str, columns: list[str], rows: list[dict], key: str,
+                   update_columns: list[str], newer_column: str = None):
+    """
+    SQLite path: one INSERT ... ON CONFLICT executemany'd on the raw sqlite3
+    cursor with positional rows, skipping SQLAlchemy's per-row parameter
+    processing (most of the cost of a batch). Runs in the session's
+    transaction.
+    """
+    updates = ", ".join(f"{c} = excluded.{c}" for c in update_columns)
+    where = f" WHERE excluded.{newer_column} > {table}.{newer_column}" if newer_column else ""
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT ({key}) DO UPDATE SET {updates}{where}",
+            [tuple(_sqlite_value(row[c]) for c in columns) for row in rows]
+        )
+    finally:
+        cursor.close()
+
+
+def _insert_upsert(session, model, rows: list[dict], key: str, update_columns: list[str],
+                   newer_column: str = None):
+    """
+    Fallback for PostgreSQL drivers without COPY: one compiled
+    INSERT ... ON CONFLICT statement executed for the whole batch.
+    """
+    insert = postgresql.insert if session.get_bind().dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_={c: stmt.excluded[c] for c in update_columns},
+        where=(stmt.excluded[newer_column] > getattr(model, newer_column)) if newer_column else None
+    )
+    session.execute(stmt, rows)
+
+
+def bulk_upsert(session, model, rows: list[dict], columns: list[str], key: str,
+                update_columns: list[str], newer_column: str = None):
+    """
+    Set-based upsert of `rows` (unique on `key`) into `model`'s table.
+
+    PostgreSQL over psycopg2 uses COPY into a staging table, SQLite a raw
+    executemany of INSERT ... ON CONFLICT, and other PostgreSQL drivers a
+    compiled multi-row INSERT ... ON CONFLICT. Any other
+    dialect falls back to looking rows up and updating them one by one. When `newer_column` is
+    given, existing rows are only updated if the incoming value is greater.
+
+    Returns (table, rows, seconds) for _count_loaded, or None if there were
+    no rows; the metrics wait for the commit, since the writer may re-run a job.
+    """
+    if not rows:
+        return None
+    started = time.perf_counter()
+    _upsert(session, model, rows, columns, key, update_columns, newer_column)
+    return model.__tablename__, len(rows), time.perf_counter() - started
+
+
+def _count_loaded(upserts):
+    for upsert in upserts:
+        if upsert is None:
+            continue
+        table, rows, seconds = upsert
+        metrics.counter("rows_loaded_total", "Rows upserted into the database", table=table).inc(rows)
+        metrics.timer("load_batch_seconds", "Time to upsert one batch", table=table).observe(seconds)
+
+
+def _upsert(session, model, rows, columns, key, update_columns, newer_column):
+    bind = session.get_bind()
+    dialect = bind.dialect.name
+    if dialect == "postgresql" and bind.dialect.driver == "psycopg2":
+        _copy_upsert(session, model.__tablename__, columns, rows, key, update_columns, newer_column)
+    elif dialect == "sqlite":
+        _sqlite_upsert(session, model.__tablename__, columns, rows, key, update_columns, newer_column)
+    elif dialect == "postgresql":
+        _insert_upsert(session, model, rows, key, update_columns, newer_column)
+    else:
+        for row in rows:
+            existing = session.get(model, row[key])
+            if existing is None:
+                session.add(model(**row))
+            elif newer_column is None or (row[newer_column] or "") > (getattr(existing, newer_column) or ""):
+                for column in update_columns:
+                    setattr(existing, column, row[column])
+
+
+def merge_abr_records(records):
+    """Previous row-by-row loader (a SELECT plus INSERT/UPDATE per ABN), kept for comparison."""
     session = SessionLocal()
     try:
-        for r in records:
-            abn = r.get("abn")
-            if not abn:
-                continue
+        for r in _abr_rows(records):
             record = ABRRecord(**r)
             session.merge(record)  # upsert: insert if not exists, else update
 
@@ -21,28 +232,36 @@ def load_abr_records(records):
     finally:
         session.close()
 
+
+def load_abr_records(records, fingerprints=None):
+    """
+    Upserts ABR records, and their change-detection fingerprints (if given) in the same transaction.
+    On SQLite the write runs on the shared db.writer thread, possibly committed with other loads.
+    """
+    rows = _abr_rows(records)
+    fingerprint_rows = list({f["abn"]: f for f in fingerprints}.values()) if fingerprints else []
+
+    def upsert(session):
+        return [
+            bulk_upsert(session, ABRRecord, rows, ABR_COLUMNS, "abn", [c for c in ABR_COLUMNS if c != "abn"]),
+            bulk_upsert(session, ABRFingerprint, fingerprint_rows, FINGERPRINT_COLUMNS, "abn", FINGERPRINT_COLUMNS[1:]),
+        ]
+
+    _count_loaded(write(upsert))
+
+
 def load_crawl_records(records):
-    session = SessionLocal()
-    try:
-        valid_records = [r for r in records if r.get("digest") and r.get("url")]
-        for i in range(0, len(valid_records), BATCH_SIZE):
-            batch = valid_records[i:i + BATCH_SIZE]
-
-            stmt = insert(CrawlRecord).values(batch)
-            stmt = stmt.on_conflict_do_update(
-                index_elements=["url"],
-                set_={
-                    "title": stmt.excluded.title,
-                    "text": stmt.excluded.text,
-                    "timestamp": stmt.excluded.timestamp
-                },
-                where=stmt.excluded.timestamp > CrawlRecord.timestamp  # only update if timestamp is newer
-            )
-            session.execute(stmt)
+    """Upserts crawl records, and the packed text of those that kept it into crawl_page_text (see load_abr_records)."""
+    newest = _newest_by_url(records)
+    crawl_rows, page_text_rows = _crawl_rows(newest), _page_text_rows(newest)
 
-        session.commit()
-    except SQLAlchemyError as e:
-        session.rollback()
-        raise e
-    finally:
-        session.close()
\ No newline at end of file
+    def upsert(session):
+        # only update if timestamp is newer
+        return [
+            bulk_upsert(session, CrawlRecord, crawl_rows, CRAWL_COLUMNS, "url",
+                        CRAWL_UPDATE_COLUMNS, newer_column="timestamp"),
+            bulk_upsert(session, CrawlPageText, page_text_rows, PAGE_TEXT_COLUMNS, "url",
+                        PAGE_TEXT_COLUMNS[1:], newer_column="timestamp"),
+        ]
+
+    _count_loaded(write(upsert))
@@ -1,80 +1,496 @@
-from rapidfuzz import fuzz
-from db.models import MatchedEntity
-from db.conn import SessionLocal
-from sqlalchemy import text
+from array import array
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from itertools import islice
+import re
+import time
+import numpy as np
+from rapidfuzz import fuzz, process
+from db.models import MatchedEntity, MatchFingerprint
+from db.conn import SessionLocal, engine
+from sqlalchemy import bindparam, insert, text
+from pipeline import metrics, profiling
+from pipeline.stages import process_context
 BATCH_SIZE = 512
 MATCH_THRESHOLD = 85
 ABR_TABLE = "abr_preprocess"
 CRAWL_TABLE = "crawl_preprocess"
+# "fuzzy": token-blocked token_set_ratio (ABRIndex); "tfidf": char-n-gram cosine top-k (matcher.tfidf)
+MATCH_ENGINES = ("fuzzy", "tfidf")
 
-def perform_string_matching():
-    session = SessionLocal()
+COMPARISONS = metrics.counter("match_comparisons_total", "Crawl x ABR name comparisons scored")
+CRAWL_ROWS_SCORED = metrics.counter("match_crawl_rows_scored_total", "Crawl names scored against the ABR index")
+MATCHES_WRITTEN = metrics.counter("matches_written_total", "Matches written to matched_entities")
+SCORE_SECONDS = metrics.timer("match_score_seconds", "Time to score one batch of crawl rows")
+FULL_SCANS = metrics.counter("match_full_scans_total", "Crawl names scored against every ABR row for lack of a shared token")
+
+_PUNCTUATION = re.compile(r"[^\w]+")
+
+
+def block_keys(name: str) -> set[str]:
+    """The whitespace tokens of `name` with punctuation stripped (kept as-is if nothing else is left)."""
+    return {_PUNCTUATION.sub("", token) or token for token in (name or "").split()}
+
+
+class ABRIndex:
+    """
+    In-memory blocking index over abr_preprocess.
+
+    Every ABR row gets a dense integer id (in the order rows are added) and is
+    posted under each block_keys() token of its normalized name. A crawl name
+    is only scored against the rows that share at least one of those with
+    it, which replaces the full crawl x ABR scan. Tokens are compared
+    without punctuation, since token_set_ratio can pass MATCH_THRESHOLD for
+    names like "pty ltd" and "pty. ltd." that share no exact token, and a
+    name sharing no token with any row is scored against all of them.
+    """
+
+    threshold = MATCH_THRESHOLD
+
+    def __init__(self):
+        self.abns = []
+        self.entity_names = []
+        self.names = []
+        self.token_postings = defaultdict(partial(array, "I"))
+
+    def __len__(self):
+        return len(self.abns)
+
+    def add(self, abn, entity_name, normalized_name):
+        row_id = len(self.abns)
+        self.abns.append(abn)
+        self.entity_names.append(entity_name)
+        self.names.append(normalized_name)
+
+        # token_set_ratio splits on whitespace, so block on those tokens
+        for token in block_keys(normalized_name):
+            self.token_postings[token].append(row_id)
+
+    def candidates(self, name: str) -> np.ndarray:
+        """Returns the sorted ids of ABR rows sharing a token with `name`, or of every row if none does."""
+        postings = [
+            np.frombuffer(self.token_postings[token], dtype=np.uint32)
+            for token in block_keys(name)
+            if token in self.token_postings
+        ]
+        if not postings:
+            if not name or not name.strip():
+                return np.empty(0, dtype=np.uint32)
+            FULL_SCANS.inc()
+            return np.arange(len(self.abns), dtype=np.uint32)
+        return np.unique(np.concatenate(postings))
+
+    def best_match(self, name: str):
+        """
+        Scores `name` against its candidate set and returns
+        (abn, entity_name, score) for the best candidate, or None.
+
+        Ties resolve to the lowest row id, i.e. the first ABR row in index
+        order, the same as the previous sequential `score > best_score` scan.
+        """
+        ids = self.candidates(name)
+        if not len(ids):
+            return None
+        COMPARISONS.inc(len(ids))
+        choices = [self.names[i] for i in ids]
+        scores = process.cdist([name], choices, scorer=fuzz.token_set_ratio, dtype=np.float64)[0]
+        best = int(np.argmax(scores))
+        row_id = int(ids[best])
+        return self.abns[row_id], self.entity_names[row_id], float(scores[best])
+
+    def best_matches(self, names: list[str]) -> list:
+        return [self.best_match(name) for name in names]
+
+    def finish(self):
+        pass
 
-    crawl_offset = 0
-    total_matches = 0
 
-    while True:
-        # Batch crawl data
-        crawl_batch = session.execute(
-            text("""
+def build_abr_index(session, changed_only: bool = False, engine: str = "fuzzy"):
+    """
+    Loads abr_preprocess once, in abn order, into an ABRIndex (or a
+    TfidfIndex for the "tfidf" engine).
+
+    With `changed_only` only the rows whose record_updated differs from the
+    fingerprint stored by the previous match run (or that have none) are
+    indexed. Returns the index and the (abn, record_updated) fingerprints of
+    the indexed rows.
+    """
+    if engine == "tfidf":
+        from matcher.tfidf import TfidfIndex
+        index = TfidfIndex()
+    else:
+        index = ABRIndex()
+    fingerprints = []
+    changed_join, changed_filter = ("", "")
+    if changed_only:
+        changed_join = "LEFT JOIN match_fingerprints f ON f.source = 'abr' AND f.key = p.abn"
+        changed_filter = "AND (f.key IS NULL OR COALESCE(f.fingerprint, '') <> COALESCE(p.record_updated, ''))"
+    rows = session.execute(
+        text(f"""
+            SELECT p.abn, p.entity_name, p.normalized_name, p.record_updated
+            FROM {ABR_TABLE} p
+            {changed_join}
+            WHERE p.entity_name IS NOT NULL
+            {changed_filter}
+            ORDER BY p.abn
+        """),
+        execution_options={"yield_per": 10_000}
+    )
+    for abn, entity_name, abr_norm, record_updated in rows:
+        index.add(abn, entity_name, abr_norm)
+        fingerprints.append((abn, record_updated))
+    # Built before the scoring workers start, which each get a copy
+    index.finish()
+    return index, fingerprints
+
+
+def changed_crawl_rows(session) -> list[tuple]:
+    """Crawl rows that are new or whose timestamp changed since the last match run."""
+    return session.execute(
+        text(f"""
+            SELECT p.url, p.company_name, p.normalized_name, p.timestamp
+            FROM {CRAWL_TABLE} p
+            LEFT JOIN match_fingerprints f
+              ON f.source = 'crawl' AND f.key = p.url
+            WHERE p.company_name IS NOT NULL
+              AND (f.key IS NULL OR COALESCE(f.fingerprint, '') <> COALESCE(p.timestamp, ''))
+            ORDER BY p.url
+        """)
+    ).fetchall()
+
+
+def vanished_keys(session, source: str) -> set:
+    """Keys fingerprinted by a previous run that are no longer matchable."""
+    table, key, name = (
+        (ABR_TABLE, "abn", "entity_name") if source == "abr" else (CRAWL_TABLE, "url", "company_name")
+    )
+    return {
+        row[0] for row in session.execute(
+            text(f"""
+                SELECT f.key
+                FROM match_fingerprints f
+                LEFT JOIN {table} p
+                  ON p.{key} = f.key AND p.{name} IS NOT NULL
+                WHERE f.source = :source AND p.{key} IS NULL
+            """),
+            {"source": source}
+        )
+    }
+
+
+def crawl_rows_for_urls(session, urls) -> list[tuple]:
+    urls = sorted(urls)
+    rows = []
+    for i in range(0, len(urls), BATCH_SIZE):
+        rows.extend(session.execute(
+            text(f"""
+                SELECT url, company_name, normalized_name, timestamp
+                FROM {CRAWL_TABLE}
+                WHERE company_name IS NOT NULL AND url IN :urls
+            """).bindparams(bindparam("urls", expanding=True)),
+            {"urls": urls[i:i + BATCH_SIZE]}
+        ).fetchall())
+    return rows
+
+
+def crawl_shards(session, shards: int) -> list[tuple[str, str]]:
+    """
+    Splits crawl_preprocess into `shards` contiguous url ranges of roughly
+    equal size. Returns inclusive (first_url, last_url) bounds per shard.
+    """
+    return [
+        (first_url, last_url)
+        for first_url, last_url in session.execute(
+            text(f"""
+                SELECT MIN(url), MAX(url)
+                FROM (
+                    SELECT url, NTILE(:shards) OVER (ORDER BY url) AS shard
+                    FROM {CRAWL_TABLE}
+                    WHERE company_name IS NOT NULL
+                ) AS sharded
+                GROUP BY shard
+                ORDER BY shard
+            """),
+            {"shards": shards}
+        )
+    ]
+
+
+def score_crawl_rows(index: ABRIndex, rows) -> list[dict]:
+    """Scores (url, company_name, normalized_name, ...) rows against the index, BATCH_SIZE rows at a time."""
+    matches = []
+    started = time.perf_counter()
+    rows = iter(rows)
+    while batch := list(islice(rows, BATCH_SIZE)):
+        CRAWL_ROWS_SCORED.inc(len(batch))
+        for (url, crawl_name, *_), best in zip(batch, index.best_matches([row[2] for row in batch])):
+            if best is None:
+                continue
+            best_abn, best_entity_name, best_score = best
+
+            if best_score >= index.threshold:
+                matches.append({
+                    "abn": best_abn,
+                    "url": url,
+                    "entity_name": best_entity_name,
+                    "company_name": crawl_name,
+                    "similarity_score": best_score
+                })
+    SCORE_SECONDS.observe(time.perf_counter() - started)
+    return matches
+
+
+def score_crawl_shard(index: ABRIndex, bounds: tuple[str, str]) -> list[dict]:
+    """Scores every crawl row in the url range `bounds` against the index."""
+    first_url, last_url = bounds
+    session = SessionLocal()
+    try:
+        rows = session.execute(
+            text(f"""
                 SELECT url, company_name, normalized_name
-                        FROM crawl_preprocess
-                        WHERE company_name IS NOT NULL
-                        ORDER BY url
-                        OFFSET :offset LIMIT :limit
-                    """),
-            {"offset": crawl_offset, "limit": BATCH_SIZE}
-        ).fetchall()
-
-        if not crawl_batch:
-            break
-
-        print(f"🔄 Processing crawl batch at offset {crawl_offset}...")
-
-        for url, crawl_name, crawl_norm in crawl_batch:
-            best_score = 0
-            best_abn = None
-            best_entity_name = None
-
-            # Now scan ABR in batches (inner loop)
-            abr_offset = 0
-            while True:
-                abr_batch = session.execute(
-                            text("""
-                                SELECT abn, entity_name, normalized_name
-                                FROM abr_preprocess
-                                WHERE entity_name IS NOT NULL
-                                ORDER BY abn
-                                OFFSET :abr_offset LIMIT :abr_limit
-                            """),
-                            {"abr_offset": abr_offset, "abr_limit": BATCH_SIZE}
-                        ).fetchall()
-
-                if not abr_batch:
-                    break
-
-                for abn, entity_name, abr_norm in abr_batch:
-                    score = fuzz.token_set_ratio(crawl_norm, abr_norm)
-                    if score > best_score:
-                        best_score = score
-                        best_abn = abn
-                        best_entity_name = entity_name
-
-                abr_offset += BATCH_SIZE
-
-            if best_score >= MATCH_THRESHOLD:
-                match = MatchedEntity(
-                    abn=best_abn,
-                    url=url,
-                    entity_name=best_entity_name,
-                    company_name=crawl_name,
-                    similarity_score=best_score
-                )
-                session.merge(match)
-                total_matches += 1
+                FROM {CRAWL_TABLE}
+                WHERE company_name IS NOT NULL
+                  AND url >= :first_url AND url <= :last_url
+                ORDER BY url
+            """),
+            {"first_url": first_url, "last_url": last_url},
+            execution_options={"yield_per": BATCH_SIZE}
+        )
+        return score_crawl_rows(index, rows)
+    finally:
+        session.close()
+
+
+# Set in each pool worker by _init_match_worker, which is handed the index once
+# per worker rather than once per job.
+_worker_index = None
 
+
+def _init_match_worker(index: ABRIndex, profile_settings=None):
+    global _worker_index
+    _worker_index = index
+    # Connections inherited from the parent must not be shared across processes
+    engine.dispose(close=False)
+    # Counts inherited from the parent would be merged back twice
+    metrics.REGISTRY.reset()
+    if profile_settings is not None:
+        profiling.enable(**profile_settings, worker=True)
+
+
+def _score_crawl_shard_in_worker(bounds: tuple[str, str]):
+    with profiling.stage("match scoring"):
+        matches = score_crawl_shard(_worker_index, bounds)
+    return matches, metrics.REGISTRY.collect()
+
+
+def _score_crawl_rows_in_worker(rows: list[tuple]):
+    with profiling.stage("match scoring"):
+        matches = score_crawl_rows(_worker_index, rows)
+    return matches, metrics.REGISTRY.collect()
+
+
+def _score_job(score_job, index, job) -> list[dict]:
+    with profiling.stage("match scoring"):
+        return score_job(index, job)
+
+
+def score_crawl(session, index: ABRIndex, workers: int = 1, rows: list = None) -> list[dict]:
+    """
+    Scores crawl rows against `index` and returns the matches.
+
+    Without `rows` the whole crawl table is scored, split into `workers` url
+    ranges that each worker reads itself. With `rows` only those rows are
+    scored, split into `workers` chunks.
+    """
+    if rows is None:
+        jobs, score_job, score_job_in_worker = (
+            crawl_shards(session, max(workers, 1)), score_crawl_shard, _score_crawl_shard_in_worker
+        )
+    else:
+        chunk = -(-len(rows) // max(workers, 1)) or 1
+        jobs, score_job, score_job_in_worker = (
+            [rows[i:i + chunk] for i in range(0, len(rows), chunk)],
+            score_crawl_rows, _score_crawl_rows_in_worker
+        )
+    # Release the read connection before the workers start; writes check out a fresh one
+    session.close()
+
+    if workers <= 1 or len(jobs) <= 1:
+        return [m for job in jobs for m in _score_job(score_job, index, job)]
+
+    print(f"🔀 Scoring {len(jobs)} crawl shards across {workers} worker processes...")
+    # Not forked: the metrics logger and database writer threads may be running.
+    # Each worker unpickles its own copy of the index instead of sharing the parent's
+    matches = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=process_context(),
+        initializer=_init_match_worker,
+        initargs=(index, profiling.settings())
+    ) as pool:
+        for future in as_completed([pool.submit(score_job_in_worker, job) for job in jobs]):
+            job_matches, worker_metrics = future.result()
+            matches.extend(job_matches)
+            metrics.REGISTRY.merge(worker_metrics)
+    return matches
+
+
+def _beats(match: dict, current: tuple) -> bool:
+    """Same ordering as a full scan: higher score wins, ties go to the lower abn."""
+    current_abn, current_score = current
+    return (match["similarity_score"], current_abn) > (current_score, match["abn"])
+
+
+def write_matches(session, replaced_urls, matches: list[dict], fingerprints: dict, vanished: dict):
+    """
+    Replaces the stored match of every url in `replaced_urls` with the new
+    `matches`, then records the fingerprints of the rows that were scored.
+    """
+    replaced_urls = sorted(replaced_urls)
+    for i in range(0, len(replaced_urls), BATCH_SIZE):
+        session.query(MatchedEntity).filter(
+            MatchedEntity.url.in_(replaced_urls[i:i + BATCH_SIZE])
+        ).delete(synchronize_session=False)
+    for i in range(0, len(matches), BATCH_SIZE):
+        session.execute(insert(MatchedEntity), matches[i:i + BATCH_SIZE])
+    MATCHES_WRITTEN.inc(len(matches))
+
+    for source, rows in fingerprints.items():
+        stale = sorted({key for key, _ in rows} | vanished[source])
+        for i in range(0, len(stale), BATCH_SIZE):
+            session.query(MatchFingerprint).filter(
+                MatchFingerprint.source == source,
+                MatchFingerprint.key.in_(stale[i:i + BATCH_SIZE])
+            ).delete(synchronize_session=False)
+        for i in range(0, len(rows), BATCH_SIZE):
+            session.execute(insert(MatchFingerprint), [
+                {"source": source, "key": key, "fingerprint": fingerprint}
+                for key, fingerprint in rows[i:i + BATCH_SIZE]
+            ])
+    session.commit()
+
+
+def start_sharded_match(session, shards: int) -> list[tuple[str, str]]:
+    """
+    Prepares a full re-match done shard by shard, possibly on other nodes
+    (run.py --coordinator): clears the stored matches and fingerprints,
+    fingerprints every ABR row up front and returns the crawl_shards()
+    bounds, each to be scored and written with write_shard_matches().
+    """
+    session.query(MatchedEntity).delete(synchronize_session=False)
+    session.query(MatchFingerprint).delete(synchronize_session=False)
+    session.execute(text(f"""
+        INSERT INTO match_fingerprints (source, key, fingerprint)
+        SELECT 'abr', abn, record_updated FROM {ABR_TABLE} WHERE entity_name IS NOT NULL
+    """))
+    session.commit()
+    return crawl_shards(session, shards)
+
+
+def write_shard_matches(session, bounds: tuple[str, str], matches: list[dict]):
+    """
+    Replaces the matches and crawl fingerprints of the url range `bounds`
+    in one transaction, so a shard that is scored again (after its worker
+    died) leaves no duplicates behind.
+    """
+    first_url, last_url = bounds
+    in_range = {"first_url": first_url, "last_url": last_url}
+    session.query(MatchedEntity).filter(
+        MatchedEntity.url >= first_url, MatchedEntity.url <= last_url
+    ).delete(synchronize_session=False)
+    for i in range(0, len(matches), BATCH_SIZE):
+        session.execute(insert(MatchedEntity), matches[i:i + BATCH_SIZE])
+    MATCHES_WRITTEN.inc(len(matches))
+    session.query(MatchFingerprint).filter(
+        MatchFingerprint.source == "crawl", MatchFingerprint.key >= first_url, MatchFingerprint.key <= last_url
+    ).delete(synchronize_session=False)
+    session.execute(text(f"""
+        INSERT INTO match_fingerprints (source, key, fingerprint)
+        SELECT 'crawl', url, timestamp FROM {CRAWL_TABLE}
+        WHERE company_name IS NOT NULL AND url >= :first_url AND url <= :last_url
+    """), in_range)
+    session.commit()
+
+
+def perform_string_matching(workers: int = 1, full: bool = False, engine: str = "fuzzy"):
+    """
+    Matches crawl_preprocess names to abr_preprocess names.
+
+    Matching is incremental: match_fingerprints remembers the timestamp /
+    record_updated of every row seen by the previous run, so only new or
+    changed crawl rows are scored against the full ABR index, and only new or
+    changed ABR rows are scored against the remaining crawl rows. `full`
+    discards the fingerprints and stored matches and re-scores everything.
+
+    With `workers` > 1 scoring runs in a process pool against a shared
+    read-only ABR index. The parent process writes all matches.
+
+    `engine` picks the index crawl names are scored against (MATCH_ENGINES).
+    Scores from the two engines are both token_set_ratio, but the tfidf
+    engine only considers its top-k cosine candidates, so switching engines
+    calls for a `full` re-match.
+    """
+    session = SessionLocal()
+
+    if full:
+        print("♻️ Full re-match requested, clearing stored matches and fingerprints...")
+        session.query(MatchedEntity).delete(synchronize_session=False)
+        session.query(MatchFingerprint).delete(synchronize_session=False)
         session.commit()
-        crawl_offset += BATCH_SIZE
 
+    print(f"📚 Building ABR {engine} index for changed ABR records...")
+    abr_delta, abr_fingerprints = build_abr_index(session, changed_only=True, engine=engine)
+    crawl_delta = changed_crawl_rows(session)
+    vanished = {"abr": vanished_keys(session, "abr"), "crawl": vanished_keys(session, "crawl")}
+    current = {
+        url: (abn, score)
+        for url, abn, score in session.query(
+            MatchedEntity.url, MatchedEntity.abn, MatchedEntity.similarity_score
+        )
+    }
+    abr_total, crawl_total = (
+        session.execute(text(f"SELECT COUNT(*) FROM {table} WHERE {name} IS NOT NULL")).scalar()
+        for table, name in ((ABR_TABLE, "entity_name"), (CRAWL_TABLE, "company_name"))
+    )
+    print(f"  ✔ {len(abr_delta)}/{abr_total} ABR and {len(crawl_delta)}/{crawl_total} crawl records changed")
+
+    # A crawl row must be fully re-scored if it changed, or if its stored best
+    # match points at an ABR row that changed or disappeared
+    affected_abns = set(abr_delta.abns) | vanished["abr"]
+    dirty_urls = {row[0] for row in crawl_delta}
+    restale_urls = {url for url, (abn, _) in current.items() if abn in affected_abns} - dirty_urls - vanished["crawl"]
+    dirty_rows = crawl_delta + crawl_rows_for_urls(session, restale_urls)
+    dirty_urls |= restale_urls
+
+    matches = {}
+    if len(dirty_rows) == crawl_total and crawl_total:
+        index = abr_delta if len(abr_delta) == abr_total else \
+            build_abr_index(session, engine=engine)[0]
+        print(f"🔄 Scoring all {crawl_total} crawl records against {len(index)} ABR names...")
+        matches = {m["url"]: m for m in score_crawl(session, index, workers)}
+    else:
+        if dirty_rows:
+            print(f"📚 Building full ABR {engine} index for {len(dirty_rows)} changed crawl records...")
+            index = build_abr_index(session, engine=engine)[0]
+            matches = {m["url"]: m for m in score_crawl(session, index, workers, rows=dirty_rows)}
+
+        if len(abr_delta):
+            print(f"🔄 Scoring {len(abr_delta)} changed ABR names against existing crawl records...")
+            for m in score_crawl(session, abr_delta, workers):
+                url = m["url"]
+                if url in dirty_urls or url in vanished["crawl"]:
+                    continue
+                if url not in current or _beats(m, current[url]):
+                    matches[url] = m
+                    dirty_urls.add(url)
+
+    write_matches(
+        session,
+        dirty_urls | vanished["crawl"],
+        list(matches.values()),
+        {"abr": abr_fingerprints, "crawl": [(url, timestamp) for url, _, _, timestamp in crawl_delta]},
+        vanished
+    )
     session.close()
-    print(f"🎉 Matching complete. Total matches stored: {total_matches}")
+    print(f"🎉 Matching complete. Matches written: {len(matches)}")
@@ -0,0 +1,197 @@
+from array import array
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from matcher.em import COMPARISONS, MATCH_THRESHOLD
+
+NGRAM = 3
+TOP_K = 10
+# Cosine similarity x 100 a pair needs to match when candidates are not re-scored
+COSINE_THRESHOLD = 80
+# Bounds on memory while scoring: crawl names x ABR rows per block (the most
+# (crawl name, ABR row) scores it can hold), and (crawl name, ABR posting)
+# products expanded at a time
+BLOCK_CELLS = 4_000_000
+CHUNK_PRODUCTS = 2_000_000
+
+
+def char_ngrams(name: str, n: int = NGRAM) -> list[str]:
+    """Character n-grams of each space-padded word, so grams never span two words."""
+    grams = []
+    for word in (name or "").split():
+        padded = f" {word} "
+        grams.extend(padded[i:i + n] for i in range(max(len(padded) - n + 1, 1)))
+    return grams
+
+
+class TfidfIndex:
+    """
+    Char-n-gram TF-IDF index over abr_preprocess, used in place of ABRIndex
+    with `--match-engine tfidf`.
+
+    Names are L2-normalized tf-idf vectors over the n-grams seen in the
+    indexed rows, stored column-wise (one posting list of row ids and
+    weights per n-gram) once finish() is called. Crawl names are scored in
+    blocks of up to `block_cells` // rows names by a sparse product with
+    those postings, summed per (crawl name, ABR row) pair the postings
+    touch, and the `top_k` rows by cosine similarity are kept. Postings
+    are expanded at most `chunk_products` at a time, so memory stays
+    bounded however common a name's n-grams are, and follows the pairs
+    that share an n-gram rather than every crawl name x ABR row.
+
+    With `rescore` the top_k candidates are re-scored with the same
+    token_set_ratio as ABRIndex, so scores and MATCH_THRESHOLD mean the
+    same for both engines. Without it the score is the cosine similarity
+    x 100, matched at COSINE_THRESHOLD.
+    """
+
+    def __init__(self, top_k: int = TOP_K, rescore: bool = True, n: int = NGRAM,
+                 block_cells: int = BLOCK_CELLS, chunk_products: int = CHUNK_PRODUCTS):
+        self.top_k = top_k
+        self.rescore = rescore
+        self.n = n
+        self.block_cells = block_cells
+        self.chunk_products = chunk_products
+        self.threshold = MATCH_THRESHOLD if rescore else COSINE_THRESHOLD
+        self.abns = []
+        self.entity_names = []
+        self.names = []
+        self.vocabulary = {}
+        self._gram_ids = array("I")
+        self._gram_counts = array("I")
+        self._indptr = None
+
+    def __len__(self):
+        return len(self.abns)
+
+    def add(self, abn, entity_name, normalized_name):
+        self.abns.append(abn)
+        self.entity_names.append(entity_name)
+        self.names.append(normalized_name)
+        vocabulary = self.vocabulary
+        grams = [vocabulary.setdefault(g, len(vocabulary)) for g in char_ngrams(normalized_name, self.n)]
+        self._gram_ids.extend(grams)
+        self._gram_counts.append(len(grams))
+        self._indptr = None
+
+    def finish(self):
+        """Weighs the added rows and builds the n-gram postings. Called again after further add()s."""
+        rows_total, grams_total = len(self.abns), max(len(self.vocabulary), 1)
+        rows = np.repeat(np.arange(rows_total, dtype=np.int64), np.frombuffer(self._gram_counts, dtype=np.uint32))
+        keys, tf = np.unique(rows * grams_total + np.frombuffer(self._gram_ids, dtype=np.uint32), return_counts=True)
+        rows, grams = keys // grams_total, keys % grams_total
+
+        df = np.bincount(grams, minlength=grams_total)
+        # Smoothed idf, as in scikit-learn's TfidfVectorizer
+        self._idf = np.log((1 + rows_total) / (1 + df)) + 1
+        weights = tf * self._idf[grams]
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=rows_total))
+        weights /= norms[rows]
+
+        # keys are sorted by row, so a stable sort by gram keeps each posting list in row order
+        order = np.argsort(grams, kind="stable")
+        self._rows = rows[order].astype(np.uint32)
+        self._weights = weights[order].astype(np.float32)
+        self._indptr = np.concatenate(([0], np.cumsum(df)))
+
+    def _query(self, names: list[str]):
+        """(query row, n-gram id, weight) arrays of the L2-normalized query vectors."""
+        query_rows, gram_ids = [], []
+        for i, name in enumerate(names):
+            for gram in char_ngrams(name, self.n):
+                gram_id = self.vocabulary.get(gram)
+                if gram_id is not None:
+                    query_rows.append(i)
+                    gram_ids.append(gram_id)
+        keys, tf = np.unique(np.array(query_rows, dtype=np.int64) * len(self._idf) + np.array(gram_ids, dtype=np.int64),
+                             return_counts=True)
+        query_rows, gram_ids = keys // len(self._idf), keys % len(self._idf)
+        weights = tf * self._idf[gram_ids]
+        weights /= np.sqrt(np.bincount(query_rows, weights=weights ** 2))[query_rows]
+        return query_rows, gram_ids, weights
+
+    def _top_k_block(self, query_rows, gram_ids, weights, queries: int):
+        """Top-k (row ids, cosines) per query, accumulated over the (query, row) pairs sharing an n-gram."""
+        n = len(self.abns)
+        # Distinct query * n + row keys of each chunk, and their summed products.
+        # 32-bit keys sort faster, and fit unless a block is over 4G cells
+        key_type = np.uint32 if queries * n < 2 ** 32 else np.int64
+        chunk_keys, chunk_scores = [], []
+        starts = self._indptr[gram_ids]
+        lengths = self._indptr[gram_ids + 1] - starts
+        ends = np.cumsum(lengths)
+        # Expand at most chunk_products postings at a time
+        cuts = np.concatenate(([0], np.searchsorted(ends, np.arange(self.chunk_products, ends[-1], self.chunk_products)),
+                               [len(lengths)])) if len(lengths) else [0, 0]
+        for lo, hi in zip(cuts[:-1], cuts[1:]):
+            if hi <= lo:
+                continue
+            slice_lengths = lengths[lo:hi]
+            offsets = np.cumsum(slice_lengths) - slice_lengths
+            postings = np.repeat(starts[lo:hi] - offsets, slice_lengths) + np.arange(int(slice_lengths.sum()))
+            keys, inverse = np.unique((np.repeat(query_rows[lo:hi], slice_lengths) * n
+                                       + self._rows[postings]).astype(key_type), return_inverse=True)
+            chunk_keys.append(keys)
+            chunk_scores.append(np.bincount(inverse, weights=np.repeat(weights[lo:hi], slice_lengths)
+                                            * self._weights[postings]))
+        if len(chunk_keys) == 1:
+            keys, scores = chunk_keys[0], chunk_scores[0]
+        elif chunk_keys:
+            # A query's n-grams can span chunks; sum its pairs across them
+            keys, inverse = np.unique(np.concatenate(chunk_keys), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(chunk_scores))
+        else:
+            keys, scores = np.empty(0, dtype=np.int64), np.empty(0)
+        COMPARISONS.inc(len(keys))
+
+        # Keys are sorted, so each query's pairs are contiguous
+        bounds = np.searchsorted(keys, np.arange(queries + 1) * n)
+        results = []
+        for query, (a, b) in enumerate(zip(bounds[:-1], bounds[1:])):
+            row_ids, cosines = keys[a:b].astype(np.int64) - query * n, scores[a:b]
+            if len(row_ids) > self.top_k:
+                top = np.argpartition(-cosines, self.top_k - 1)[:self.top_k]
+                row_ids, cosines = row_ids[top], cosines[top]
+            # Highest cosine first, ties to the lowest row id
+            order = np.lexsort((row_ids, -cosines))
+            results.append((row_ids[order], cosines[order]))
+        return results
+
+    def top_k_candidates(self, names: list[str]) -> list[tuple[np.ndarray, np.ndarray]]:
+        """(row ids, cosine similarities) of the top_k indexed rows for each name, best first."""
+        if self._indptr is None:
+            self.finish()
+        if not len(self.abns) or not names:
+            return [(np.empty(0, dtype=np.int64), np.empty(0))] * len(names)
+        query_rows, gram_ids, weights = self._query(names)
+        bounds = np.searchsorted(query_rows, np.arange(len(names) + 1))
+        block = max(1, self.block_cells // len(self.abns))
+        results = []
+        for first in range(0, len(names), block):
+            last = min(first + block, len(names))
+            lo, hi = bounds[first], bounds[last]
+            results.extend(self._top_k_block(query_rows[lo:hi] - first, gram_ids[lo:hi], weights[lo:hi], last - first))
+        return results
+
+    def best_matches(self, names: list[str]) -> list:
+        """(abn, entity_name, score) of the best candidate for each name, or None."""
+        best = []
+        for name, (row_ids, cosines) in zip(names, self.top_k_candidates(names)):
+            if not len(row_ids):
+                best.append(None)
+                continue
+            if self.rescore:
+                # Re-scored in row id order, so ties resolve to the lowest row id as in ABRIndex
+                row_ids = np.sort(row_ids)
+                scores = process.cdist([name], [self.names[i] for i in row_ids],
+                                       scorer=fuzz.token_set_ratio, dtype=np.float64)[0]
+                top = int(np.argmax(scores))
+                row_id, score = int(row_ids[top]), float(scores[top])
+            else:
+                row_id, score = int(row_ids[0]), round(float(cosines[0]) * 100, 4)
+            best.append((self.abns[row_id], self.entity_names[row_id], score))
+        return best
+
+    def best_match(self, name: str):
+        return self.best_matches([name])[0]
@@ -0,0 +1,139 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+JOURNAL_PATH = Path("data/cache/crawl_journal.sqlite")
+# Fragment status changes buffered before a write; at most this many are redone after a crash
+FLUSH_SIZE = 200
+
+PENDING = "pending"
+FETCHED = "fetched"
+PARSED = "parsed"
+LOADED = "loaded"
+FAILED = "failed"
+SKIPPED = "skipped"
+NO_RECORD = "no_record"
+# Fragments in these states are not revisited by a resumed run
+FINISHED = (LOADED, SKIPPED, NO_RECORD)
+
+ENTRY_COLUMNS = ["warc_path", "offset", "length", "url", "digest", "timestamp"]
+
+
+def journal_key(entry: dict) -> tuple:
+    return entry["warc_path"], entry["offset"]
+
+
+def keyed(fn, item):
+    """
+    Runs a stage `fn` on an (entry, ...) item and returns (journal key,
+    result), so the outcome can be journalled by the parent process.
+    """
+    return journal_key(item[0]), fn(item)
+
+
+class CrawlJournal:
+    """
+    Durable progress of a Common Crawl run, in a SQLite file.
+
+    A CDX page is recorded once, with every fetcher entry it produced, in a
+    single transaction; a resumed run does not request it again. Each
+    entry (keyed by WARC path and offset) then moves through pending,
+    fetched, parsed and loaded, or ends up skipped (domain already covered),
+    no_record (nothing to extract) or failed. Entries not in FINISHED are
+    what a resumed run retries.
+
+    Status changes are buffered (FLUSH_SIZE) and written in one transaction,
+    so a crash loses at most that many, which are then simply redone.
+    Thread-safe.
+    """
+
+    def __init__(self, path: Path = JOURNAL_PATH, flush_size: int = FLUSH_SIZE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_size = flush_size
+        self._pending = []
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS cdx_pages (query TEXT, page INTEGER, entries INTEGER, "
+                             "PRIMARY KEY (query, page))")
+            self._db.execute("CREATE TABLE IF NOT EXISTS fragments (warc_path TEXT, offset INTEGER, length INTEGER, "
+                             "url TEXT, digest TEXT, timestamp TEXT, query TEXT, page INTEGER, status TEXT, error TEXT, "
+                             "updated REAL, PRIMARY KEY (warc_path, offset))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS fragments_status ON fragments (status)")
+
+    def reset(self):
+        """Forgets every page and fragment, for a run that starts over."""
+        with self._lock, self._db:
+            self._pending = []
+            self._db.execute("DELETE FROM cdx_pages")
+            self._db.execute("DELETE FROM fragments")
+
+    def done_pages(self, query: str) -> set:
+        return {page for page, in self._db.execute("SELECT page FROM cdx_pages WHERE query = ?", (query,))}
+
+    def record_page(self, query: str, page: int, entries: list[dict]):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                f"INSERT OR IGNORE INTO fragments ({', '.join(ENTRY_COLUMNS)}, query, page, status, updated) "
+                f"VALUES ({', '.join('?' * len(ENTRY_COLUMNS))}, ?, ?, ?, ?)",
+                [[e.get(c) for c in ENTRY_COLUMNS] + [query, page, PENDING, now] for e in entries]
+            )
+            self._db.execute("INSERT OR REPLACE INTO cdx_pages (query, page, entries) VALUES (?, ?, ?)",
+                             (query, page, len(entries)))
+
+    def unfinished(self, query: str):
+        """Entries of recorded pages that were never finished, grouped by WARC file in offset order."""
+        self.flush()
+        rows = self._db.execute(
+            f"SELECT {', '.join(ENTRY_COLUMNS)} FROM fragments "
+            f"WHERE query = ? AND status NOT IN ({', '.join('?' * len(FINISHED))}) ORDER BY warc_path, offset",
+            (query, *FINISHED)
+        ).fetchall()
+        return [dict(zip(ENTRY_COLUMNS, row)) for row in rows]
+
+    def mark(self, keys, status: str, error: str = None):
+        """Records `status` for the fragments with the given journal keys."""
+        now = time.time()
+        with self._lock:
+            self._pending.extend((status, error, now, warc_path, offset) for warc_path, offset in keys)
+            if len(self._pending) >= self.flush_size:
+                self._flush()
+
+    def parsed(self, outcome):
+        """
+        Pipeline-stage form: takes a (key, parse result) pair from keyed()
+        and passes the result on, tagged with its key for mark() after loading.
+        """
+        key, result = outcome
+        self.mark([key], PARSED if result else NO_RECORD)
+        if result:
+            result[0]["journal_key"] = key
+        return result
+
+    def _flush(self):
+        if not self._pending:
+            return
+        with self._db:
+            self._db.executemany(
+                "UPDATE fragments SET status = ?, error = ?, updated = ? WHERE warc_path = ? AND offset = ?",
+                self._pending
+            )
+        self._pending = []
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def counts(self, query: str = None) -> dict:
+        self.flush()
+        where, params = ("WHERE query = ?", (query,)) if query is not None else ("", ())
+        return dict(self._db.execute(f"SELECT status, COUNT(*) FROM fragments {where} GROUP BY status", params))
+
+    def close(self):
+        self.flush()
+        self._db.close()
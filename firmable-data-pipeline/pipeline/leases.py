@@ -0,0 +1,239 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db.conn import SessionLocal
+from db.models import WorkLease
+
+# A leased unit not renewed for this long is claimed again by another worker
+LEASE_SECONDS = 120
+# Attempts (claims) before a unit that keeps failing or expiring is given up
+MAX_ATTEMPTS = 3
+# Seconds an idle worker waits before asking for work again
+POLL_SECONDS = 2
+# Claimable units a worker tries, in random order, per claim
+CLAIM_CANDIDATES = 8
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+CLAIMABLE = ("(status = 'pending' OR (status = 'leased' AND lease_expires < :now)) "
+             "AND attempts < :max_attempts")
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _kinds_filter(kinds) -> tuple[str, dict]:
+    return (" AND kind IN :kinds", {"kinds": list(kinds)}) if kinds else ("", {})
+
+
+def _statement(sql: str, kinds):
+    stmt = text(sql)
+    return stmt.bindparams(bindparam("kinds", expanding=True)) if kinds else stmt
+
+
+def enqueue(session, units, priority: int = 0) -> int:
+    """
+    Adds (key, kind, payload) units as pending. Keys already in the table
+    keep their row and status, so re-planning or re-expanding work is
+    idempotent. Returns the number of units added.
+    """
+    now = time.time()
+    rows = [
+        {"key": key, "kind": kind, "payload": json.dumps(payload), "priority": priority, "status": PENDING,
+         "attempts": 0, "updated": now}
+        for key, kind, payload in units
+    ]
+    if not rows:
+        return 0
+    insert = postgresql.insert if session.get_bind().dialect.name == "postgresql" else sqlite.insert
+    added = session.connection().execute(insert(WorkLease.__table__).on_conflict_do_nothing(), rows).rowcount
+    session.commit()
+    return added
+
+
+def clear(session, kinds):
+    """Drops every unit of the given kinds, for work planned from scratch."""
+    session.query(WorkLease).filter(WorkLease.kind.in_(list(kinds))).delete(synchronize_session=False)
+    session.commit()
+
+
+def claim(session, owner: str, kinds=None, ttl: float = LEASE_SECONDS):
+    """
+    Leases one pending unit, or one whose lease expired, to `owner` for
+    `ttl` seconds. Returns the unit as a dict (payload decoded), or None if
+    nothing is claimable.
+
+    The claim is a conditional UPDATE that only succeeds while the unit is
+    still claimable, so when workers race for the same unit exactly one
+    wins (rowcount 1) and the others move on to the next candidate. Expired
+    leases that used up MAX_ATTEMPTS are marked failed first.
+    """
+    now = time.time()
+    kinds_sql, kinds_params = _kinds_filter(kinds)
+    session.execute(
+        text("UPDATE work_leases SET status = 'failed', owner = NULL, updated = :now, "
+             "error = COALESCE(error, 'lease expired') "
+             "WHERE status = 'leased' AND lease_expires < :now AND attempts >= :max_attempts"),
+        {"now": now, "max_attempts": MAX_ATTEMPTS}
+    )
+    session.commit()
+
+    keys = list(session.execute(
+        _statement(f"SELECT key FROM work_leases WHERE {CLAIMABLE}{kinds_sql} ORDER BY priority, key LIMIT :limit",
+                   kinds),
+        {"now": now, "max_attempts": MAX_ATTEMPTS, "limit": CLAIM_CANDIDATES, **kinds_params}
+    ).scalars())
+    # Spread racing workers over the candidates instead of all trying the first
+    random.shuffle(keys)
+    for key in keys:
+        won = session.execute(
+            text(f"UPDATE work_leases SET status = 'leased', owner = :owner, lease_expires = :expires, "
+                 f"attempts = attempts + 1, updated = :now WHERE key = :key AND {CLAIMABLE}"),
+            {"owner": owner, "expires": now + ttl, "now": now, "key": key, "max_attempts": MAX_ATTEMPTS}
+        ).rowcount == 1
+        session.commit()
+        if won:
+            row = session.get(WorkLease, key, populate_existing=True)
+            return {"key": row.key, "kind": row.kind, "payload": json.loads(row.payload), "attempts": row.attempts}
+    return None
+
+
+def _update_owned(session, key: str, owner: str, assignments: str, params: dict) -> bool:
+    updated = session.execute(
+        text(f"UPDATE work_leases SET {assignments}, updated = :now "
+             f"WHERE key = :key AND owner = :owner AND status = 'leased'"),
+        {"key": key, "owner": owner, "now": time.time(), **params}
+    ).rowcount == 1
+    session.commit()
+    return updated
+
+
+def heartbeat(session, key: str, owner: str, ttl: float = LEASE_SECONDS) -> bool:
+    """Extends `owner`'s lease on `key`. False if the lease was lost to another worker."""
+    return _update_owned(session, key, owner, "lease_expires = :expires", {"expires": time.time() + ttl})
+
+
+def complete(session, key: str, owner: str) -> bool:
+    """Marks a leased unit done. False if the lease was lost, in which case another worker redoes it."""
+    return _update_owned(session, key, owner, "status = 'done', owner = NULL, lease_expires = NULL, error = NULL", {})
+
+
+def fail(session, key: str, owner: str, error: str):
+    """
+    Gives a unit back after an error: pending again to be retried, or
+    failed once it used up MAX_ATTEMPTS. Returns the new status, or None if
+    the lease was already lost.
+    """
+    released = _update_owned(
+        session, key, owner,
+        "status = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'pending' END, "
+        "owner = NULL, lease_expires = NULL, error = :error",
+        {"max_attempts": MAX_ATTEMPTS, "error": error}
+    )
+    return session.get(WorkLease, key, populate_existing=True).status if released else None
+
+
+def counts(session, kinds=None) -> dict:
+    """Number of units per status."""
+    kinds_sql, kinds_params = _kinds_filter(kinds)
+    return dict(session.execute(
+        _statement(f"SELECT status, COUNT(*) FROM work_leases WHERE 1 = 1{kinds_sql} GROUP BY status", kinds),
+        kinds_params
+    ).all())
+
+
+def outstanding(session, kinds=None) -> int:
+    """Units still pending or leased, i.e. work that may yet be done (or create more units)."""
+    status = counts(session, kinds)
+    return status.get(PENDING, 0) + status.get(LEASED, 0)
+
+
+class LeaseKeeper:
+    """
+    Renews a lease from a background thread every ttl / 3 seconds while
+    its unit is being worked on. `lost` is set if a renewal finds the lease
+    taken over by another worker.
+    """
+
+    def __init__(self, key: str, owner: str, ttl: float = LEASE_SECONDS):
+        self.key = key
+        self.owner = owner
+        self.ttl = ttl
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease {key}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                with SessionLocal() as session:
+                    renewed = heartbeat(session, self.key, self.owner, self.ttl)
+            except Exception as e:
+                print(f"[!] Lease heartbeat for {self.key} failed: {e}")
+                continue
+            if not renewed:
+                self.lost.set()
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def work(handlers: dict, owner: str = None, ttl: float = LEASE_SECONDS, poll_seconds: float = POLL_SECONDS,
+         kinds=None) -> dict:
+    """
+    Worker loop: claims units of the `handlers`' kinds (or `kinds`), runs
+    handlers[kind](unit) under a LeaseKeeper, and marks each unit done, or
+    failed for a retry if the handler raised. Returns once no unit is
+    pending or leased any more; a unit leased by a worker that died is
+    picked up here when its lease expires. Handlers must be safe to run
+    again on a unit a dead worker had partly done.
+
+    Returns the number of units this worker completed, failed and lost.
+    """
+    owner = owner or worker_name()
+    kinds = list(kinds or handlers)
+    summary = {DONE: 0, FAILED: 0, "lost": 0}
+    while True:
+        with SessionLocal() as session:
+            unit = claim(session, owner, kinds, ttl)
+            if unit is None:
+                if not outstanding(session, kinds):
+                    break
+        if unit is None:
+            time.sleep(poll_seconds)
+            continue
+
+        print(f"🔧 [{owner}] {unit['key']} (attempt {unit['attempts']})")
+        try:
+            with LeaseKeeper(unit["key"], owner, ttl):
+                handlers[unit["kind"]](unit)
+        except Exception as e:
+            with SessionLocal() as session:
+                status = fail(session, unit["key"], owner, f"{type(e).__name__}: {e}")
+            print(f"❌ [{owner}] {unit['key']} failed ({status or 'lease lost'}): {e}")
+            summary[FAILED] += 1
+            continue
+        with SessionLocal() as session:
+            if complete(session, unit["key"], owner):
+                summary[DONE] += 1
+            else:
+                print(f"⚠️ [{owner}] Lease on {unit['key']} was lost; another worker redoes it")
+                summary["lost"] += 1
+    return summary
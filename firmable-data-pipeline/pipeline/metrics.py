@@ -0,0 +1,245 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+# Upper bounds (seconds) of the default timer buckets
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOG_INTERVAL = 30.0
+PREFIX = "firmable_"
+
+
+class Counter:
+    """Monotonic count. inc() takes an uncontended lock, cheap enough for per-record use."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str = "", labels: dict = None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def _dump(self):
+        return self.value
+
+    def _merge(self, value):
+        self.inc(value)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+
+class Histogram:
+    """
+    Observations counted into fixed buckets (upper bounds), plus their count
+    and sum. Used as a timer through time().
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str = "", labels: dict = None, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self._reset()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def _dump(self):
+        return {"count": self.count, "sum": self.sum, "buckets": list(self.counts)}
+
+    def _merge(self, value):
+        with self._lock:
+            self.count += value["count"]
+            self.sum += value["sum"]
+            for i, n in enumerate(value["buckets"]):
+                self.counts[i] += n
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        # The last slot counts observations above every bucket (+Inf)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+class Registry:
+    """
+    Named metrics of one process, created on first use.
+
+    Metrics recorded in worker processes are carried back with collect()
+    (in the worker) and merge() (in the parent).
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, labels: dict, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = cls(name, help, labels, **kwargs)
+        return metric
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name: str, help: str = "", buckets=TIME_BUCKETS, **labels) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    timer = histogram
+
+    def reset(self):
+        """Zeroes every metric; called in freshly forked workers, which also get new locks."""
+        self._lock = threading.Lock()
+        for metric in list(self._metrics.values()):
+            metric._reset()
+
+    def collect(self) -> list:
+        """Returns every non-zero metric as plain data and zeroes it, for merge() in another process."""
+        collected = []
+        for metric in list(self._metrics.values()):
+            value = metric._dump()
+            if value == 0 or (isinstance(value, dict) and not value["count"]):
+                continue
+            collected.append((metric.kind, metric.name, metric.help, metric.labels,
+                              getattr(metric, "buckets", None), value))
+            metric._reset()
+        return collected
+
+    def merge(self, collected: list):
+        for kind, name, help, labels, buckets, value in collected or ():
+            if kind == "counter":
+                metric = self.counter(name, help, **labels)
+            else:
+                metric = self.histogram(name, help, buckets, **labels)
+            metric._merge(value)
+
+    def counter_values(self) -> dict:
+        return {_series(m.name, m.labels): m.value for m in list(self._metrics.values()) if m.kind == "counter"}
+
+    def to_json(self) -> dict:
+        return {
+            "time": time.time(),
+            "metrics": [
+                {"name": m.name, "type": m.kind, "labels": m.labels, "help": m.help,
+                 **({"value": m.value} if m.kind == "counter" else
+                    {"count": m.count, "sum": round(m.sum, 6), "buckets": dict(zip(
+                        [str(b) for b in m.buckets] + ["+Inf"], _cumulative(m.counts)))})}
+                for m in sorted(self._metrics.values(), key=lambda m: (m.name, sorted(m.labels.items())))
+            ],
+        }
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format, e.g. for node_exporter's textfile collector."""
+        lines = []
+        described = set()
+        for m in sorted(self._metrics.values(), key=lambda m: (m.name, sorted(m.labels.items()))):
+            name = PREFIX + m.name
+            if name not in described:
+                described.add(name)
+                lines += [f"# HELP {name} {m.help}", f"# TYPE {name} {m.kind}"]
+            if m.kind == "counter":
+                lines.append(f"{_series(name, m.labels)} {m.value}")
+                continue
+            for bound, count in zip(list(m.buckets) + ["+Inf"], _cumulative(m.counts)):
+                lines.append(f"{_series(name + '_bucket', {**m.labels, 'le': str(bound)})} {count}")
+            lines.append(f"{_series(name + '_sum', m.labels)} {m.sum}")
+            lines.append(f"{_series(name + '_count', m.labels)} {m.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Writes a Prometheus textfile (for a .prom path) or JSON, replacing `path` atomically."""
+        path = Path(path)
+        body = self.to_prometheus() if path.suffix == ".prom" else json.dumps(self.to_json(), indent=2)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(body)
+        os.replace(tmp, path)
+
+
+def _series(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    escaped = {k: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for k, v in labels.items()}
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in sorted(escaped.items())) + "}"
+
+
+def _cumulative(counts):
+    total = 0
+    for n in counts:
+        total += n
+        yield total
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+timer = REGISTRY.timer
+
+
+class ThroughputLog:
+    """Prints every counter that moved, with its rate, every `interval` seconds until stopped."""
+
+    def __init__(self, registry: Registry = REGISTRY, interval: float = LOG_INTERVAL):
+        self.registry = registry
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-log", daemon=True)
+        self._last = {}
+        self._last_time = None
+
+    def start(self):
+        self._last = self.registry.counter_values()
+        self._last_time = time.monotonic()
+        self._thread.start()
+        return self
+
+    def log(self):
+        now = time.monotonic()
+        values = self.registry.counter_values()
+        elapsed = max(now - self._last_time, 1e-9)
+        moved = [
+            f"{name} {value} (+{value - self._last.get(name, 0)}, {(value - self._last.get(name, 0)) / elapsed:.1f}/s)"
+            for name, value in sorted(values.items()) if value != self._last.get(name, 0)
+        ]
+        if moved:
+            print("📈 " + "; ".join(moved))
+        self._last, self._last_time = values, now
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.log()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.log()
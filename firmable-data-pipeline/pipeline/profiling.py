@@ -0,0 +1,260 @@
+import cProfile
+import itertools
+import math
+import multiprocessing.util
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+PROFILE_DIR = "data/profiles"
+# Fraction of each stage's calls (fragments, batches, ABR files) profiled
+SAMPLE = 0.01
+# Seconds between a worker process's rewrites of a stage's profile files
+WORKER_WRITE_INTERVAL = 30.0
+# Lines listed in each allocation report
+TOP_ALLOCATIONS = 25
+# Stack frames tracemalloc keeps per allocation
+FRAMES = 1
+# From 3.12 cProfile hooks sys.monitoring, which one profiler at a time
+# holds for every thread of the process
+EXCLUSIVE = sys.version_info >= (3, 12)
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_")
+
+
+class _StageProfile:
+    """What was recorded for one stage on one thread of one process."""
+
+    def __init__(self, stage: str, thread: str):
+        self.stage = stage
+        self.thread = thread
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self.profiled = 0
+        self.skipped = 0
+        self.seconds = 0.0
+        # "file:line" -> [bytes, blocks] retained by the profiled calls
+        self.allocations = {}
+        # time.monotonic() of the last write from a worker process
+        self.written_at = None
+
+    def add_allocations(self, before, after):
+        # Leave out the snapshots' own bookkeeping
+        own = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        for diff in after.filter_traces(own).compare_to(before.filter_traces(own), "lineno"):
+            if not diff.size_diff and not diff.count_diff:
+                continue
+            frame = diff.traceback[0]
+            totals = self.allocations.setdefault(f"{frame.filename}:{frame.lineno}", [0, 0])
+            totals[0] += diff.size_diff
+            totals[1] += diff.count_diff
+
+
+class Profiler:
+    """
+    cProfile and tracemalloc per pipeline stage, turned on by run.py --profile.
+
+    Code under `with profiling.stage(name):` is profiled on a `sample`
+    fraction of its calls (1 in 100 by default), spread evenly (1 in 10
+    for 0.1, starting with the first), so the overhead on a full run stays
+    bounded; a sample of 1 profiles every call. Each stage
+    gets one cProfile.Profile per thread, and with `memory` the net
+    allocations of every profiled call, by source line, from tracemalloc
+    snapshots taken around it. Those take time in proportion to the live
+    allocations traced, another reason to sample on large runs.
+
+    A stage nested in a profiled one runs unprofiled (counted as skipped);
+    its time shows up in the outer stage's profile. From Python 3.12 only
+    one call at a time can be profiled in a process, so there a sampled
+    call that comes while another thread's is being profiled is skipped
+    too, and the profile can include what other threads ran meanwhile.
+    tracemalloc is process-wide, so allocation reports always can.
+
+    write() leaves a <stage>.<thread>.<pid>.prof file (for pstats or
+    snakeviz) and a matching .alloc.txt report in `out_dir` for every stage
+    thread with a profiled call. Worker processes (process stages, ABR
+    parse workers, match scoring pools) are never told when they are done,
+    so they write theirs after their first profiled call of a stage, then
+    at most every `write_interval` seconds, and once more when they exit
+    normally (a terminated worker loses the calls since its last write).
+    Forked ones inherit the profiler, others are given settings() to
+    enable it with `worker` set.
+    """
+
+    def __init__(self, out_dir=PROFILE_DIR, sample: float = SAMPLE, memory: bool = True, top: int = TOP_ALLOCATIONS,
+                 worker: bool = False, write_interval: float = WORKER_WRITE_INTERVAL):
+        self.out_dir = Path(out_dir)
+        self.sample = sample
+        self.memory = memory
+        self.top = top
+        self.worker = worker
+        self.write_interval = write_interval
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()
+        self._local = threading.local()
+        self._counters = {}
+        self._stages = {}
+        self._writes_at_exit = False
+
+    def _forked(self):
+        # The parent's profiles stay with the parent
+        self.worker = True
+        self._reset()
+
+    def settings(self) -> dict:
+        return {"out_dir": str(self.out_dir), "sample": self.sample, "memory": self.memory, "top": self.top,
+                "write_interval": self.write_interval}
+
+    def start(self):
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(FRAMES)
+        return self
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _sampled(self, name: str) -> bool:
+        counter = self._counters.get(name)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(name, itertools.count())
+        n = next(counter)
+        return math.floor(n * self.sample) != math.floor((n - 1) * self.sample)
+
+    def _stage_profile(self, name: str) -> _StageProfile:
+        thread = threading.current_thread().name
+        key = (name, thread)
+        profile = self._stages.get(key)
+        if profile is None:
+            with self._lock:
+                profile = self._stages.setdefault(key, _StageProfile(name, thread))
+        return profile
+
+    @contextmanager
+    def stage(self, name: str):
+        profile = self._stage_profile(name)
+        profile.calls += 1
+        if not self._sampled(name):
+            yield
+            return
+        if getattr(self._local, "active", False) or (EXCLUSIVE and not self._busy.acquire(blocking=False)):
+            profile.skipped += 1
+            yield
+            return
+        self._local.active = True
+        try:
+            before = tracemalloc.take_snapshot() if self.memory else None
+            started = time.perf_counter()
+            profile.profile.enable()
+            try:
+                yield
+            finally:
+                profile.profile.disable()
+                profile.seconds += time.perf_counter() - started
+                profile.profiled += 1
+                if before is not None:
+                    profile.add_allocations(before, tracemalloc.take_snapshot())
+        finally:
+            self._local.active = False
+            if EXCLUSIVE:
+                self._busy.release()
+        if self.worker:
+            self._worker_write(profile)
+
+    def _worker_write(self, profile: _StageProfile):
+        if not self._writes_at_exit:
+            # Registered on first use: a forked child starts with the registry cleared.
+            # Pool and Process workers run these finalizers when they exit normally
+            with self._lock:
+                if not self._writes_at_exit:
+                    multiprocessing.util.Finalize(self, self.write, exitpriority=0)
+                    self._writes_at_exit = True
+        if profile.written_at is None or time.monotonic() - profile.written_at >= self.write_interval:
+            self._write_one(profile)
+
+    def _paths(self, profile: _StageProfile) -> tuple[Path, Path]:
+        base = self.out_dir / f"{_slug(profile.stage)}.{_slug(profile.thread)}.{os.getpid()}"
+        return base.with_name(base.name + ".prof"), base.with_name(base.name + ".alloc.txt")
+
+    def _write_one(self, profile: _StageProfile):
+        profile.written_at = time.monotonic()
+        prof_path, alloc_path = self._paths(profile)
+        profile.profile.dump_stats(prof_path)
+        lines = [
+            f"# {profile.stage} on thread {profile.thread} (pid {os.getpid()}): {profile.profiled} of "
+            f"{profile.calls} calls profiled ({profile.skipped} skipped), {profile.seconds:.3f} s",
+        ]
+        if not self.memory:
+            lines.append("# Memory profiling was off")
+        else:
+            grown = [item for item in profile.allocations.items() if item[1][0] > 0]
+            top = sorted(grown, key=lambda item: item[1][0], reverse=True)[:self.top]
+            retained = sum(size for size, _ in profile.allocations.values())
+            lines.append(f"# Net allocations of the profiled calls: {retained / 1024:.1f} KiB; top {len(top)} lines")
+            lines += [f"{size / 1024:12.1f} KiB {blocks:10d} blocks  {line}" for line, (size, blocks) in top]
+        alloc_path.write_text("\n".join(lines) + "\n")
+
+    def write(self) -> list[_StageProfile]:
+        """Writes the profiles and reports of every stage thread with a profiled call and returns them."""
+        written = [profile for profile in list(self._stages.values()) if profile.profiled]
+        for profile in written:
+            self._write_one(profile)
+        return written
+
+
+_profiler = None
+
+
+def _forked():
+    if _profiler is not None:
+        _profiler._forked()
+
+
+os.register_at_fork(after_in_child=_forked)
+
+
+def enable(out_dir=PROFILE_DIR, sample: float = SAMPLE, memory: bool = True, top: int = TOP_ALLOCATIONS,
+           worker: bool = False, write_interval: float = WORKER_WRITE_INTERVAL) -> Profiler:
+    global _profiler
+    _profiler = Profiler(out_dir, sample=sample, memory=memory, top=top, worker=worker,
+                         write_interval=write_interval).start()
+    return _profiler
+
+
+def disable():
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+    _profiler = None
+
+
+def settings():
+    """Arguments for enable() in a worker process that doesn't inherit the profiler, or None if it is off."""
+    return _profiler.settings() if _profiler is not None else None
+
+
+def stage(name: str):
+    """Profiles the block as stage `name` when profiling is enabled; otherwise does nothing."""
+    return _profiler.stage(name) if _profiler is not None else nullcontext()
+
+
+def write():
+    """Writes the enabled profiler's files and prints a line per stage thread."""
+    if _profiler is None:
+        return
+    for profile in sorted(_profiler.write(), key=lambda p: (p.stage, p.thread)):
+        print(f"  🔬 {profile.stage} [{profile.thread}]: {profile.profiled}/{profile.calls} calls profiled, "
+              f"{profile.seconds:.2f} s")
+    print(f"🔬 Profiles written to {_profiler.out_dir}")
@@ -0,0 +1,267 @@
+import multiprocessing as mp
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Iterable
+
+from pipeline import metrics, profiling
+
+QUEUE_SIZE = 8
+POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+class StageStopped(Exception):
+    """Raised inside a stage thread when another stage failed and the pipeline is shutting down."""
+
+
+def _stage_timer(pipeline: str, stage: str) -> metrics.Histogram:
+    return metrics.timer("stage_seconds", "Time a stage spends on one item or batch", pipeline=pipeline, stage=stage)
+
+
+def process_context():
+    """
+    Multiprocessing context for worker processes started while the
+    pipeline runs. By then the process is running threads (stages, the
+    fetcher pool, the database writer), and a forked child can inherit a
+    lock one of them held at that moment and hang on it; a fork server
+    forks from a clean single-threaded process instead.
+    """
+    return mp.get_context("forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn")
+
+
+def _init_worker(profile_settings):
+    metrics.REGISTRY.reset()
+    if profile_settings is not None:
+        profiling.enable(**profile_settings, worker=True)
+
+
+def _call_in_worker(fn, item, pipeline: str, stage: str):
+    """Runs a process stage's `fn` and hands the metrics it recorded back to the parent."""
+    with _stage_timer(pipeline, stage).time(), profiling.stage(f"{pipeline}/{stage}"):
+        result = fn(item)
+    return result, metrics.REGISTRY.collect()
+
+
+class Stage:
+    """
+    One step of a Pipeline.
+
+    `fn` is called with each item from the previous stage, or with a list of
+    up to `batch_size` items when `batch_size` is set. Its return value is
+    passed on (None is dropped; with `flatten` the result is iterated and
+    each element passed on). The last stage's results are discarded.
+
+    `workers` threads call `fn` concurrently, or with `processes` a pool of
+    `workers` processes does (`fn` and its items must then be picklable;
+    the pool is started by a fork server, or spawned, not forked from the
+    threaded parent).
+    Items wait in a queue of `queue_size` in front of the stage, so a slow
+    stage blocks the ones before it instead of letting work pile up.
+    """
+
+    def __init__(self, name: str, fn: Callable, workers: int = 1, batch_size: int = None,
+                 processes: bool = False, flatten: bool = False, queue_size: int = QUEUE_SIZE):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.processes = processes
+        self.flatten = flatten
+        self.queue_size = queue_size
+        self.items_in = 0
+        self.items_out = 0
+
+
+class Pipeline:
+    """
+    Runs `source` (any iterable) through a chain of Stages, each in its own
+    threads, connected by bounded queues.
+
+    The first exception raised by the source or any stage stops every
+    stage, closes the source and is re-raised from `run`.
+
+    Every stage's items in and out and time per call are recorded in
+    pipeline.metrics, labelled with the pipeline and stage names. Metrics
+    recorded inside process workers are merged back with each result.
+    With pipeline.profiling enabled, each stage call, and each item taken
+    from the source, is profiled as "<pipeline>/<stage>" ("/source").
+    """
+
+    def __init__(self, source: Iterable, stages: list[Stage], name: str = "pipeline"):
+        self.source = source
+        self.stages = stages
+        self.name = name
+        self.source_items = 0
+        self._queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+        self._stop = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+        self._running = [stage.workers if not stage.processes else 1 for stage in stages]
+        self._items_in = [
+            metrics.counter("stage_items_in_total", "Items taken in by a pipeline stage", pipeline=name, stage=s.name)
+            for s in stages
+        ]
+        self._items_out = [
+            metrics.counter("stage_items_out_total", "Items passed on by a pipeline stage", pipeline=name, stage=s.name)
+            for s in stages
+        ]
+
+    def _fail(self, error: BaseException):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+    def _put(self, index: int, item):
+        if index >= len(self._queues):
+            return
+        while True:
+            if self._stop.is_set():
+                raise StageStopped()
+            try:
+                self._queues[index].put(item, timeout=POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, index: int):
+        while True:
+            if self._stop.is_set():
+                raise StageStopped()
+            try:
+                return self._queues[index].get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+    def _emit(self, index: int, result):
+        """Passes a stage result on to stage `index`."""
+        stage = self.stages[index - 1]
+        if result is None:
+            return
+        for item in (result if stage.flatten else (result,)):
+            stage.items_out += 1
+            self._items_out[index - 1].inc()
+            self._put(index, item)
+
+    def _emit_from_worker(self, index: int, outcome):
+        result, worker_metrics = outcome
+        metrics.REGISTRY.merge(worker_metrics)
+        self._emit(index, result)
+
+    def _finish(self, index: int):
+        """Called by each of stage `index`'s threads as it exits; the last one signals the next stage."""
+        with self._lock:
+            self._running[index] -= 1
+            last = self._running[index] == 0
+        if last and index + 1 < len(self.stages):
+            for _ in range(self._running[index + 1]):
+                self._put(index + 1, _DONE)
+
+    def _batches(self, index: int):
+        """Yields the items of stage `index`'s input queue, grouped as the stage asks."""
+        stage = self.stages[index]
+        batch = []
+        while True:
+            item = self._get(index)
+            if item is _DONE:
+                break
+            stage.items_in += 1
+            self._items_in[index].inc()
+            if not stage.batch_size:
+                yield item
+                continue
+            batch.append(item)
+            if len(batch) >= stage.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _run_source(self):
+        source = iter(self.source)
+        try:
+            while True:
+                with profiling.stage(f"{self.name}/source"):
+                    item = next(source, _DONE)
+                if item is _DONE:
+                    break
+                self.source_items += 1
+                self._put(0, item)
+            for _ in range(self._running[0]):
+                self._put(0, _DONE)
+        except StageStopped:
+            pass
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            close = getattr(self.source, "close", None)
+            if close is not None:
+                close()
+
+    def _run_threaded(self, index: int):
+        stage = self.stages[index]
+        timer = _stage_timer(self.name, stage.name)
+        profile_name = f"{self.name}/{stage.name}"
+        try:
+            for item in self._batches(index):
+                started = time.perf_counter()
+                with profiling.stage(profile_name):
+                    result = stage.fn(item)
+                timer.observe(time.perf_counter() - started)
+                self._emit(index + 1, result)
+            self._finish(index)
+        except StageStopped:
+            pass
+        except BaseException as e:
+            self._fail(e)
+
+    def _run_processes(self, index: int):
+        stage = self.stages[index]
+        context = process_context()
+        try:
+            with ProcessPoolExecutor(max_workers=stage.workers, mp_context=context,
+                                     initializer=_init_worker, initargs=(profiling.settings(),)) as pool:
+                in_flight = set()
+                try:
+                    for item in self._batches(index):
+                        in_flight.add(pool.submit(_call_in_worker, stage.fn, item, self.name, stage.name))
+                        if len(in_flight) >= stage.workers * 2:
+                            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                self._emit_from_worker(index + 1, future.result())
+                    for future in in_flight:
+                        self._emit_from_worker(index + 1, future.result())
+                finally:
+                    for future in in_flight:
+                        future.cancel()
+            self._finish(index)
+        except StageStopped:
+            pass
+        except BaseException as e:
+            self._fail(e)
+
+    def run(self):
+        threads = [threading.Thread(target=self._run_source, name=f"{self.name}-source", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            if stage.processes:
+                threads.append(threading.Thread(target=self._run_processes, args=(index,),
+                                                name=f"{self.name}-{stage.name}", daemon=True))
+            else:
+                threads += [
+                    threading.Thread(target=self._run_threaded, args=(index,),
+                                     name=f"{self.name}-{stage.name}-{n}", daemon=True)
+                    for n in range(stage.workers)
+                ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            print(f"[!] {self.name} stopped: {self._error!r}")
+            raise self._error
+        summary = ", ".join(f"{s.name} {s.items_in} in / {s.items_out} out" for s in self.stages)
+        print(f"  ✔ {self.name}: {self.source_items} source items; {summary}")
@@ -1,102 +1,254 @@
 import threading
 import argparse
+import fcntl
 import time
-from db.conn import engine
+from db.conn import engine, SessionLocal
 from db.base import Base
-from extract.abr_extractor import extract_abr_records, download_and_extract_abr_zip
-from extract.common_crawl_extractor import search_common_crawl, download_and_extract_company_data
+from extract.abr_extractor import (
+    PARSE_WORKERS, ZIP_PATH, batched, download_abr_zip, download_and_extract_abr_zip, extract_abr_records,
+    iter_abr_batches, list_abr_members, parse_abr_member
+)
+from extract.cache import CACHE_MAX_BYTES, DiskCache
+from extract.download import DOWNLOAD_SEGMENTS
+from extract.cdx_client import (
+    CdxClient, CdxFetchError, PAGE_CONCURRENCY, domain_query, iter_warc_groups, journal_query, page_groups
+)
+from extract.cdx_select import LANGUAGES, MAX_RECORD_BYTES, MAX_URL_DEPTH, CdxSelector
+from extract.dedup import DEDUP_STORES, DatabaseDedupStore, domain_of, seed_from_database
+from extract.common_crawl_extractor import iter_warc_fragments, parse_fragment
+from db.page_text import TEXT_MAX_CHARS, TEXT_RETENTION, TEXT_RETENTION_MODES
+from extract.ner import NERStage, NER_BATCH_SIZE, NER_TEXT_CAP, NER_N_PROCESS
+from extract.warc_fetcher import WarcFetcher, MAX_CONCURRENCY, PER_HOST_CONCURRENCY, MAX_RANGE_GAP
+from load.fingerprints import ABRChangeFilter
 from load.loader import load_abr_records, load_crawl_records
-from collections import defaultdict
-from matcher.em import perform_string_matching
+from matcher.em import (
+    MATCH_ENGINES, build_abr_index, perform_string_matching, score_crawl_shard, start_sharded_match,
+    write_shard_matches
+)
+from pipeline import leases, profiling
+from pipeline.journal import FAILED, JOURNAL_PATH, LOADED, CrawlJournal, keyed
+from pipeline.metrics import LOG_INTERVAL, REGISTRY, ThroughputLog
+from pipeline.stages import Pipeline, Stage
+from functools import partial
+from itertools import chain
 import os
 import subprocess
 BATCH_SIZE = 500
+CRAWL_DOMAIN = "com.au"
+# Distributed runs (--coordinator / --worker): CDX index pages per unit,
+# crawl url ranges matched per run, and seconds between progress checks
+CDX_PAGES_PER_UNIT = 5
+MATCH_SHARDS = 16
+COORDINATOR_POLL_SECONDS = 10
+# Claim order: drain WARC files already planned before reading more CDX pages
+UNIT_PRIORITY = {"warc_file": 0, "abr_member": 1, "match_shard": 1, "cdx_pages": 2}
 
 
-def run_abr_pipeline(abr_limit=3, record_limit=None):
-    print("\n📥 Ensuring ABR XML files exist...")
-    xml_paths = download_and_extract_abr_zip()
-    print(f"  ✔ Found {len(xml_paths)} XML files.")
-    if abr_limit:
-        xml_paths = xml_paths[:abr_limit]
-
-    print("🔄 Parsing and loading ABR records...")
-    batch = []
+def _limit_batches(batches, record_limit):
+    """Truncates a stream of record batches after `record_limit` records (no limit if falsy)."""
     count = 0
-    for record in extract_abr_records(xml_paths):
-        batch.append(record)
-        if len(batch) >= BATCH_SIZE:
-            load_abr_records(batch)
+    try:
+        for batch in batches:
+            if record_limit:
+                batch = batch[:record_limit - count]
             count += len(batch)
-            print(f"  ✔ Loaded {count} ABR records so far...")
-            batch = []
-        if record_limit and count >= record_limit:
-            break
-    if batch and (not record_limit or count < record_limit):
-        load_abr_records(batch)
-        count += len(batch)
-        print(f"  ✔ Loaded total {count} ABR records.")
+            yield batch
+            if record_limit and count >= record_limit:
+                break
+    finally:
+        batches.close()
+
+
+def run_abr_pipeline(abr_limit=3, record_limit=None, stream=False, workers=PARSE_WORKERS,
+                     download_segments=DOWNLOAD_SEGMENTS, full_load=False, batch_size=BATCH_SIZE, load_workers=1):
+    if stream:
+        print("\n📥 Ensuring ABR ZIP exists...")
+        zip_path = download_abr_zip(segments=download_segments)
+        members = list_abr_members(zip_path)
+        print(f"  ✔ Found {len(members)} XML files.")
+        if abr_limit:
+            members = members[:abr_limit]
+        batches = iter_abr_batches(zip_path, members, workers=workers, batch_size=batch_size)
+    else:
+        print("\n📥 Ensuring ABR XML files exist...")
+        xml_paths = download_and_extract_abr_zip(segments=download_segments)
+        print(f"  ✔ Found {len(xml_paths)} XML files.")
+        if abr_limit:
+            xml_paths = xml_paths[:abr_limit]
+        batches = batched(extract_abr_records(xml_paths), batch_size)
+
+    change_filter = ABRChangeFilter()
+    if not full_load:
+        with SessionLocal() as session:
+            change_filter = ABRChangeFilter.load(session)
+        print(f"  ✔ Loaded fingerprints of {len(change_filter)} previously loaded ABNs.")
+
+    def filter_batch(batch):
+        changed, fingerprints = change_filter.split(batch)
+        return (changed, fingerprints) if changed else None
+
+    def load_batch(item):
+        changed, fingerprints = item
+        load_abr_records(changed, fingerprints)
+        print(f"  ✔ Loaded {len(changed)} new or changed ABR records...")
+
+    # Parsing, change detection and loading overlap: each runs in its own
+    # thread(s) and hands batches on through a bounded queue
+    print("🔄 Parsing and loading ABR records...")
+    abr_pipeline = Pipeline(_limit_batches(batches, record_limit), [
+        Stage("filter", filter_batch),
+        Stage("load", load_batch, workers=load_workers),
+    ], name="ABR pipeline")
+    abr_pipeline.run()
+
+    counts = change_filter.counts
+    count = sum(counts.values())
     if count == 0:
         print("⚠️ No ABR records were loaded. Check XML contents or parsing logic.")
+    else:
+        print(f"  ✔ Processed total {count} ABR records: {counts['inserted']} inserted, "
+              f"{counts['updated']} updated, {counts['skipped']} unchanged and skipped.")
 
 
+def _parse_with_domain(parse, item):
+    """Runs a keyed() parse stage and tags its outcome with the fragment's domain, for releasing its claim."""
+    return domain_of(item[0]["url"]), parse(item)
 
 
-def run_common_crawl_pipeline(crawl_pages=100):
-    print("\n🌍 Fetching Common Crawl index metadata...")
-    domain = "com.au"
-    records = list(search_common_crawl(domain, pages=crawl_pages))
-    print(f"  ✔ Fetched {len(records)} crawl index records")
-
-    # Group digests and metadata by WARC file
-    warc_index = defaultdict(list)
-    for rec in records: 
-        warc_path = rec.get("filename")
-        digest = rec.get("digest")
-        offset = rec.get("offset")
-        length = rec.get("length")
-        timestamp = rec.get("timestamp")
-        url = rec.get("url")
-        if warc_path and digest and offset and length:
-            warc_index[warc_path].append({
-                "digest": digest,
-                "offset": int(offset),
-                "length": int(length),
-                "warc_path": warc_path,
-                "url": url,
-                "timestamp": timestamp
-            })
+def _load_crawl_batch(batch):
+    try:
+        load_crawl_records(batch)
+        print(f"✅ Loaded {len(batch)} crawl records")
+        return len(batch)
+    except Exception as e:
+        print(f"[!] Failed to load crawl batch: {e}")
+        return 0
 
-    print(f"🔁 Found {len(warc_index)} WARC files with matching digests")
 
-    total_loaded = 0
+def run_common_crawl_pipeline(crawl_pages=100, fetch_concurrency=MAX_CONCURRENCY, fetch_per_host=PER_HOST_CONCURRENCY,
+                              range_gap=MAX_RANGE_GAP, cdx_concurrency=PAGE_CONCURRENCY,
+                              ner_batch_size=NER_BATCH_SIZE, ner_text_cap=NER_TEXT_CAP, ner_processes=NER_N_PROCESS,
+                              parse_workers=1, batch_size=BATCH_SIZE, load_workers=1,
+                              use_cache=True, cache_max_bytes=CACHE_MAX_BYTES, dedup_store="memory", seed_dedup=True,
+                              text_retention=TEXT_RETENTION, text_max_chars=TEXT_MAX_CHARS,
+                              resume=False, journal_path=JOURNAL_PATH, max_record_bytes=MAX_RECORD_BYTES,
+                              max_url_depth=MAX_URL_DEPTH, languages=LANGUAGES):
+    domain = CRAWL_DOMAIN
+    # Snapshots are immutable, so CDX pages and WARC fragments from earlier
+    # runs are served from the local cache
+    cache = DiskCache(max_bytes=cache_max_bytes) if use_cache else None
+    cdx_client = CdxClient(concurrency=cdx_concurrency, cache=cache)
 
+    # Progress is journalled so that a run that dies can be resumed: with
+    # `resume`, recorded CDX pages are not requested again and only their
+    # unfinished fragments are retried
+    journal = CrawlJournal(journal_path)
+    query = journal_query(cdx_client, domain)
+    retry = []
+    if resume:
+        retry = journal.unfinished(query)
+        print(f"  ↩️ Resuming: {len(journal.done_pages(query))} CDX pages already read, "
+              f"{len(retry)} fragments to retry")
+    else:
+        journal.reset()
 
-    for warc_path, entries in list(warc_index.items()):
+    # One page per domain: domains claimed here (or already in the database)
+    # are skipped before any WARC request is planned for them. A persistent
+    # store starts over with the journal, or claims left by an earlier run
+    # would skip those domains for good
+    dedup = DEDUP_STORES[dedup_store]()
+    if not resume:
+        dedup.clear()
+    # A persistent store still holds the claims of fragments being retried;
+    # domains that did get loaded are claimed again by the seeding below
+    for entry in retry:
+        dedup.release(domain_of(entry["url"]))
+    if seed_dedup:
+        session = SessionLocal()
         try:
-            # Pass full entry metadata to the extractor
-            extracted = download_and_extract_company_data(
-                entries=entries,  # ⬅ Updated: pass entries directly
-                digest_set={e["digest"] for e in entries})
-            if extracted:
-                print(f"✅ Extracted {len(extracted)} records from {warc_path}")
-                load_crawl_records(extracted)
-                total_loaded += len(extracted)
-        except Exception as e:
-            print(f"[!] Failed to process {warc_path}: {e}")
+            pages = seed_from_database(dedup, session)
+        finally:
+            session.close()
+        print(f"  ✔ Domain dedup ({dedup_store}): {len(dedup)} domains already covered by {pages} stored pages")
+
+    print("\n🌍 Streaming Common Crawl index metadata...")
+    # Captures that are not HTML, too large or too deep are dropped, and the
+    # best one per domain chosen, before any WARC byte is requested
+    selector = CdxSelector(max_bytes=max_record_bytes, max_depth=max_url_depth, languages=languages)
+    # Pages the index keeps failing on are left out of the journal for --resume
+    failed_pages = []
+    warc_groups = iter_warc_groups(cdx_client, domain, pages=crawl_pages, journal=journal, selector=selector,
+                                   failed=failed_pages)
+    fetcher = WarcFetcher(max_concurrency=fetch_concurrency, per_host_concurrency=fetch_per_host)
+    ner_stage = NERStage(batch_size=ner_batch_size, text_cap=ner_text_cap, n_process=ner_processes)
+
+    # CDX pages stream in grouped by WARC file and fragments from every file
+    # share one fetch pool (the source stage); parsing, NER and loading each
+    # run as their own stage behind a bounded queue
+    entries = chain(retry, (e for _, file_entries in warc_groups for e in file_entries))
+    fragments = iter_warc_fragments(entries, fetcher=fetcher, max_range_gap=range_gap, cache=cache, dedup=dedup,
+                                    journal=journal)
+    parse_in_processes = parse_workers > 1
+    if parse_in_processes:
+        # memoryview slices of the fetched range can't be pickled
+        fragments = ((entry, bytes(member)) for entry, member in fragments)
+
+    loaded = []
 
-    print(f"  ✔ Loaded {total_loaded} enriched company records to DB")
+    def parsed(item):
+        domain, outcome = item
+        result = journal.parsed(outcome)
+        if not result:
+            # Nothing to load from this page; leave the domain to a later run
+            dedup.release(domain)
+        return result
 
+    def load_batch(batch):
+        count = _load_crawl_batch(batch)
+        loaded.append(count)
+        journal.mark([r["journal_key"] for r in batch], LOADED if count else FAILED, None if count else "load failed")
+        if not count:
+            for record in batch:
+                dedup.release(domain_of(record["url"]))
 
-def run_all_parallel(run_abr=True, run_crawl=True, abr_limit=3, abr_records=None, crawl_pages=3):
+    # Parse outcomes are returned with their journal key (and domain) and
+    # journalled in this process
+    parse = partial(_parse_with_domain, partial(keyed, partial(parse_fragment, text_retention=text_retention,
+                                                                text_max_chars=text_max_chars)))
+    try:
+        Pipeline(fragments, [
+            Stage("parse", parse, workers=parse_workers, processes=parse_in_processes),
+            Stage("journal", parsed),
+            Stage("ner", ner_stage.resolve, batch_size=ner_batch_size, flatten=True),
+            Stage("load", load_batch, batch_size=batch_size, workers=load_workers),
+        ], name="Common Crawl pipeline").run()
+    finally:
+        fetcher.close()
+        cdx_client.close()
+        if cache is not None:
+            print(f"  ✔ Crawl cache: {cache.hits} hits, {cache.misses} misses, {cache.total_bytes} bytes stored")
+            cache.close()
+        counts = journal.counts(query)
+        journal.close()
+        print(f"  ✔ Crawl journal: {', '.join(f'{n} {status}' for status, n in sorted(counts.items()))}")
+        print(f"  ✔ CDX selection: {selector.summary()}")
+        if failed_pages:
+            print(f"⚠️ {len(failed_pages)} CDX pages could not be fetched ({sorted(failed_pages)}); "
+                  f"run again with --resume to fetch them")
+
+    print(f"  ✔ Loaded {sum(loaded)} enriched company records to DB")
+
+
+def run_all_parallel(run_abr=True, run_crawl=True, abr_limit=3, abr_records=None, crawl_pages=3, crawl_options=None,
+                     abr_options=None):
     print("🧱 Creating database tables...")
     Base.metadata.create_all(engine)
 
     threads = []
     if run_abr:
-        threads.append(threading.Thread(target=run_abr_pipeline, args=(abr_limit, abr_records)))
+        threads.append(threading.Thread(target=run_abr_pipeline, args=(abr_limit, abr_records), kwargs=abr_options or {}))
     if run_crawl:
-        threads.append(threading.Thread(target=run_common_crawl_pipeline, args=(crawl_pages,)))
+        threads.append(threading.Thread(target=run_common_crawl_pipeline, args=(crawl_pages,), kwargs=crawl_options or {}))
 
     print("🚀 Starting data pipelines...")
     for t in threads:
@@ -105,11 +257,274 @@ def run_all_parallel(run_abr=True, run_crawl=True, abr_limit=3, abr_records=None
         t.join()
     print("\n✅ All data pipelines completed.")
 
-def run_dbt_command(command: str, dbt_path: str, dbt_target: str = None):
+def _wait_for_units(kinds) -> dict:
+    """Blocks until no unit of `kinds` is pending or leased; returns the final counts per status."""
+    while True:
+        with SessionLocal() as session:
+            counts = leases.counts(session, kinds)
+        if not counts.get(leases.PENDING, 0) + counts.get(leases.LEASED, 0):
+            return counts
+        print(f"⏳ Units: {', '.join(f'{n} {status}' for status, n in sorted(counts.items()))}")
+        time.sleep(COORDINATOR_POLL_SECONDS)
+
+
+def _plan_abr(abr_limit, download_segments):
+    print("\n📥 Ensuring ABR ZIP exists...")
+    members = list_abr_members(download_abr_zip(segments=download_segments))
+    if abr_limit:
+        members = members[:abr_limit]
+    return [(f"abr:{member}", "abr_member", {"member": member}) for member in members]
+
+
+def _plan_crawl(session, crawl_pages, pages_per_unit, cdx_concurrency, resume, seed_dedup):
+    # Every worker claims domains in the database, so each is loaded once
+    # across nodes; a resumed run keeps the claims of the units it retries
+    dedup = DatabaseDedupStore()
+    if not resume:
+        dedup.clear()
+    if seed_dedup:
+        pages = seed_from_database(dedup, session)
+        print(f"  ✔ Domain dedup (database): {len(dedup)} domains already covered by {pages} stored pages")
+    cdx_client = CdxClient(concurrency=cdx_concurrency)
+    try:
+        total = cdx_client.num_pages(domain_query(CRAWL_DOMAIN))
+    finally:
+        cdx_client.close()
+    if crawl_pages is not None:
+        total = min(total, crawl_pages)
+    return [
+        (f"cdx:{CRAWL_DOMAIN}:{first}-{min(first + pages_per_unit, total) - 1}", "cdx_pages",
+         {"domain": CRAWL_DOMAIN, "first": first, "last": min(first + pages_per_unit, total) - 1})
+        for first in range(0, total, pages_per_unit)
+    ]
+
+
+def _plan_matching(session, shards, match_engine, resume):
+    if resume and leases.counts(session, ["match_shard"]):
+        print("  ↩️ Resuming the planned match shards")
+        return []
+    print(f"♻️ Planning a full {match_engine} re-match in {shards} shards...")
+    return [
+        (f"match:{i}", "match_shard", {"first_url": first_url, "last_url": last_url, "engine": match_engine})
+        for i, (first_url, last_url) in enumerate(start_sharded_match(session, shards))
+    ]
+
+
+def _enqueue(session, units) -> int:
+    kinds = sorted({kind for _, kind, _ in units})
+    added = sum(
+        leases.enqueue(session, [u for u in units if u[1] == kind], priority=UNIT_PRIORITY[kind]) for kind in kinds
+    )
+    print(f"  ✔ Planned {len(units)} units ({added} new): {', '.join(kinds) or 'none'}")
+    return added
+
+
+def run_coordinator(run_abr=True, run_crawl=True, run_matching=False, abr_limit=3, crawl_pages=3,
+                    cdx_pages_per_unit=CDX_PAGES_PER_UNIT, match_shards=MATCH_SHARDS, match_engine="fuzzy",
+                    resume=False, seed_dedup=True, download_segments=DOWNLOAD_SEGMENTS,
+                    cdx_concurrency=PAGE_CONCURRENCY, wait=False, after_load=None):
+    """
+    Splits a run into units in the work_leases table, for any number of
+    `run.py --worker` processes sharing the database to claim:
+
+      abr_member   one XML file of the ABR ZIP
+      cdx_pages    a range of CDX index pages, expanded into warc_file units
+      warc_file    one CDX page's fragments in one WARC file: fetched,
+                   parsed, NER'd and loaded
+      match_shard  a url range of crawl_preprocess scored against the
+                   whole ABR index (a full re-match)
+
+    Without `resume`, earlier units of the planned kinds are dropped first;
+    with it, units already done are kept. Matching reads the dbt models
+    built from the loaded data, so when loads are planned too it is only
+    planned with `wait`: once every load unit is finished and `after_load`
+    (dbt) has run.
+    """
+    print("🧱 Creating database tables...")
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    try:
+        load_kinds = [kind for kind, planned in (("abr_member", run_abr), ("cdx_pages", run_crawl),
+                                                 ("warc_file", run_crawl)) if planned]
+        if load_kinds and not resume:
+            leases.clear(session, load_kinds)
+        units = []
+        if run_abr:
+            units += _plan_abr(abr_limit, download_segments)
+        if run_crawl:
+            units += _plan_crawl(session, crawl_pages, cdx_pages_per_unit, cdx_concurrency, resume, seed_dedup)
+        if units:
+            _enqueue(session, units)
+
+        if load_kinds and wait:
+            counts = _wait_for_units(load_kinds)
+            print(f"✅ Load units finished: {', '.join(f'{n} {status}' for status, n in sorted(counts.items()))}")
+            if after_load is not None:
+                after_load()
+        if run_matching:
+            if load_kinds and not wait:
+                print("⚠️ Matching is planned once loading finishes; rerun with --entity-matching alone, "
+                      "or add --coordinator-wait")
+                return
+            if not resume:
+                leases.clear(session, ["match_shard"])
+            _enqueue(session, _plan_matching(session, match_shards, match_engine, resume))
+            if wait:
+                counts = _wait_for_units(["match_shard"])
+                print(f"🎉 Match shards finished: {', '.join(f'{n} {status}' for status, n in sorted(counts.items()))}")
+    finally:
+        session.close()
+
+
+def _shared_abr_zip(download_segments):
+    """download_abr_zip() under a file lock, so workers on one node download the ZIP once between them."""
+    with open(ZIP_PATH.with_suffix(".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            return download_abr_zip(segments=download_segments)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _work_abr_member(unit, worker):
+    options = worker["options"]
+    if "abr_zip" not in worker:
+        worker["abr_zip"] = _shared_abr_zip(options["download_segments"])
+    if "abr_filter" not in worker:
+        with SessionLocal() as session:
+            worker["abr_filter"] = ABRChangeFilter() if options["full_abr_load"] else ABRChangeFilter.load(session)
+    change_filter = worker["abr_filter"]
+    member = unit["payload"]["member"]
+    loaded = 0
+    try:
+        for batch in batched(parse_abr_member(worker["abr_zip"], member), options["batch_size"]):
+            changed, fingerprints = change_filter.split(batch)
+            if changed:
+                load_abr_records(changed, fingerprints)
+                loaded += len(changed)
+    except Exception:
+        # The filter already counts this member's records as loaded; re-read it for the retry
+        worker.pop("abr_filter")
+        raise
+    print(f"  ✔ {member}: loaded {loaded} new or changed ABR records")
+
+
+def _work_cdx_pages(unit, worker):
+    payload = unit["payload"]
+    units = []
+    failed = []
+    for page, raw_records in worker["cdx_client"].iter_pages(domain_query(payload["domain"]), payload["last"] + 1,
+                                                              skip=set(range(payload["first"])), failed=failed,
+                                                              ordered=True):
+        units += [
+            (f"warc:{payload['domain']}:{page}:{warc_path}", "warc_file", {"entries": entries})
+            for warc_path, entries in page_groups(raw_records, worker["cdx_selector"]).items()
+        ]
+    # The pages that were read are planned either way; a retry of the unit
+    # re-reads them, and enqueue() keeps the WARC units already there
+    with SessionLocal() as session:
+        added = leases.enqueue(session, units, priority=UNIT_PRIORITY["warc_file"])
+    print(f"  ✔ CDX pages {payload['first']}-{payload['last']}: {len(units)} WARC file units ({added} new); "
+          f"{worker['cdx_selector'].summary()}")
+    if failed:
+        raise CdxFetchError(f"CDX pages {sorted(failed)} could not be fetched")
+
+
+def _work_warc_file(unit, worker):
+    options = worker["options"]
+    # Domains are claimed in the database on behalf of this unit: no other
+    # unit loads them, and a retry of this one gets them back
+    dedup = DatabaseDedupStore(owner=unit["key"])
+    fragments = iter_warc_fragments(unit["payload"]["entries"], fetcher=worker["fetcher"],
+                                    max_range_gap=options["range_gap"], cache=worker["cache"], dedup=dedup)
+    loaded = []
+
+    def load_batch(batch):
+        load_crawl_records(batch)
+        loaded.append(len(batch))
+
+    Pipeline(fragments, [
+        Stage("parse", partial(parse_fragment, text_retention=options["text_retention"],
+                               text_max_chars=options["text_max_chars"])),
+        Stage("ner", worker["ner_stage"].resolve, batch_size=options["ner_batch_size"], flatten=True),
+        Stage("load", load_batch, batch_size=options["batch_size"]),
+    ], name=unit["key"]).run()
+    if dedup.released:
+        raise RuntimeError(f"{dedup.released} fragments could not be fetched")
+    print(f"  ✔ {unit['key']}: loaded {sum(loaded)} crawl records")
+
+
+def _work_match_shard(unit, worker):
+    payload = unit["payload"]
+    # Built on the first shard and reused: the ABR side does not change while shards are scored
+    if worker.get("match_engine") != payload["engine"]:
+        with SessionLocal() as session:
+            worker["match_index"] = build_abr_index(session, engine=payload["engine"])[0]
+        worker["match_engine"] = payload["engine"]
+    bounds = (payload["first_url"], payload["last_url"])
+    matches = score_crawl_shard(worker["match_index"], bounds)
+    with SessionLocal() as session:
+        write_shard_matches(session, bounds, matches)
+    print(f"  ✔ {unit['key']}: {len(matches)} matches")
+
+
+UNIT_HANDLERS = {
+    "abr_member": _work_abr_member,
+    "cdx_pages": _work_cdx_pages,
+    "warc_file": _work_warc_file,
+    "match_shard": _work_match_shard,
+}
+
+
+def run_worker(worker_id=None, lease_seconds=leases.LEASE_SECONDS, kinds=None, fetch_concurrency=MAX_CONCURRENCY,
+               fetch_per_host=PER_HOST_CONCURRENCY, range_gap=MAX_RANGE_GAP, cdx_concurrency=PAGE_CONCURRENCY,
+               ner_batch_size=NER_BATCH_SIZE, ner_text_cap=NER_TEXT_CAP, ner_processes=NER_N_PROCESS,
+               batch_size=BATCH_SIZE, use_cache=True, cache_max_bytes=CACHE_MAX_BYTES,
+               text_retention=TEXT_RETENTION, text_max_chars=TEXT_MAX_CHARS,
+               download_segments=DOWNLOAD_SEGMENTS, full_abr_load=False, max_record_bytes=MAX_RECORD_BYTES,
+               max_url_depth=MAX_URL_DEPTH, languages=LANGUAGES):
+    """
+    Claims and runs units planned by run_coordinator() until none is left
+    pending or leased, renewing each lease while its unit runs. Units of a
+    worker that dies are taken over by another once their lease expires.
+    """
+    Base.metadata.create_all(engine)
+    cache = DiskCache(max_bytes=cache_max_bytes) if use_cache else None
+    worker = {
+        "cache": cache,
+        "cdx_client": CdxClient(concurrency=cdx_concurrency, cache=cache),
+        "cdx_selector": CdxSelector(max_bytes=max_record_bytes, max_depth=max_url_depth, languages=languages),
+        "fetcher": WarcFetcher(max_concurrency=fetch_concurrency, per_host_concurrency=fetch_per_host),
+        "ner_stage": NERStage(batch_size=ner_batch_size, text_cap=ner_text_cap, n_process=ner_processes),
+        "options": {
+            "range_gap": range_gap, "ner_batch_size": ner_batch_size, "batch_size": batch_size,
+            "text_retention": text_retention, "text_max_chars": text_max_chars,
+            "download_segments": download_segments, "full_abr_load": full_abr_load,
+        },
+    }
+    owner = worker_id or leases.worker_name()
+    print(f"👷 Worker {owner} waiting for units...")
+    try:
+        summary = leases.work({kind: partial(handler, worker=worker) for kind, handler in UNIT_HANDLERS.items()},
+                              owner=owner, ttl=lease_seconds, kinds=kinds)
+    finally:
+        worker["fetcher"].close()
+        worker["cdx_client"].close()
+        if cache is not None:
+            cache.close()
+    print(f"✅ Worker {owner} finished: {summary['done']} units done, {summary['failed']} failed, "
+          f"{summary['lost']} lost to other workers")
+    return summary
+
+
+def run_dbt_command(command: str, dbt_path: str, dbt_target: str = None, full_refresh: bool = False):
     print(f"\n⚙️ Running: `dbt {command}` in {dbt_path}...")
     cmd = ["dbt", command, "--project-dir", dbt_path]
     if dbt_target:
         cmd += ["--target", dbt_target]
+    if full_refresh:
+        # Rebuilds incremental models from scratch instead of only new or changed rows
+        cmd.append("--full-refresh")
 
     try:
         subprocess.run(cmd, check=True)
@@ -125,30 +540,158 @@ if __name__ == "__main__":
     parser.add_argument("--abr-limit", type=int, default=3, help="Limit number of ABR XML files")
     parser.add_argument("--crawl-pages", type=int, default=3, help="Number of Common Crawl pages to fetch")
     parser.add_argument("--abr-records", type=int, help="Limit number of ABR records to load")
+    parser.add_argument("--abr-stream", action="store_true", help="Parse ABR XML straight from the ZIP instead of extracting it to disk")
+    parser.add_argument("--abr-workers", type=int, default=PARSE_WORKERS, help="Processes parsing ABR XML files (with --abr-stream)")
+    parser.add_argument("--abr-download-segments", type=int, default=DOWNLOAD_SEGMENTS, help="Parallel byte-range segments for the ABR ZIP download")
+    parser.add_argument("--full-abr-load", action="store_true", help="Reload every ABR record instead of only new or changed ones")
+    parser.add_argument("--load-workers", type=int, default=1, help="Threads writing batches to the database, per pipeline")
+    parser.add_argument("--load-batch-size", type=int, default=BATCH_SIZE, help="Records per database write")
+    parser.add_argument("--parse-workers", type=int, default=1, help="Processes parsing WARC fragments (1 = parse in a thread)")
+    parser.add_argument("--cdx-concurrency", type=int, default=PAGE_CONCURRENCY, help="Max concurrent Common Crawl index page requests")
+    parser.add_argument("--fetch-concurrency", type=int, default=MAX_CONCURRENCY, help="Max concurrent WARC range requests")
+    parser.add_argument("--fetch-per-host", type=int, default=PER_HOST_CONCURRENCY, help="Max concurrent WARC range requests per host")
+    parser.add_argument("--range-gap", type=int, default=MAX_RANGE_GAP, help="Merge WARC fragments closer than this many bytes into one request")
+    parser.add_argument("--max-record-kb", type=int, default=MAX_RECORD_BYTES // 1024, help="Skip captures whose WARC record is larger (0 = no limit)")
+    parser.add_argument("--max-url-depth", type=int, default=MAX_URL_DEPTH, help="Skip captures more than this many path segments deep")
+    parser.add_argument("--crawl-languages", nargs="*", default=list(LANGUAGES), help="Keep captures in these CDX content languages (ISO 639-3; none given keeps any)")
+    parser.add_argument("--resume", action="store_true", help="Continue the last Common Crawl run: skip CDX pages it read and retry only fragments it did not finish")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read or write the local CDX/WARC cache")
+    parser.add_argument("--cache-max-mb", type=int, default=CACHE_MAX_BYTES // 2 ** 20, help="Size cap of the local CDX/WARC cache")
+    parser.add_argument("--dedup-store", choices=sorted(DEDUP_STORES), default="memory", help="Where crawled domains are tracked: a set, a Bloom filter, or an on-disk SQLite index kept across runs")
+    parser.add_argument("--no-dedup-seed", action="store_true", help="Don't skip domains that already have a page in the database")
+    parser.add_argument("--text-retention", choices=TEXT_RETENTION_MODES, default=TEXT_RETENTION, help="How much page text to keep in crawl_page_text")
+    parser.add_argument("--text-max-chars", type=int, default=TEXT_MAX_CHARS, help="Characters of page text kept with --text-retention truncated")
+    parser.add_argument("--ner-batch-size", type=int, default=NER_BATCH_SIZE, help="Pages per spaCy NER batch")
+    parser.add_argument("--ner-text-cap", type=int, default=NER_TEXT_CAP, help="Max characters of page text passed to NER")
+    parser.add_argument("--ner-processes", type=int, default=NER_N_PROCESS, help="Processes used by spaCy NER")
     parser.add_argument("--entity-matching", action="store_true", help="Perform entity matching after loading data")
+    parser.add_argument("--match-workers", type=int, default=1, help="Number of processes used for entity matching")
+    parser.add_argument("--match-engine", choices=MATCH_ENGINES, default="fuzzy", help="fuzzy: token-blocked token_set_ratio; tfidf: char-n-gram TF-IDF top-k candidates, re-scored with token_set_ratio")
+    parser.add_argument("--full-match", action="store_true", help="Re-match every record instead of only those changed since the last run")
 
     parser.add_argument("--run-dbt", action="store_true", help="Run dbt models")
     parser.add_argument("--test-dbt", action="store_true", help="Run dbt tests")
     parser.add_argument("--dbt-path", default="dbt", help="Path to dbt project directory")
     parser.add_argument("--dbt-target", default=None, help="dbt target profile (optional)")
+    parser.add_argument("--dbt-full-refresh", action="store_true", help="Rebuild the incremental dbt models from scratch")
 
-    args = parser.parse_args()
+    parser.add_argument("--coordinator", action="store_true", help="Plan --abr / --crawl / --entity-matching as units in the work_leases table for --worker processes instead of running them")
+    parser.add_argument("--coordinator-wait", action="store_true", help="Wait for the planned units to finish (and run dbt and plan matching once loads are done)")
+    parser.add_argument("--cdx-pages-per-unit", type=int, default=CDX_PAGES_PER_UNIT, help="CDX index pages per crawl unit")
+    parser.add_argument("--match-shards", type=int, default=MATCH_SHARDS, help="Crawl url ranges planned for distributed matching")
+    parser.add_argument("--worker", action="store_true", help="Claim and run units planned by a coordinator until none is left")
+    parser.add_argument("--worker-id", help="Name of this worker in the lease table (default host:pid)")
+    parser.add_argument("--lease-seconds", type=float, default=leases.LEASE_SECONDS, help="Lease length; a unit not renewed for this long is taken over by another worker")
+    parser.add_argument("--worker-kinds", nargs="+", choices=sorted(UNIT_HANDLERS), help="Only claim these kinds of unit")
 
-    run_all_parallel(
-        run_abr=args.abr,
-        run_crawl=args.crawl,
-        abr_limit=args.abr_limit,
-        crawl_pages=args.crawl_pages,
-        abr_records=args.abr_records
-    )
+    parser.add_argument("--metrics-out", help="Write run metrics here at the end: Prometheus text for a .prom path, JSON otherwise")
+    parser.add_argument("--metrics-interval", type=float, default=LOG_INTERVAL, help="Seconds between throughput log lines (0 = off)")
+    parser.add_argument("--profile", nargs="?", const=profiling.PROFILE_DIR, help="Profile every pipeline stage (cProfile and tracemalloc) and write per stage and thread .prof files and allocation reports to this directory")
+    parser.add_argument("--profile-sample", type=float, default=profiling.SAMPLE, help="Fraction of each stage's calls (WARC fragments, batches, ABR files) to profile")
+    parser.add_argument("--no-profile-memory", action="store_true", help="Profile CPU only, without tracemalloc")
+
+    args = parser.parse_args()
 
-    if args.run_dbt:
-        run_dbt_command("run", args.dbt_path, args.dbt_target)
+    throughput_log = ThroughputLog(interval=args.metrics_interval).start() if args.metrics_interval > 0 else None
+    if args.profile:
+        profiling.enable(args.profile, sample=args.profile_sample, memory=not args.no_profile_memory)
+    try:
+        def run_dbt():
+            if args.run_dbt:
+                run_dbt_command("run", args.dbt_path, args.dbt_target, full_refresh=args.dbt_full_refresh)
+            if args.test_dbt:
+                run_dbt_command("test", args.dbt_path, args.dbt_target)
 
-    if args.test_dbt:
-        run_dbt_command("test", args.dbt_path, args.dbt_target)
+        if args.worker:
+            run_worker(
+                worker_id=args.worker_id,
+                lease_seconds=args.lease_seconds,
+                kinds=args.worker_kinds,
+                fetch_concurrency=args.fetch_concurrency,
+                fetch_per_host=args.fetch_per_host,
+                range_gap=args.range_gap,
+                cdx_concurrency=args.cdx_concurrency,
+                ner_batch_size=args.ner_batch_size,
+                ner_text_cap=args.ner_text_cap,
+                ner_processes=args.ner_processes,
+                batch_size=args.load_batch_size,
+                use_cache=not args.no_cache,
+                cache_max_bytes=args.cache_max_mb * 2 ** 20,
+                text_retention=args.text_retention,
+                text_max_chars=args.text_max_chars,
+                download_segments=args.abr_download_segments,
+                full_abr_load=args.full_abr_load,
+                max_record_bytes=args.max_record_kb * 1024,
+                max_url_depth=args.max_url_depth,
+                languages=args.crawl_languages,
+            )
+        elif args.coordinator:
+            run_coordinator(
+                run_abr=args.abr,
+                run_crawl=args.crawl,
+                run_matching=args.entity_matching,
+                abr_limit=args.abr_limit,
+                crawl_pages=args.crawl_pages,
+                cdx_pages_per_unit=args.cdx_pages_per_unit,
+                match_shards=args.match_shards,
+                match_engine=args.match_engine,
+                resume=args.resume,
+                seed_dedup=not args.no_dedup_seed,
+                download_segments=args.abr_download_segments,
+                cdx_concurrency=args.cdx_concurrency,
+                wait=args.coordinator_wait,
+                after_load=run_dbt,
+            )
+        else:
+            run_all_parallel(
+                run_abr=args.abr,
+                run_crawl=args.crawl,
+                abr_limit=args.abr_limit,
+                crawl_pages=args.crawl_pages,
+                abr_records=args.abr_records,
+                abr_options={
+                    "stream": args.abr_stream,
+                    "workers": args.abr_workers,
+                    "download_segments": args.abr_download_segments,
+                    "full_load": args.full_abr_load,
+                    "batch_size": args.load_batch_size,
+                    "load_workers": args.load_workers,
+                },
+                crawl_options={
+                    "fetch_concurrency": args.fetch_concurrency,
+                    "fetch_per_host": args.fetch_per_host,
+                    "range_gap": args.range_gap,
+                    "cdx_concurrency": args.cdx_concurrency,
+                    "ner_batch_size": args.ner_batch_size,
+                    "ner_text_cap": args.ner_text_cap,
+                    "ner_processes": args.ner_processes,
+                    "parse_workers": args.parse_workers,
+                    "use_cache": not args.no_cache,
+                    "cache_max_bytes": args.cache_max_mb * 2 ** 20,
+                    "dedup_store": args.dedup_store,
+                    "seed_dedup": not args.no_dedup_seed,
+                    "text_retention": args.text_retention,
+                    "text_max_chars": args.text_max_chars,
+                    "resume": args.resume,
+                    "max_record_bytes": args.max_record_kb * 1024,
+                    "max_url_depth": args.max_url_depth,
+                    "languages": args.crawl_languages,
+                    "batch_size": args.load_batch_size,
+                    "load_workers": args.load_workers,
+                }
+            )
 
+            run_dbt()
 
-    if args.entity_matching:
-        print("\n🔍 Starting entity matching using vector similarity...")
-        perform_string_matching()
\ No newline at end of file
+            if args.entity_matching:
+                print(f"\n🔍 Starting entity matching with the {args.match_engine} engine...")
+                perform_string_matching(workers=args.match_workers, full=args.full_match, engine=args.match_engine)
+    finally:
+        if throughput_log:
+            throughput_log.stop()
+        if args.metrics_out:
+            REGISTRY.write(args.metrics_out)
+            print(f"📈 Metrics written to {args.metrics_out}")
+        if args.profile:
+            profiling.write()
+            profiling.disable()
@@ -0,0 +1,19 @@
+import os
+import tempfile
+
+import pytest
+
+# db.conn builds its engine at import time, so point it at a throwaway SQLite
+# database before any test module imports the pipeline code.
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
+# Likewise keep the crawl cache out of data/cache
+os.environ.setdefault("CRAWL_CACHE_DIR", f"{tempfile.mkdtemp()}/crawl_cache")
+
+from bench.fixtures import RangeServer, build_warc, serve  # noqa: E402
+
+
+@pytest.fixture
+def range_server():
+    """Starts a RangeServer; tests fill in `server.files`."""
+    with serve() as server:
+        yield server
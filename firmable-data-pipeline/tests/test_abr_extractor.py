@@ -1,3 +1,8 @@
+import io
+import multiprocessing as mp
+import os
+import zipfile
+
 import pytest
 from extract.abr_extractor import extract_abr_records
 
@@ -14,4 +19,92 @@ def test_extract_abr_records_limited_files():
         assert "abn" in rec
         assert "entity_name" in rec
         assert "state" in rec
-        assert rec["abn"] is not None
\ No newline at end of file
+        assert rec["abn"] is not None
+
+COMPANY = (
+    '<ABR recordLastUpdatedDate="20240101" replaced="N">'
+    '<ABN status="ACT" ABNStatusFromDate="20000101">{abn}</ABN>'
+    '<EntityType><EntityTypeInd>PRV</EntityTypeInd><EntityTypeText>Australian Private Company</EntityTypeText></EntityType>'
+    '<MainEntity><NonIndividualName type="MN"><NonIndividualNameText>ACME {abn} PTY LTD</NonIndividualNameText></NonIndividualName>'
+    '<BusinessAddress><AddressDetails><State>NSW</State><Postcode>2000</Postcode></AddressDetails></BusinessAddress></MainEntity>'
+    '<OtherEntity><NonIndividualName type="TRD"><NonIndividualNameText>ACME TRADING</NonIndividualNameText></NonIndividualName></OtherEntity>'
+    '</ABR>'
+)
+INDIVIDUAL = (
+    '<ABR recordLastUpdatedDate="20230505" replaced="N">'
+    '<ABN status="CAN" ABNStatusFromDate="20100202">{abn}</ABN>'
+    '<EntityType><EntityTypeInd>IND</EntityTypeInd><EntityTypeText>Individual/Sole Trader</EntityTypeText></EntityType>'
+    '<LegalEntity><IndividualName type="LGL"><NameTitle>MS</NameTitle><GivenName>JANE</GivenName><GivenName>ANN</GivenName>'
+    '<FamilyName>CITIZEN</FamilyName></IndividualName>'
+    '<BusinessAddress><AddressDetails><State>VIC</State><Postcode>3000</Postcode></AddressDetails></BusinessAddress></LegalEntity>'
+    '</ABR>'
+)
+
+
+def abr_xml(abns) -> bytes:
+    body = "".join((COMPANY if int(abn) % 2 else INDIVIDUAL).format(abn=abn) for abn in abns)
+    return f'<?xml version="1.0" encoding="UTF-8"?><Transfer><ABR_Extract>{body}</ABR_Extract></Transfer>'.encode()
+
+
+def test_parse_abr_stream_fields(monkeypatch):
+    from extract import abr_extractor
+
+    expected = [
+        {"abn": "11", "entity_name": "ACME 11 PTY LTD", "entity_type": "Australian Private Company",
+         "entity_status": "ACT", "start_date": "20000101", "address": None, "state": "NSW",
+         "postcode": "2000", "record_updated": "20240101"},
+        {"abn": "12", "entity_name": "JANE ANN CITIZEN", "entity_type": "Individual/Sole Trader",
+         "entity_status": "CAN", "start_date": "20100202", "address": None, "state": "VIC",
+         "postcode": "3000", "record_updated": "20230505"},
+    ]
+    assert list(abr_extractor.parse_abr_stream(io.BytesIO(abr_xml(["11", "12"])))) == expected
+
+    monkeypatch.setattr(abr_extractor, "LXML_ETREE", None)
+    assert list(abr_extractor.parse_abr_stream(io.BytesIO(abr_xml(["11", "12"])))) == expected
+
+
+def test_iter_abr_batches_streams_members_from_zip(tmp_path):
+    from extract.abr_extractor import iter_abr_batches, list_abr_members
+
+    zip_path = tmp_path / "abr.zip"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for part in range(3):
+            zf.writestr(f"public_split_{part}.xml", abr_xml([str(part * 100 + i) for i in range(1, 8)]))
+        zf.writestr("README.txt", "not xml")
+
+    assert len(list_abr_members(zip_path)) == 3
+    sequential = list(iter_abr_batches(zip_path, workers=1, batch_size=3))
+    parallel = list(iter_abr_batches(zip_path, workers=2, batch_size=3))
+
+    assert all(len(batch) <= 3 for batch in sequential + parallel)
+    abns = sorted(r["abn"] for batch in sequential for r in batch)
+    assert len(abns) == 21
+    assert sorted(r["abn"] for batch in parallel for r in batch) == abns
+
+
+def _write_abr_zip(zip_path, broken=False):
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for part in range(3):
+            zf.writestr(f"public_split_{part}.xml", abr_xml([str(part * 100 + i) for i in range(1, 8)]))
+        if broken:
+            zf.writestr("public_split_3.xml", abr_xml(["999"])[:-40])
+
+
+def test_parse_workers_report_a_broken_member(tmp_path):
+    from extract.abr_extractor import ABRParseError, iter_abr_batches
+
+    _write_abr_zip(tmp_path / "abr.zip", broken=True)
+    with pytest.raises(ABRParseError, match="public_split_3.xml"):
+        list(iter_abr_batches(tmp_path / "abr.zip", workers=2, batch_size=3))
+
+
+def test_a_parse_worker_that_dies_fails_the_load_instead_of_hanging(tmp_path, monkeypatch):
+    from extract import abr_extractor
+
+    _write_abr_zip(tmp_path / "abr.zip")
+    # Forked, so the workers run the patched target: it dies without putting its None
+    monkeypatch.setattr(abr_extractor, "process_context", lambda: mp.get_context("fork"))
+    monkeypatch.setattr(abr_extractor, "_parse_members_in_worker", lambda *args: os._exit(3))
+    monkeypatch.setattr(abr_extractor, "WORKER_POLL_SECONDS", 0.1)
+    with pytest.raises(abr_extractor.ABRParseError, match="exited with code 3"):
+        list(abr_extractor.iter_abr_batches(tmp_path / "abr.zip", workers=2, batch_size=3))
@@ -0,0 +1,68 @@
+import os
+
+from extract import common_crawl_extractor
+from extract.cache import DiskCache
+from extract.cdx_client import CdxClient, domain_query
+from extract.dedup import MemoryDedupStore
+from extract.warc_fetcher import WarcFetcher
+from tests.conftest import build_warc
+
+
+def test_disk_cache_round_trip_and_lru_eviction(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=2500)
+    cache.put("a", os.urandom(1000), compress=False)
+    cache.put("b", b"x" * 100_000)  # compresses to well under 1000 bytes
+    assert cache.get("b") == b"x" * 100_000
+    cache.get("a")  # now "b" is the least recently used
+    cache.put("c", os.urandom(1000), compress=False)
+    cache.put("d", os.urandom(1000), compress=False)
+
+    assert cache.get("b") is None and cache.get("c") is not None
+    assert cache.total_bytes <= 2500
+    cache.close()
+
+    # The index survives a restart, and files removed behind its back are misses
+    reopened = DiskCache(tmp_path, max_bytes=2500)
+    assert len(reopened) == 2 and reopened.get("d") is not None
+    next(tmp_path.glob("*/*")).unlink()
+    assert sum(reopened.get(key) is None for key in ("c", "d")) == 1
+
+
+def test_cdx_pages_are_served_from_cache(range_server, tmp_path):
+    range_server.cdx_pages = [[{"url": f"https://a{p}.com.au/", "filename": "f.warc.gz"}] for p in range(3)]
+    cache = DiskCache(tmp_path)
+
+    def fetch():
+        client = CdxClient(index_url=f"{range_server.base_url}cdx", cache=cache)
+        return sorted(r["url"] for _, records in client.iter_pages(domain_query("com.au")) for r in records)
+
+    first = fetch()
+    requests_made = len(range_server.requests)
+    assert fetch() == first and len(first) == 3
+    assert len(range_server.requests) == requests_made
+
+
+def test_warc_fragments_are_served_from_cache(range_server, tmp_path):
+    warc, entries = build_warc([(f"https://c{i}.com.au/", f"<title>C{i}</title>".encode()) for i in range(6)])
+    range_server.files["w.warc.gz"] = warc
+    for entry in entries:
+        entry["warc_path"] = "w.warc.gz"
+    cache = DiskCache(tmp_path)
+
+    def fetch(batch):
+        fragments = common_crawl_extractor.iter_warc_fragments(
+            batch, fetcher=WarcFetcher(backoff=0), warc_base=range_server.base_url, max_range_gap=0, cache=cache,
+            dedup=MemoryDedupStore()
+        )
+        return {entry["url"]: bytes(member) for entry, member in fragments}
+
+    first = fetch(entries[:4])
+    requests_made = len(range_server.requests)
+    second = fetch(entries)
+
+    assert {url: second[url] for url in first} == first
+    assert len(second) == 6
+    # Only the two new (adjacent, so coalesced) fragments went over the network
+    assert [r for _, _, r in range_server.requests[requests_made:]] == [
+        f"bytes={entries[4]['offset']}-{entries[5]['offset'] + entries[5]['length'] - 1}"
+    ]
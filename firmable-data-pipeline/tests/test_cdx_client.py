@@ -0,0 +1,122 @@
+import time
+
+import pytest
+
+from extract.cdx_client import AdaptiveRateLimiter, CdxClient, CdxFetchError, iter_warc_groups
+from extract.cdx_select import CdxSelector
+
+
+def _cdx_pages(pages, per_page):
+    return [
+        [
+            {
+                "url": f"https://p{page}r{i}.com.au/",
+                "timestamp": "20250315000000",
+                "digest": f"D{page}-{i}",
+                "mime": "text/html",
+                "status": "200",
+                "filename": f"crawl/warc-{page}.warc.gz",
+                "offset": str(i * 1000),
+                "length": "500",
+            }
+            for i in range(per_page)
+        ]
+        for page in range(pages)
+    ]
+
+
+def test_pages_are_fetched_concurrently_and_grouped_by_warc(range_server):
+    range_server.cdx_pages = _cdx_pages(pages=6, per_page=3)
+    range_server.latency = 0.2
+    client = CdxClient(
+        index_url=f"{range_server.base_url}cdx",
+        concurrency=6,
+        limiter=AdaptiveRateLimiter(rate=100, max_rate=100),
+    )
+
+    started = time.monotonic()
+    groups = list(iter_warc_groups(client, "com.au"))
+    elapsed = time.monotonic() - started
+    client.close()
+
+    assert sorted(path for path, _ in groups) == [f"crawl/warc-{p}.warc.gz" for p in range(6)]
+    assert all(len(entries) == 3 for _, entries in groups)
+    # showNumPages plus six pages at 0.2s each would take 1.4s serially
+    assert range_server.peak_active > 1
+    assert elapsed < 1.0
+
+
+
+def test_ordered_pages_wait_for_earlier_ones(range_server):
+    range_server.cdx_pages = _cdx_pages(pages=5, per_page=1)
+    range_server.slow_cdx_pages = {0: 0.3}
+    range_server.failing_cdx_pages = {2}
+    client = CdxClient(index_url=f"{range_server.base_url}cdx", max_retries=1, backoff=0,
+                       limiter=AdaptiveRateLimiter(rate=100, max_rate=100))
+    failed = []
+
+    pages = [page for page, _ in client.iter_pages({"url": "*.com.au/*"}, ordered=True, failed=failed)]
+    client.close()
+
+    # Pages 1 to 4 complete while page 0 is still on its way
+    assert pages == [0, 1, 3, 4] and failed == [2]
+
+def test_throttling_slows_the_limiter_down(range_server):
+    range_server.cdx_pages = _cdx_pages(pages=1, per_page=2)
+    range_server.fail_next = 2
+    limiter = AdaptiveRateLimiter(rate=50, max_rate=50, increase=0)
+    client = CdxClient(index_url=f"{range_server.base_url}cdx", limiter=limiter, backoff=0)
+
+    assert client.num_pages({"url": "*.com.au/*"}) == 1
+    assert limiter.rate == 50 * 0.5 * 0.5
+    client.close()
+
+
+def test_failed_requests_raise_instead_of_returning_no_records(range_server):
+    range_server.cdx_pages = _cdx_pages(pages=1, per_page=2)
+    client = CdxClient(index_url=f"{range_server.base_url}cdx", max_retries=2, backoff=0,
+                       limiter=AdaptiveRateLimiter(rate=100, max_rate=100))
+
+    range_server.fail_next = 2
+    with pytest.raises(CdxFetchError, match="after 2 attempts"):
+        client.fetch_page({"url": "*.com.au/*"}, 0)
+    # Errors other than throttling are not retried
+    with pytest.raises(CdxFetchError, match="status 400"):
+        client.fetch_page({"url": "*.com.au/*"}, 5)
+    assert len(client.fetch_page({"url": "*.com.au/*"}, 0)) == 2
+    client.close()
+
+
+def test_captures_are_filtered_and_the_best_per_domain_kept_before_fetching(range_server):
+    def entry(url, mime="text/html", length="500", languages="eng"):
+        return {"url": url, "mime": mime, "length": length, "languages": languages, "status": "200",
+                "timestamp": "20250315000000", "digest": url, "filename": "crawl/warc-0.warc.gz", "offset": "0"}
+
+    range_server.cdx_pages = [[
+        entry("https://a.com.au/about/team"),
+        entry("https://a.com.au/"),
+        entry("https://a.com.au/?page=2"),
+        entry("https://b.com.au/report.pdf", mime="application/pdf", length="900000"),
+        entry("https://c.com.au/", length="900000"),
+        entry("https://d.com.au/", languages="deu,fra"),
+        entry("https://e.com.au/a/b/c/d"),
+        entry("https://f.com.au/", languages="eng,fra"),
+    ], [
+        # f.com.au's captures run on into the next page, which arrives first;
+        # pages are still selected in page order, so its root page is kept
+        entry("https://f.com.au/contact"),
+        entry("https://g.com.au/"),
+    ]]
+    range_server.slow_cdx_pages = {0: 0.3}
+    client = CdxClient(index_url=f"{range_server.base_url}cdx", limiter=AdaptiveRateLimiter(rate=100, max_rate=100))
+    selector = CdxSelector()
+
+    groups = list(iter_warc_groups(client, "com.au", selector=selector))
+    client.close()
+
+    assert [e["url"] for _, entries in groups for e in entries] == [
+        "https://a.com.au/", "https://f.com.au/", "https://g.com.au/"]
+    assert selector.counts == {"selected": 3, "mime": 1, "length": 1, "language": 1, "depth": 1, "duplicate": 3}
+    assert selector.bytes_avoided == 900000 * 2 + 500 * 5
+    # Only the fields the pipeline reads are asked of the index
+    assert all("fl=url%2Ctimestamp" in path for _, path, _ in range_server.requests if "output=json" in path)
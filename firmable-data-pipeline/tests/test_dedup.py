@@ -0,0 +1,134 @@
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from db.base import Base
+from db.conn import SessionLocal, engine
+from db.models import CrawlRecord
+from extract import common_crawl_extractor
+from extract.dedup import BloomDedupStore, MemoryDedupStore, SQLiteDedupStore, seed_from_database
+from extract.warc_fetcher import WarcFetcher
+from load.loader import load_crawl_records
+from sqlalchemy import delete
+from tests.conftest import build_warc
+
+
+def _claim_all(path, domains, results):
+    store = SQLiteDedupStore(path)
+    results.put([d for d in domains if store.claim(d)])
+
+
+@pytest.mark.parametrize("make_store", [MemoryDedupStore, lambda: BloomDedupStore(capacity=10_000),
+                                        lambda: SQLiteDedupStore("dedup.sqlite")])
+def test_each_domain_is_claimed_once_across_threads(make_store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = make_store()
+    domains = [f"d{i % 200}.com.au" for i in range(2000)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        claimed = [d for d, won in zip(domains, pool.map(store.claim, domains)) if won]
+
+    assert sorted(claimed) == sorted(set(domains))
+    assert "d7.com.au" in store and "other.com.au" not in store
+
+
+def test_sqlite_store_is_shared_across_processes_and_runs(tmp_path):
+    path = tmp_path / "domains.sqlite"
+    domains = [f"d{i}.com.au" for i in range(300)]
+    context = mp.get_context("fork")
+    results = context.Queue()
+    workers = [context.Process(target=_claim_all, args=(path, domains, results)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    claimed = [d for _ in workers for d in results.get(timeout=30)]
+    for worker in workers:
+        worker.join()
+
+    assert sorted(claimed) == sorted(domains)
+    reopened = SQLiteDedupStore(path)
+    assert len(reopened) == 300 and not reopened.claim("d5.com.au")
+    reopened.release("d5.com.au")
+    assert reopened.claim("d5.com.au")
+
+
+def test_covered_domains_are_skipped_before_any_request(range_server):
+    Base.metadata.create_all(engine)
+    with SessionLocal() as session:
+        session.execute(delete(CrawlRecord))
+        session.commit()
+    load_crawl_records([{"url": "https://c1.com.au/old", "title": "C1", "timestamp": "20240101000000",
+                         "company_name": "C1", "digest": "x"}])
+
+    warc, entries = build_warc([(f"https://c{i}.com.au/", f"<title>C{i}</title>".encode()) for i in range(4)])
+    range_server.files["w.warc.gz"] = warc
+    for entry in entries:
+        entry["warc_path"] = "w.warc.gz"
+
+    store = MemoryDedupStore()
+    with SessionLocal() as session:
+        assert seed_from_database(store, session) == 1
+    # c1 already has a stored page, so only c0 is requested
+    fragments = common_crawl_extractor.iter_warc_fragments(
+        entries[:2], fetcher=WarcFetcher(backoff=0), warc_base=range_server.base_url, max_range_gap=0, dedup=store
+    )
+    assert [entry["url"] for entry, _ in fragments] == ["https://c0.com.au/"]
+    assert [r for _, _, r in range_server.requests] == [
+        f"bytes={entries[0]['offset']}-{entries[0]['offset'] + entries[0]['length'] - 1}"
+    ]
+
+
+def test_crawl_starts_persistent_claims_over_and_releases_pages_it_could_not_use(range_server, monkeypatch, tmp_path):
+    import run
+    from extract.cdx_client import CdxClient
+
+    pages = [("https://stale.com.au/", b"<title>Stale</title>"), ("https://garbled.com.au/", b"<title>Garbled</title>"),
+             ("https://broken.com.au/", b"<title>Broken</title>")]
+    warc, entries = build_warc(pages)
+    range_server.files["w.warc.gz"] = warc
+    range_server.cdx_pages = [[{"url": e["url"], "digest": f"dedup-{e['digest']}", "offset": str(e["offset"]),
+                                "length": str(e["length"]) if "garbled" not in e["url"] else "10", "filename": "w.warc.gz",
+                                "timestamp": e["timestamp"]} for e in entries]]
+    monkeypatch.setattr(run, "CdxClient", lambda **kw: CdxClient(index_url=f"{range_server.base_url}cdx", **kw))
+    monkeypatch.setattr(run, "iter_warc_fragments", lambda entries, **kw: common_crawl_extractor.iter_warc_fragments(
+        entries, warc_base=range_server.base_url, **kw))
+    monkeypatch.setitem(run.DEDUP_STORES, "sqlite", lambda: SQLiteDedupStore(tmp_path / "d.sqlite"))
+    load = run.load_crawl_records
+
+    def failing_load(batch):
+        if any("broken" in r["url"] for r in batch):
+            raise RuntimeError("boom")
+        load(batch)
+
+    monkeypatch.setattr(run, "load_crawl_records", failing_load)
+    Base.metadata.create_all(engine)
+    with SessionLocal() as session:
+        session.execute(delete(CrawlRecord))
+        session.commit()
+    # garbled's record is cut short, so it can't be parsed. stale's claim was
+    # left behind by an earlier run that crashed before loading it
+    SQLiteDedupStore(tmp_path / "d.sqlite").claim("stale.com.au")
+
+    run.run_common_crawl_pipeline(crawl_pages=None, use_cache=False, dedup_store="sqlite", seed_dedup=False,
+                                  journal_path=tmp_path / "j.sqlite", batch_size=1)
+
+    with SessionLocal() as session:
+        assert [r.url for r in session.query(CrawlRecord)] == ["https://stale.com.au/"]
+    store = SQLiteDedupStore(tmp_path / "d.sqlite")
+    assert "stale.com.au" in store and "garbled.com.au" not in store and "broken.com.au" not in store
+
+
+def test_pages_deferred_to_ner_keep_their_domain_claimed(range_server):
+    warc, entries = build_warc([("https://nameless.com.au/", b"<p>We fix roofs across Sydney</p>"),
+                                ("https://named.com.au/", b"<title>Named Roofing</title>")])
+    range_server.files["w.warc.gz"] = warc
+    for entry in entries:
+        entry["warc_path"] = "w.warc.gz"
+    store = MemoryDedupStore()
+
+    records = common_crawl_extractor.iter_company_data(
+        entries, fetcher=WarcFetcher(backoff=0), warc_base=range_server.base_url, max_range_gap=0,
+        text_retention="compressed", dedup=store)
+    # The nameless page waits in the NER stage while the named one is yielded
+    assert next(records)["url"] == "https://named.com.au/"
+    assert "nameless.com.au" in store and "named.com.au" in store
+    records.close()
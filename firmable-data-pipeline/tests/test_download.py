@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from extract.download import download_file, plan_segments
+
+PAYLOAD = os.urandom(256 * 1024 + 17)
+
+
+def test_download_resumes_after_dropped_connections(range_server, tmp_path):
+    range_server.files["abr.zip"] = PAYLOAD
+    range_server.drop_next = 2
+    dest = tmp_path / "abr.zip"
+
+    download_file(f"{range_server.base_url}abr.zip", dest, chunk_size=4096, backoff=0)
+
+    assert dest.read_bytes() == PAYLOAD
+    assert not (tmp_path / "abr.zip.part").exists()
+    assert not (tmp_path / "abr.zip.part.json").exists()
+    ranges = [r for _, _, r in range_server.requests]
+    # Each retry picks up where the dropped response stopped instead of byte 0
+    assert len(ranges) == 3 and ranges[0] == f"bytes=0-{len(PAYLOAD) - 1}" and ranges[1] != ranges[0]
+
+
+def test_download_resumes_part_file_from_an_earlier_run(range_server, tmp_path):
+    range_server.files["abr.zip"] = PAYLOAD
+    range_server.drop_next = 1
+    dest = tmp_path / "abr.zip"
+    url = f"{range_server.base_url}abr.zip"
+
+    with pytest.raises(Exception):
+        download_file(url, dest, chunk_size=4096, max_retries=0, backoff=0)
+    assert not dest.exists()
+    resumed_at = (tmp_path / "abr.zip.part").stat().st_size
+    assert 0 < resumed_at < len(PAYLOAD)
+
+    download_file(url, dest, backoff=0)
+    assert dest.read_bytes() == PAYLOAD
+    assert range_server.requests[-1][2] == f"bytes={resumed_at}-{len(PAYLOAD) - 1}"
+
+
+def test_download_restarts_when_remote_file_changed(range_server, tmp_path):
+    range_server.files["abr.zip"] = PAYLOAD
+    range_server.drop_next = 1
+    dest = tmp_path / "abr.zip"
+    url = f"{range_server.base_url}abr.zip"
+    with pytest.raises(Exception):
+        download_file(url, dest, chunk_size=4096, max_retries=0, backoff=0)
+
+    # Same size, new content: the saved ETag no longer matches, so nothing is reused
+    changed = bytes(reversed(PAYLOAD))
+    range_server.files["abr.zip"] = changed
+    download_file(url, dest, backoff=0)
+    assert dest.read_bytes() == changed
+
+
+def test_segmented_download_resumes_each_segment(range_server, tmp_path):
+    range_server.files["abr.zip"] = PAYLOAD
+    range_server.drop_next = 3
+    dest = tmp_path / "abr.zip"
+
+    download_file(f"{range_server.base_url}abr.zip", dest, segments=4, chunk_size=4096, backoff=0)
+
+    assert dest.read_bytes() == PAYLOAD
+    assert len({r for _, _, r in range_server.requests}) >= 4
+
+
+def test_plan_segments_covers_file():
+    segments = plan_segments(10, 3)
+    assert segments == [[0, 3, 0], [4, 7, 0], [8, 9, 0]]
+    assert plan_segments(2, 8) == [[0, 0, 0], [1, 1, 0]]
@@ -0,0 +1,38 @@
+import json
+from pathlib import Path
+
+from extract.html_extract import decode_html, extract_from_head
+
+FIXTURES = Path(__file__).parent / "fixtures" / "html"
+# Answers of the previous full-document extractor on the fixture corpus
+EXPECTED = json.loads((FIXTURES / "expected.json").read_text())
+
+
+def test_head_first_path_agrees_with_full_document_extractor():
+    resolved_pages = set()
+    for page, expected in EXPECTED.items():
+        company_name, title, resolved = extract_from_head(decode_html((FIXTURES / page).read_bytes()))
+        if resolved:
+            resolved_pages.add(page)
+            assert {"company_name": company_name, "title": title} == expected, page
+
+    # The common case (meta tags or <title> in the head) never needs the full document
+    assert {
+        "og_site_name.html", "name_og_site_name.html", "description.html", "og_title.html",
+        "title_dash.html", "title_en_dash.html", "latin1.html", "upper_case.html",
+    } <= resolved_pages
+
+
+def test_head_first_path_defers_when_body_may_win():
+    for page in ("meta_in_body.html", "og_title_head_site_name_body.html", "svg_title_body.html", "h1_only.html"):
+        assert extract_from_head(decode_html((FIXTURES / page).read_bytes()))[2] is False, page
+
+
+def test_extract_company_fields_matches_full_document_extractor():
+    from extract.common_crawl_extractor import extract_company_fields
+
+    for page, expected in EXPECTED.items():
+        payload = (FIXTURES / page).read_bytes()
+        for keep_text in (True, False):
+            company_name, title, _ = extract_company_fields(payload, keep_text)
+            assert {"company_name": company_name, "title": title} == expected, (page, keep_text)
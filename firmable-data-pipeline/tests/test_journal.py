@@ -0,0 +1,92 @@
+from itertools import chain
+
+from extract.cdx_client import CdxClient, iter_warc_groups, journal_query
+from extract.common_crawl_extractor import iter_warc_fragments
+from extract.dedup import MemoryDedupStore
+from extract.warc_fetcher import WarcFetcher
+from pipeline.journal import FAILED, FETCHED, LOADED, NO_RECORD, PARSED, CrawlJournal
+from tests.conftest import build_warc
+
+
+def _entry(offset, warc_path="w.warc.gz"):
+    return {"warc_path": warc_path, "offset": offset, "length": 10, "url": f"https://s{offset}.com.au/",
+            "digest": f"D{offset}", "timestamp": "20250315000000"}
+
+
+def test_journal_keeps_unfinished_fragments_across_reopen(tmp_path):
+    journal = CrawlJournal(tmp_path / "j.sqlite", flush_size=100)
+    journal.record_page("q", 0, [_entry(30), _entry(0), _entry(10), _entry(20)])
+    journal.mark([("w.warc.gz", 0)], FETCHED)
+    journal.mark([("w.warc.gz", 0)], PARSED)
+    journal.mark([("w.warc.gz", 0)], LOADED)
+    journal.mark([("w.warc.gz", 10)], NO_RECORD)
+    journal.mark([("w.warc.gz", 20)], FAILED, "timed out")
+    # Buffered marks are written on close
+    journal.close()
+
+    reopened = CrawlJournal(tmp_path / "j.sqlite")
+    assert reopened.done_pages("q") == {0} and reopened.done_pages("other") == set()
+    assert [e["offset"] for e in reopened.unfinished("q")] == [20, 30]
+    assert reopened.counts("q") == {LOADED: 1, NO_RECORD: 1, FAILED: 1, "pending": 1}
+
+    reopened.reset()
+    assert reopened.done_pages("q") == set() and reopened.unfinished("q") == []
+
+
+def test_resume_skips_read_pages_and_refetches_only_unfinished_fragments(range_server, tmp_path):
+    warc, entries = build_warc([(f"https://r{i}.com.au/", f"<title>R{i}</title>".encode()) for i in range(6)])
+    range_server.files["w.warc.gz"] = warc
+    range_server.cdx_pages = [
+        [{"url": e["url"], "digest": e["digest"], "offset": str(e["offset"]), "length": str(e["length"]),
+          "filename": "w.warc.gz", "timestamp": e["timestamp"]} for e in entries[i:i + 3]]
+        for i in (0, 3)
+    ]
+    client = CdxClient(index_url=f"{range_server.base_url}cdx")
+    query = journal_query(client, "com.au")
+
+    def fetch(journal, retry=()):
+        groups = iter_warc_groups(client, "com.au", journal=journal)
+        fragments = iter_warc_fragments(
+            chain(retry, (e for _, file_entries in groups for e in file_entries)), fetcher=WarcFetcher(backoff=0),
+            warc_base=range_server.base_url, max_range_gap=0, dedup=MemoryDedupStore(), journal=journal
+        )
+        return [entry["url"] for entry, _ in fragments]
+
+    # The first run loads two fragments, then dies
+    journal = CrawlJournal(tmp_path / "j.sqlite", flush_size=1)
+    first = fetch(journal)
+    assert len(first) == 6 and journal.done_pages(query) == {0, 1}
+    journal.mark([("w.warc.gz", e["offset"]) for e in entries[:2]], LOADED)
+    journal.close()
+
+    journal = CrawlJournal(tmp_path / "j.sqlite")
+    retry = journal.unfinished(query)
+    requests_made = len(range_server.requests)
+    resumed = fetch(journal, retry)
+
+    assert sorted(resumed) == sorted(e["url"] for e in entries[2:])
+    # Only the page count is asked for again, no CDX page
+    assert not [path for _, path, _ in range_server.requests[requests_made:] if "&page=" in path]
+    assert journal.counts(query) == {LOADED: 2, FETCHED: 4}
+
+
+def test_failed_cdx_pages_are_not_journalled_and_are_retried_on_resume(range_server, tmp_path):
+    range_server.cdx_pages = [[{"url": f"https://f{p}.com.au/", "digest": f"F{p}", "offset": "0", "length": "10",
+                                "filename": f"f{p}.warc.gz", "timestamp": "20250315000000"}] for p in range(3)]
+    range_server.failing_cdx_pages = {1}
+    client = CdxClient(index_url=f"{range_server.base_url}cdx", max_retries=2, backoff=0)
+    query = journal_query(client, "com.au")
+    journal = CrawlJournal(tmp_path / "j.sqlite", flush_size=1)
+
+    failed = []
+    first = [path for path, _ in iter_warc_groups(client, "com.au", journal=journal, failed=failed)]
+    assert sorted(first) == ["f0.warc.gz", "f2.warc.gz"] and failed == [1]
+    assert journal.done_pages(query) == {0, 2}
+
+    range_server.failing_cdx_pages = set()
+    failed = []
+    resumed = [path for path, _ in iter_warc_groups(client, "com.au", journal=journal, failed=failed)]
+    assert resumed == ["f1.warc.gz"] and failed == []
+    assert journal.done_pages(query) == {0, 1, 2}
+    journal.close()
+    client.close()
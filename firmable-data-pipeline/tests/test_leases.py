@@ -0,0 +1,171 @@
+import json
+import multiprocessing as mp
+import os
+import time
+
+from sqlalchemy import text
+
+import run
+from db.base import Base
+from db.conn import SessionLocal, engine
+from db.models import MatchFingerprint
+from extract import common_crawl_extractor
+from extract.cdx_client import CdxClient
+from extract.dedup import DatabaseDedupStore
+from matcher.em import perform_string_matching
+from pipeline import leases
+from tests.conftest import build_warc
+from tests.test_matcher import _seed_preprocess_tables, _stored_matches
+
+
+def _fresh(kinds):
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    leases.clear(session, kinds)
+    return session
+
+
+def test_claims_are_exclusive_and_expired_leases_are_taken_over():
+    session = _fresh(["t"])
+    assert leases.enqueue(session, [("t:1", "t", {"n": 1}), ("t:2", "t", {"n": 2})]) == 2
+    # Planning again keeps existing units as they are
+    assert leases.enqueue(session, [("t:1", "t", {"n": 1})]) == 0
+
+    first = leases.claim(session, "a", ["t"], ttl=0.2)
+    second = leases.claim(session, "b", ["t"], ttl=60)
+    assert {first["key"], second["key"]} == {"t:1", "t:2"} and first["payload"]["n"] in (1, 2)
+    assert leases.claim(session, "c", ["t"]) is None
+
+    # a stops renewing its lease, so c takes the unit over and a can no longer finish it
+    time.sleep(0.3)
+    taken = leases.claim(session, "c", ["t"], ttl=60)
+    assert taken["key"] == first["key"] and taken["attempts"] == 2
+    assert not leases.heartbeat(session, first["key"], "a") and not leases.complete(session, first["key"], "a")
+    assert leases.complete(session, first["key"], "c")
+
+    # Failures are retried until MAX_ATTEMPTS, then given up
+    key = second["key"]
+    for attempt in range(1, leases.MAX_ATTEMPTS):
+        assert leases.fail(session, key, "b", "boom") == leases.PENDING
+        assert leases.claim(session, "b", ["t"])["attempts"] == attempt + 1
+    assert leases.fail(session, key, "b", "boom") == leases.FAILED
+    assert leases.counts(session, ["t"]) == {leases.DONE: 1, leases.FAILED: 1}
+    session.close()
+
+
+def _record_unit(path, unit):
+    # The first worker to get unit w:3 dies holding its lease
+    if unit["key"] == "w:3" and unit["attempts"] == 1:
+        os._exit(1)
+    with open(path, "a") as out:
+        out.write(f"{unit['key']}\n")
+
+
+def _run_worker(path):
+    engine.dispose(close=False)
+    leases.work({"w": lambda unit: _record_unit(path, unit)}, ttl=0.5, poll_seconds=0.05)
+
+
+def test_local_workers_share_units_and_take_over_from_a_dead_worker(tmp_path):
+    session = _fresh(["w"])
+    leases.enqueue(session, [(f"w:{i}", "w", {}) for i in range(20)])
+    session.close()
+
+    path = tmp_path / "done.txt"
+    context = mp.get_context("fork")
+    workers = [context.Process(target=_run_worker, args=(path,)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+
+    assert sorted(path.read_text().split()) == sorted(f"w:{i}" for i in range(20))
+    assert sorted(w.exitcode for w in workers) == [0, 0, 1]
+    with SessionLocal() as session:
+        assert leases.counts(session, ["w"]) == {leases.DONE: 20}
+
+
+def test_database_dedup_store_gives_a_retried_unit_its_own_domains_back():
+    Base.metadata.create_all(engine)
+    store = DatabaseDedupStore()
+    store.clear()
+    store.seed(["stored.com.au"])
+    first, other = DatabaseDedupStore(owner="warc:1"), DatabaseDedupStore(owner="warc:2")
+
+    assert first.claim("a.com.au") and not other.claim("a.com.au") and not first.claim("stored.com.au")
+    # A retry of warc:1 claims its domain again
+    assert DatabaseDedupStore(owner="warc:1").claim("a.com.au")
+    other.release("a.com.au")
+    assert "a.com.au" in store
+    first.release("a.com.au")
+    assert "a.com.au" not in store and other.claim("a.com.au") and len(store) == 2
+
+
+def test_workers_load_each_domain_once_across_warc_files(range_server, monkeypatch):
+    # Domains repeat across the two WARC files
+    pages = [(f"https://dist{i % 12}.com.au/p{i}", f"<title>Home - Dist {i}</title>".encode()) for i in range(20)]
+    rows = []
+    for name, file_pages in (("a.warc.gz", pages[:10]), ("b.warc.gz", pages[10:])):
+        warc, entries = build_warc(file_pages)
+        range_server.files[name] = warc
+        rows += [{"url": e["url"], "digest": f"{name}{e['digest']}", "offset": str(e["offset"]),
+                  "length": str(e["length"]), "filename": name, "timestamp": e["timestamp"]} for e in entries]
+    range_server.cdx_pages = [rows[i:i + 4] for i in range(0, len(rows), 4)]
+    monkeypatch.setattr(run, "CdxClient", lambda **kw: CdxClient(index_url=f"{range_server.base_url}cdx", **kw))
+    monkeypatch.setattr(run, "iter_warc_fragments", lambda entries, **kw: common_crawl_extractor.iter_warc_fragments(
+        entries, warc_base=range_server.base_url, **kw))
+
+    run.run_coordinator(run_abr=False, run_crawl=True, crawl_pages=None, cdx_pages_per_unit=2, seed_dedup=False)
+    context = mp.get_context("fork")
+    workers = [context.Process(target=run.run_worker, kwargs={"use_cache": False, "batch_size": 3})
+               for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=120)
+
+    with SessionLocal() as session:
+        urls = session.execute(text("SELECT url FROM crawl_records_extracted WHERE url LIKE 'https://dist%'")).scalars()
+        domains = [url.split("/")[2] for url in urls]
+        assert sorted(domains) == sorted(f"dist{i}.com.au" for i in range(12))
+        # 3 cdx_pages units, expanded into one warc_file unit per (CDX page, WARC file)
+        assert leases.counts(session, ["cdx_pages", "warc_file"]) == {leases.DONE: 3 + 6}
+
+
+def test_match_shards_agree_with_a_full_rematch():
+    session = _fresh(["match_shard"])
+    _seed_preprocess_tables(session)
+    perform_string_matching(full=True)
+    expected, fingerprints = _stored_matches(session), session.query(MatchFingerprint).count()
+
+    run.run_coordinator(run_abr=False, run_crawl=False, run_matching=True, match_shards=3)
+    assert _stored_matches(session) == []
+    run.run_worker(kinds=["match_shard"], use_cache=False)
+    # A shard scored again (as when its first worker died after writing) replaces its own rows
+    payload = session.execute(text("SELECT payload FROM work_leases WHERE key = 'match:1'")).scalar_one()
+    leases.enqueue(session, [("match:1:again", "match_shard", json.loads(payload))])
+    run.run_worker(kinds=["match_shard"], use_cache=False)
+
+    assert _stored_matches(session) == expected
+    assert session.query(MatchFingerprint).count() == fingerprints
+    assert leases.counts(session, ["match_shard"]) == {leases.DONE: 4}
+    session.close()
+
+
+def test_a_cdx_pages_unit_with_a_failed_page_is_retried(range_server, monkeypatch):
+    _fresh(["cdx_pages", "warc_file"]).close()
+    range_server.cdx_pages = [[{"url": f"https://retry{p}.com.au/", "digest": f"R{p}", "offset": "0",
+                                "length": "10", "filename": f"r{p}.warc.gz", "timestamp": "20250315000000"}]
+                              for p in range(2)]
+    range_server.failing_cdx_pages = {1}
+    monkeypatch.setattr(run, "CdxClient", lambda **kw: CdxClient(
+        index_url=f"{range_server.base_url}cdx", max_retries=1, backoff=0, **kw))
+
+    run.run_coordinator(run_abr=False, run_crawl=True, crawl_pages=None, cdx_pages_per_unit=2, seed_dedup=False)
+    run.run_worker(kinds=["cdx_pages"], use_cache=False)
+    with SessionLocal() as session:
+        # The page that was read is planned; the unit itself is given up after its attempts, not marked done
+        assert leases.counts(session, ["cdx_pages"]) == {leases.FAILED: 1}
+        assert leases.counts(session, ["warc_file"]) == {leases.PENDING: 1}
+        error = session.execute(text("SELECT error FROM work_leases WHERE kind = 'cdx_pages'")).scalar_one()
+        assert "CdxFetchError" in error and "[1]" in error
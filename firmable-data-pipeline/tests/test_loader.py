@@ -0,0 +1,173 @@
+import threading
+import time
+from datetime import date
+
+import pytest
+from sqlalchemy import delete, select, text
+
+from db.base import Base
+from db.conn import SessionLocal, engine
+from db.models import ABRFingerprint, ABRRecord, CrawlPageText, CrawlRecord
+from db.writer import WRITE_RETRIES, WRITE_TRANSACTIONS, DatabaseWriter, get_writer
+from db.page_text import pack_text
+from load.fingerprints import ABRChangeFilter
+from pipeline import metrics
+from load.loader import copy_buffer, load_abr_records, load_crawl_records
+
+
+def _abr(abn, name, updated="20240101"):
+    return {"abn": abn, "entity_name": name, "entity_type": "Australian Private Company", "entity_status": "ACT",
+            "start_date": "20000102", "address": None, "state": "NSW", "postcode": "2000", "record_updated": updated}
+
+
+def _crawl(url, title, timestamp, digest):
+    return {"url": url, "title": title, "page_text": pack_text(f"{title} text", "compressed"), "text_chars": len(title) + 5,
+            "timestamp": timestamp, "company_name": title, "digest": digest}
+
+
+def _reset(model):
+    Base.metadata.create_all(engine)
+    with SessionLocal() as session:
+        session.execute(delete(model))
+        session.commit()
+
+
+def test_load_abr_records_upserts_in_bulk():
+    _reset(ABRRecord)
+    load_abr_records([_abr("1", "Acme"), _abr("2", "Blue Sky"), _abr(None, "No ABN")])
+    load_abr_records([_abr("2", "Blue Sky Cafe", "20240201"), _abr("3", "Harbour"), _abr("3", "Harbour Dental")])
+
+    with SessionLocal() as session:
+        rows = session.execute(select(ABRRecord.abn, ABRRecord.entity_name, ABRRecord.start_date)
+                               .order_by(ABRRecord.abn)).all()
+    # Updated in place, and the later record wins within a batch, as with merge()
+    assert rows == [("1", "Acme", date(2000, 1, 2)), ("2", "Blue Sky Cafe", date(2000, 1, 2)),
+                    ("3", "Harbour Dental", date(2000, 1, 2))]
+
+
+def test_load_crawl_records_only_applies_newer_captures():
+    _reset(CrawlPageText)
+    _reset(CrawlRecord)
+    load_crawl_records([_crawl("https://a.com.au/", "Old", "20250101000000", "D1")])
+    load_crawl_records([
+        _crawl("https://a.com.au/", "Older", "20240101000000", "D1"),
+        _crawl("https://b.com.au/", "B", "20250101000000", "D2"),
+        _crawl("https://b.com.au/", "B newer", "20250301000000", "D2"),
+    ])
+    load_crawl_records([_crawl("https://a.com.au/", "New", "20250201000000", "D1")])
+
+    with SessionLocal() as session:
+        rows = session.execute(select(CrawlRecord.url, CrawlRecord.title).order_by(CrawlRecord.url)).all()
+    assert rows == [("https://a.com.au/", "New"), ("https://b.com.au/", "B newer")]
+
+    # Page text sits in its own table, read only on access
+    with SessionLocal() as session:
+        assert session.get(CrawlRecord, "https://b.com.au/").text == "B newer text"
+        assert session.get(CrawlPageText, "https://a.com.au/").chars == len("New text")
+
+
+def test_sqlite_connections_run_in_wal_mode():
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        # NORMAL
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+
+
+def test_writer_commits_queued_jobs_together_and_isolates_a_failing_one():
+    _reset(ABRRecord)
+    writer = DatabaseWriter()
+    started, release = threading.Event(), threading.Event()
+
+    def blocker(session):
+        started.set()
+        release.wait()
+
+    def insert(abn):
+        return lambda session: session.add(ABRRecord(abn=abn, entity_name=f"Company {abn}"))
+
+    def broken(session):
+        raise ValueError("bad batch")
+
+    # Jobs queued while the writer is busy are committed in one transaction
+    first = writer.submit(blocker)
+    started.wait()
+    transactions = WRITE_TRANSACTIONS.value
+    queued = [writer.submit(insert(str(i))) for i in range(5)] + [writer.submit(broken)]
+    release.set()
+    first.result()
+    for future in queued[:5]:
+        future.result()
+    with pytest.raises(ValueError):
+        queued[5].result()
+    writer.close()
+
+    with SessionLocal() as session:
+        assert session.scalars(select(ABRRecord.abn).order_by(ABRRecord.abn)).all() == ["0", "1", "2", "3", "4"]
+    # The blocker's, then (after the group of six failed) one per job that succeeds on its own
+    assert WRITE_TRANSACTIONS.value - transactions == 1 + 5
+
+
+def test_copy_buffer_distinguishes_null_from_empty():
+    buffer = copy_buffer([{"a": None, "b": "", "c": 'say "hi",\x00 ok'}], ["a", "b", "c"])
+    assert buffer.read() == '\\N,,"say ""hi"", ok"\n'
+
+
+def _load_with_filter(records):
+    with SessionLocal() as session:
+        change_filter = ABRChangeFilter.load(session)
+    changed, fingerprints = change_filter.split(records)
+    if changed:
+        load_abr_records(changed, fingerprints)
+    return [r["abn"] for r in changed], change_filter.counts
+
+
+def test_change_filter_skips_unchanged_abr_records():
+    _reset(ABRRecord)
+    _reset(ABRFingerprint)
+    first = [_abr("1", "Acme"), _abr("2", "Blue Sky"), _abr("X3", "Non-numeric")]
+    assert _load_with_filter(first) == (["1", "2", "X3"], {"inserted": 3, "updated": 0, "skipped": 0})
+
+    refresh = [_abr("1", "Acme"), _abr("2", "Blue Sky Cafe", "20240201"), _abr("X3", "Non-numeric"), _abr("4", "New")]
+    assert _load_with_filter(refresh) == (["2", "4"], {"inserted": 1, "updated": 1, "skipped": 2})
+
+    # A row deleted from the ABR table is loaded again even though its fingerprint is unchanged
+    with SessionLocal() as session:
+        session.execute(delete(ABRRecord).where(ABRRecord.abn == "1"))
+        session.commit()
+    assert _load_with_filter(refresh)[0] == ["1"]
+
+    # Repeats within one run are only loaded once
+    change_filter = ABRChangeFilter()
+    assert len(change_filter.split([_abr("5", "Five"), _abr("5", "Five")])[0]) == 1
+
+
+def test_rows_are_counted_once_when_the_writer_re_runs_a_failed_group():
+    _reset(ABRRecord)
+    writer = get_writer()
+    started, release = threading.Event(), threading.Event()
+
+    def blocker(session):
+        started.set()
+        release.wait()
+
+    def broken(session):
+        raise ValueError("bad batch")
+
+    loaded = metrics.counter("rows_loaded_total", "Rows upserted into the database", table=ABRRecord.__tablename__)
+    before, retries = loaded.value, WRITE_RETRIES.value
+    first = writer.submit(blocker)
+    started.wait()
+    load = threading.Thread(target=load_abr_records, args=([_abr("1", "One"), _abr("2", "Two")],))
+    load.start()
+    while writer._queue.qsize() < 1:
+        time.sleep(0.001)
+    failing = writer.submit(broken)
+    release.set()
+    first.result()
+    load.join()
+    with pytest.raises(ValueError):
+        failing.result()
+
+    # The load ran in the failed group and again alone, but committed once
+    assert WRITE_RETRIES.value - retries == 2
+    assert loaded.value - before == 2
@@ -0,0 +1,139 @@
+import numpy as np
+from rapidfuzz import fuzz, process
+from sqlalchemy import text
+from bench.match_recall import matching_fixture
+from db.base import Base
+from db.conn import SessionLocal, engine
+from db.models import MatchedEntity
+from matcher.em import ABRIndex, MATCH_THRESHOLD, perform_string_matching
+
+ABR_ROWS = [
+    ("10000000001", "Acme Plumbing Pty Ltd", "acme plumbing", "NSW", "2000"),
+    ("10000000002", "Acme Plumbing Services", "acme plumbing services", "VIC", "3000"),
+    ("10000000003", "Blue Sky Cafe", "blue sky cafe", "QLD", "4000"),
+    ("10000000004", "Sky High Roofing", "sky high roofing", "NSW", "2000"),
+    ("10000000005", "Harbour Dental", "harbour dental", "NSW", "2060"),
+]
+
+CRAWL_NAMES = ["acme plumbing", "blue sky", "sky roofing", "harbour dental care", "unrelated name"]
+
+
+def _full_scan(name):
+    best_score, best_abn = 0, None
+    for abn, _, abr_norm, _, _ in ABR_ROWS:
+        score = fuzz.token_set_ratio(name, abr_norm)
+        if score > best_score:
+            best_score, best_abn = score, abn
+    return best_abn, best_score
+
+
+def test_blocking_index_matches_full_scan_above_threshold():
+    index = ABRIndex()
+    for row in ABR_ROWS:
+        index.add(*row[:3])
+
+    for name in CRAWL_NAMES:
+        expected_abn, expected_score = _full_scan(name)
+        best = index.best_match(name)
+        if expected_score >= MATCH_THRESHOLD:
+            assert best is not None
+            assert (best[0], best[2]) == (expected_abn, expected_score)
+        else:
+            assert best is None or best[2] < MATCH_THRESHOLD
+
+
+
+def test_blocking_index_agrees_with_a_brute_force_scan_on_a_sample():
+    abr, crawl = matching_fixture(abr_rows=1500, crawl_rows=300)
+    # No exact token in common with any ABR name, but within MATCH_THRESHOLD of one
+    crawl += ["acme. plumbing.", "zzqx"]
+    abr.append(("10000009999", "Acme Plumbing", "acme plumbing"))
+    index = ABRIndex()
+    for row in abr:
+        index.add(*row[:3])
+    names = [row[2] for row in abr]
+
+    for name in crawl:
+        scores = process.cdist([name], names, scorer=fuzz.token_set_ratio, dtype=np.float64)[0]
+        # argmax keeps the first best row, like the old `score > best_score` scan
+        first_best = int(np.argmax(scores))
+        expected = (abr[first_best][0], scores[first_best]) if scores[first_best] >= MATCH_THRESHOLD else None
+        best = index.best_match(name)
+        assert ((best[0], best[2]) if best and best[2] >= MATCH_THRESHOLD else None) == expected
+    assert index.best_match("acme. plumbing.")[0] == "10000009999"
+
+def _seed_preprocess_tables(session):
+    session.execute(text("DROP TABLE IF EXISTS abr_preprocess"))
+    session.execute(text("DROP TABLE IF EXISTS crawl_preprocess"))
+    session.execute(text(
+        "CREATE TABLE abr_preprocess (abn TEXT PRIMARY KEY, entity_name TEXT, normalized_name TEXT, "
+        "state TEXT, postcode TEXT, record_updated TEXT)"
+    ))
+    session.execute(text(
+        "CREATE TABLE crawl_preprocess (url TEXT PRIMARY KEY, company_name TEXT, normalized_name TEXT, "
+        "timestamp TEXT)"
+    ))
+    for abn, entity_name, norm, state, postcode in ABR_ROWS:
+        session.execute(
+            text("INSERT INTO abr_preprocess VALUES (:abn, :name, :norm, :state, :postcode, '20240101')"),
+            {"abn": abn, "name": entity_name, "norm": norm, "state": state, "postcode": postcode}
+        )
+    for i, name in enumerate(CRAWL_NAMES):
+        session.execute(
+            text("INSERT INTO crawl_preprocess VALUES (:url, :name, :norm, '20250101000000')"),
+            {"url": f"https://site{i}.com.au/", "name": name.title(), "norm": name}
+        )
+    session.commit()
+
+
+def _stored_matches(session):
+    return sorted(
+        (m.url, m.abn, m.similarity_score) for m in session.query(MatchedEntity).all()
+    )
+
+
+def test_sharded_matching_agrees_with_single_process():
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    _seed_preprocess_tables(session)
+
+    perform_string_matching(workers=1, full=True)
+    single = _stored_matches(session)
+
+    perform_string_matching(workers=3, full=True)
+    sharded = _stored_matches(session)
+    session.close()
+
+    assert single
+    assert sharded == single
+
+
+def test_incremental_matching_agrees_with_full_rematch():
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    _seed_preprocess_tables(session)
+    perform_string_matching(full=True)
+
+    # A crawl row changes, an ABR row loses its match, and a new ABR row beats an existing match
+    session.execute(text(
+        "UPDATE crawl_preprocess SET normalized_name = 'unrelated cafe', timestamp = '20250201000000' "
+        "WHERE url = 'https://site4.com.au/'"
+    ))
+    session.execute(text(
+        "UPDATE abr_preprocess SET normalized_name = 'harbour vet', record_updated = '20190101' "
+        "WHERE abn = '10000000005'"
+    ))
+    session.execute(text(
+        "INSERT INTO abr_preprocess VALUES ('10000000000', 'Sky Roofing', 'sky roofing', 'NSW', '2000', '20180101')"
+    ))
+    session.commit()
+
+    perform_string_matching()
+    incremental = _stored_matches(session)
+
+    perform_string_matching(full=True)
+    full = _stored_matches(session)
+    session.close()
+
+    assert incremental == full
+    assert ("https://site2.com.au/", "10000000000", 100.0) in full
@@ -0,0 +1,75 @@
+import json
+
+from pipeline import metrics
+from pipeline.metrics import Registry, ThroughputLog
+from pipeline.stages import Pipeline, Stage
+
+ITEMS = metrics.counter("test_worker_items_total", "Items seen by a test process stage")
+
+
+def _count_and_square(x):
+    ITEMS.inc()
+    return x * x
+
+
+def test_counters_and_histograms_export_as_json_and_prometheus(tmp_path):
+    registry = Registry()
+    registry.counter("rows_total", "Rows", table="abr").inc(3)
+    registry.counter("rows_total", "Rows", table="abr").inc()
+    timer = registry.timer("load_seconds", "Load time", buckets=(0.1, 1))
+    for seconds in (0.05, 0.5, 5):
+        timer.observe(seconds)
+
+    assert registry.counter_values() == {'rows_total{table="abr"}': 4}
+
+    registry.write(tmp_path / "run.prom")
+    prom = (tmp_path / "run.prom").read_text().splitlines()
+    assert "# TYPE firmable_rows_total counter" in prom
+    assert 'firmable_rows_total{table="abr"} 4' in prom
+    assert 'firmable_load_seconds_bucket{le="1"} 2' in prom
+    assert 'firmable_load_seconds_bucket{le="+Inf"} 3' in prom
+    assert "firmable_load_seconds_count 3" in prom
+
+    registry.write(tmp_path / "run.json")
+    report = {m["name"]: m for m in json.loads((tmp_path / "run.json").read_text())["metrics"]}
+    assert report["rows_total"]["value"] == 4
+    assert report["load_seconds"]["buckets"] == {"0.1": 1, "1": 2, "+Inf": 3}
+
+
+def test_collect_and_merge_carry_metrics_between_registries():
+    worker, parent = Registry(), Registry()
+    worker.counter("pages_total").inc(5)
+    worker.timer("parse_seconds").observe(0.2)
+    worker.counter("idle_total")
+    parent.counter("pages_total").inc(1)
+
+    parent.merge(worker.collect())
+    assert parent.counter("pages_total").value == 6
+    assert parent.timer("parse_seconds").count == 1
+    # collect() zeroes what it hands over and skips untouched metrics
+    assert worker.counter("pages_total").value == 0
+    assert ("idle_total", ()) not in parent._metrics
+
+
+def test_process_stage_metrics_are_merged_into_the_parent():
+    before = ITEMS.value
+    results = []
+    Pipeline(range(10), [
+        Stage("square", _count_and_square, workers=2, processes=True),
+        Stage("collect", results.append),
+    ], name="metrics test").run()
+
+    assert sorted(results) == [x * x for x in range(10)]
+    assert ITEMS.value - before == 10
+    assert metrics.counter("stage_items_out_total", pipeline="metrics test", stage="square").value == 10
+    assert metrics.timer("stage_seconds", pipeline="metrics test", stage="square").count == 10
+
+
+def test_throughput_log_prints_counters_that_moved(capsys):
+    registry = Registry()
+    log = ThroughputLog(registry, interval=60).start()
+    registry.counter("fetched_total").inc(7)
+    registry.counter("unchanged_total")
+    log.stop()
+    out = capsys.readouterr().out
+    assert "fetched_total 7 (+7" in out and "unchanged_total" not in out
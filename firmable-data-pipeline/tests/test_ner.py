@@ -0,0 +1,45 @@
+import subprocess
+import sys
+
+import spacy
+
+import extract.ner as ner
+from extract.ner import NERStage
+
+
+def org_pipeline():
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "ORG", "pattern": "Acme Plumbing"}])
+    return nlp
+
+
+def test_extractor_import_does_not_load_spacy():
+    code = "import sys, extract.common_crawl_extractor, extract.ner as ner; print(ner._nlp is None, 'spacy' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ["True", "False"]
+
+
+def test_ner_stage_resolves_deferred_pages_in_batches(monkeypatch):
+    nlp = org_pipeline()
+    calls = []
+    original_pipe = nlp.pipe
+
+    def pipe(texts, **kwargs):
+        texts = list(texts)
+        calls.append(texts)
+        return original_pipe(texts, **kwargs)
+
+    monkeypatch.setattr(nlp, "pipe", pipe)
+    monkeypatch.setattr(ner, "_nlp", nlp)
+
+    stage = NERStage(batch_size=2, text_cap=40)
+    stage.defer({"url": "a"}, "Call Acme Plumbing today")
+    assert not stage.full()
+    stage.defer({"url": "b"}, "No company here " + "x" * 100 + " Acme Plumbing")
+    assert stage.full()
+
+    records = stage.flush()
+    assert [r["company_name"] for r in records] == ["Acme Plumbing", None]
+    assert len(calls) == 1 and all(len(text) <= 40 for text in calls[0])
+    assert stage.flush() == []
@@ -0,0 +1,45 @@
+import pytest
+
+from extract.common_crawl_extractor import parse_company_record
+from db.page_text import pack_text, unpack_text
+from extract.warc_fetcher import MemberReader
+from tests.conftest import build_warc
+
+BODY = "Harbour Dental cares for smiles. " * 200
+# soup.get_text() of the page below
+TEXT = "Harbour Dental" + BODY
+
+
+@pytest.mark.parametrize("retention, expected", [
+    ("none", None), ("truncated", TEXT[:100]), ("compressed", TEXT),
+], ids=["none", "truncated", "compressed"])
+def test_page_text_is_kept_as_retention_says(retention, expected):
+    html = f"<html><head><title>Harbour Dental</title></head><body>{BODY}</body></html>".encode()
+    warc, entries = build_warc([("https://harbour.com.au/", html)])
+    entry = entries[0]
+    member = memoryview(warc)[entry["offset"]:entry["offset"] + entry["length"]]
+
+    record, ner_text = parse_company_record(entry, MemberReader(member), retention, text_max_chars=100)
+
+    assert record["company_name"] == "Harbour Dental" and ner_text is None
+    assert unpack_text(record["page_text"]) == expected
+    if retention == "compressed":
+        assert record["text_chars"] == len(TEXT) and len(record["page_text"]) < len(TEXT) // 10
+
+
+def test_page_text_is_not_extracted_by_default():
+    html = f"<html><head><title>Harbour Dental</title></head><body>{BODY}</body></html>".encode()
+    warc, entries = build_warc([("https://harbour.com.au/", html)])
+    entry = entries[0]
+    member = memoryview(warc)[entry["offset"]:entry["offset"] + entry["length"]]
+
+    record, _ = parse_company_record(entry, MemberReader(member))
+
+    # The <head> names the company, so no body text was extracted
+    assert record["company_name"] == "Harbour Dental"
+    assert record["page_text"] is None and record["text_chars"] is None
+
+
+def test_pack_text_rejects_unknown_modes():
+    with pytest.raises(ValueError):
+        pack_text("text", "gzip")
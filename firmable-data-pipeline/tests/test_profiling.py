@@ -0,0 +1,51 @@
+import os
+import pstats
+
+from pipeline import profiling
+from pipeline.stages import Pipeline, Stage
+
+
+def _allocate(n):
+    return [str(i) * 10 for i in range(n * 10)]
+
+
+def _stats_functions(path):
+    return {name for _, _, name in pstats.Stats(str(path)).stats}
+
+
+def test_sampled_stage_calls_are_profiled_per_stage_and_thread(tmp_path):
+    kept = []
+    profiling.enable(tmp_path, sample=0.25)
+    try:
+        Pipeline(range(20), [
+            Stage("allocate", _allocate),
+            Stage("keep", kept.append),
+        ], name="profile test").run()
+        written = {(p.stage, p.thread): p for p in profiling._profiler.write()}
+    finally:
+        profiling.disable()
+
+    allocate = written["profile test/allocate", "profile test-allocate-0"]
+    assert (allocate.calls, allocate.profiled + allocate.skipped) == (20, 5)
+    assert "_allocate" in _stats_functions(tmp_path / f"profile_test_allocate.profile_test-allocate-0.{os.getpid()}.prof")
+    # The kept lists are still referenced, so their allocations show as retained
+    report = next(tmp_path.glob("profile_test_allocate.*.alloc.txt")).read_text()
+    line = f"test_profiling.py:{_allocate.__code__.co_firstlineno + 1}"
+    assert f"{allocate.profiled} of 20 calls profiled" in report and line in report.splitlines()[2]
+    assert ("profile test/source", "profile test-source") in written
+    # Disabled again: stages run unprofiled
+    assert profiling.stage("anything").__class__.__name__ == "nullcontext"
+
+
+def test_process_stage_workers_write_their_own_profiles(tmp_path):
+    profiling.enable(tmp_path, sample=1, memory=False)
+    try:
+        Pipeline(range(6), [Stage("allocate", _allocate, workers=2, processes=True)], name="forked").run()
+    finally:
+        profiling.disable()
+
+    profiles = list(tmp_path.glob("forked_allocate.*.prof"))
+    assert profiles and all("_allocate" in _stats_functions(path) for path in profiles)
+    calls = sum(int(path.with_suffix(".alloc.txt").read_text().split(": ")[1].split(" of")[0]) for path in profiles)
+    # Rewritten after the first call only, then once more as each worker exits
+    assert calls == 6
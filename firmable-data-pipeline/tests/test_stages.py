@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+from pipeline.stages import Pipeline, Stage
+
+
+def _square(x):
+    return x * x
+
+
+def test_pipeline_runs_items_through_every_stage():
+    results = []
+    lock = threading.Lock()
+
+    def collect(batch):
+        with lock:
+            results.append(batch)
+
+    pipeline = Pipeline(range(100), [
+        Stage("square", _square, workers=4),
+        Stage("pairs", lambda batch: [batch, batch], batch_size=10, flatten=True),
+        Stage("collect", collect, batch_size=3),
+    ])
+    pipeline.run()
+
+    assert sorted(x for group in results for batch in group for x in batch) == sorted([x * x for x in range(100)] * 2)
+    assert all(len(group) <= 3 for group in results)
+    assert [s.items_in for s in pipeline.stages] == [100, 100, 20]
+
+
+def test_slow_stage_holds_back_the_source():
+    produced = []
+
+    def source():
+        for i in range(1000):
+            produced.append(i)
+            yield i
+
+    release = threading.Event()
+    seen = []
+
+    def slow(item):
+        release.wait()
+        seen.append(item)
+
+    pipeline = Pipeline(source(), [Stage("slow", slow, queue_size=5)])
+    runner = threading.Thread(target=pipeline.run)
+    runner.start()
+    time.sleep(0.3)
+    # One item in the stage, five queued, one blocked on put
+    assert len(produced) <= 7
+    release.set()
+    runner.join()
+    assert len(seen) == 1000
+
+
+def test_stage_error_stops_pipeline_and_closes_source():
+    closed = threading.Event()
+
+    def source():
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+        finally:
+            closed.set()
+
+    def explode(item):
+        if item == 50:
+            raise ValueError("bad item")
+        return item
+
+    with pytest.raises(ValueError, match="bad item"):
+        Pipeline(source(), [Stage("explode", explode, workers=2), Stage("sink", lambda x: None)]).run()
+    assert closed.is_set()
+
+
+def test_process_stage():
+    results = []
+    Pipeline(range(20), [
+        Stage("square", _square, workers=2, processes=True),
+        Stage("collect", results.append),
+    ]).run()
+    assert sorted(results) == [x * x for x in range(20)]
@@ -0,0 +1,60 @@
+import numpy as np
+
+from bench.match_recall import matching_fixture, recall_report
+from db.base import Base
+from db.conn import SessionLocal, engine
+from matcher.em import perform_string_matching
+from matcher.tfidf import TfidfIndex, char_ngrams
+from tests.test_matcher import ABR_ROWS, CRAWL_NAMES, _seed_preprocess_tables, _stored_matches
+
+
+def _index(**kwargs):
+    index = TfidfIndex(**kwargs)
+    for row in ABR_ROWS:
+        index.add(*row[:3])
+    index.finish()
+    return index
+
+
+def test_top_k_cosine_candidates():
+    assert char_ngrams("acme co") == [" ac", "acm", "cme", "me ", " co", "co "]
+
+    row_ids, cosines = _index(top_k=2).top_k_candidates(["acme plumbing"])[0]
+    assert list(row_ids) == [0, 1]
+    assert np.isclose(cosines[0], 1) and cosines[1] < cosines[0]
+
+    # Names sharing no n-gram with any ABR name have no candidates
+    assert len(_index().top_k_candidates(["zzzz"])[0][0]) == 0
+
+
+def test_bounded_blocks_give_the_same_candidates():
+    names = CRAWL_NAMES + ["", "acme"]
+    whole = _index().top_k_candidates(names)
+    # One crawl name per block, one posting expanded at a time
+    bounded = _index(block_cells=1, chunk_products=1).top_k_candidates(names)
+    for (ids, cosines), (bounded_ids, bounded_cosines) in zip(whole, bounded):
+        assert list(ids) == list(bounded_ids)
+        assert np.allclose(cosines, bounded_cosines)
+
+
+def test_recall_against_fuzzy_engine():
+    abr, crawl = matching_fixture(abr_rows=2000, crawl_rows=300)
+    report = recall_report(abr, crawl)
+    assert report["fuzzy"]["matches"] > 150
+    assert report["tfidf"]["recall"] >= 0.95
+    # Re-scored candidates are held to the same threshold, so nothing is matched that fuzzy would reject
+    assert report["tfidf"]["extra_matches"] == 0
+
+
+def test_tfidf_engine_matching_agrees_with_fuzzy_on_fixture():
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    _seed_preprocess_tables(session)
+
+    perform_string_matching(full=True)
+    fuzzy = _stored_matches(session)
+    perform_string_matching(full=True, engine="tfidf", workers=2)
+    tfidf = _stored_matches(session)
+    session.close()
+
+    assert fuzzy and tfidf == fuzzy
@@ -0,0 +1,77 @@
+from io import BytesIO
+
+from warcio.archiveiterator import ArchiveIterator
+
+from extract.warc_fetcher import MemberReader, WarcFetcher, plan_ranges, split_range
+from tests.conftest import build_warc
+
+PAGES = [(f"https://site{i}.com.au/", f"<html><title>Site {i}</title></html>".encode()) for i in range(20)]
+
+
+def _range(base_url):
+    return lambda e: (f"{base_url}test.warc.gz", e["offset"], e["offset"] + e["length"] - 1)
+
+
+def test_fetch_all_returns_every_fragment_over_pooled_connections(range_server):
+    warc, entries = build_warc(PAGES)
+    range_server.files["test.warc.gz"] = warc
+    range_server.latency = 0.01
+    fetcher = WarcFetcher(max_concurrency=8, per_host_concurrency=4, backoff=0)
+
+    results = list(fetcher.fetch_all(entries, _range(range_server.base_url)))
+    fetcher.close()
+
+    assert len(results) == len(entries)
+    for entry, body, error in results:
+        assert error is None
+        record = next(ArchiveIterator(BytesIO(body)))
+        assert record.rec_headers.get_header("WARC-Target-URI") == entry["url"]
+
+    peers = {peer for peer, _, _ in range_server.requests}
+    assert len(peers) <= 4 < len(range_server.requests)
+    assert range_server.peak_active <= 4
+
+
+def test_fetch_range_retries_on_503(range_server):
+    range_server.files["test.warc.gz"] = b"0123456789"
+    range_server.fail_next = 2
+    fetcher = WarcFetcher(max_retries=3, backoff=0)
+
+    assert fetcher.fetch_range(f"{range_server.base_url}test.warc.gz", 2, 5) == b"2345"
+    assert len(range_server.requests) == 3
+
+
+def test_plan_ranges_coalesces_nearby_fragments():
+    entries = [
+        {"warc_path": "a", "offset": 1000, "length": 100},
+        {"warc_path": "a", "offset": 0, "length": 100},
+        {"warc_path": "a", "offset": 150, "length": 50},
+        {"warc_path": "a", "offset": 5000, "length": 10},
+    ]
+
+    plans = plan_ranges(entries, max_gap=100)
+
+    assert [(p["start"], p["end"], [e["offset"] for e in p["entries"]]) for p in plans] == [
+        (0, 199, [0, 150]),
+        (1000, 1099, [1000]),
+        (5000, 5009, [5000]),
+    ]
+
+
+def test_coalesced_fetch_splits_back_into_warc_members(range_server):
+    warc, entries = build_warc(PAGES)
+    range_server.files["test.warc.gz"] = warc
+    plans = plan_ranges(entries, max_gap=0)
+    fetcher = WarcFetcher(backoff=0)
+
+    parsed = []
+    for plan, body, error in fetcher.fetch_all(plans, lambda p: (f"{range_server.base_url}test.warc.gz", p["start"], p["end"])):
+        assert error is None
+        for entry, member in split_range(plan, body):
+            record = next(ArchiveIterator(MemberReader(member)))
+            parsed.append((entry["url"], record.rec_headers.get_header("WARC-Target-URI")))
+    fetcher.close()
+
+    assert len(plans) == 1
+    assert len(range_server.requests) == 1
+    assert sorted(parsed) == sorted((e["url"], e["url"]) for e in entries)